@@ -48,6 +48,7 @@ from . import _data           as data        ; data._settings    = settings
 from . import _dialogs        as dialogs     ; dialogs._settings = settings
 from . import _pylab_tweaks   as tweaks      ; tweaks._settings  = settings
 from . import _functions      as fun         ; fun._settings     = settings
+from . import _models         as models
 
 plot.tweaks._pylab_colormap._settings = settings
 
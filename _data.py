@@ -10,9 +10,13 @@ import pylab          as _p
 import textwrap       as _textwrap
 import spinmob        as _s
 import time           as _time
+import hashlib        as _hashlib
+import collections    as _collections
+import operator       as _operator
 
 # Things that belong here too
 from . import _functions
+from . import _models
 averager = _functions.averager
 
 
@@ -1454,10 +1458,356 @@ class databox:
 
 
 
+###########################################
+# Compiled string functions for fitting
+###########################################
+
+# Python equivalents of ufuncs, for folding constants exactly
+_python_ops = {_n.add:_operator.add, _n.subtract:_operator.sub, _n.multiply:_operator.mul,
+               _n.true_divide:_operator.truediv, _n.power:_operator.pow, 
+               _n.negative:_operator.neg, _n.square:lambda v: v*v}
+
+class _compiled_function():
+    """
+    Fast, drop-in replacement for eval('lambda x, a, b: expression', globals)
+    used by the fitter.
+    
+    The expression is parsed once into a short program of numpy ufunc calls:
+    identical subexpressions are computed only once, anything not depending 
+    on x (parameters, constants, and combinations thereof) is computed once 
+    per call as a scalar, and numeric globals (e.g., pi or fit constants) are 
+    folded in at compile time. The program is then run on cache-sized chunks
+    of x, writing each intermediate result in place into a small set of 
+    reused buffers, rather than allocating a full-size temporary array for
+    every operation.
+    
+    Expressions that use anything else (e.g., non-ufunc functions like 
+    max(), attribute access, or user-defined functions) are evaluated with
+    the plain lambda, as are calls with anything other than a 1D float x 
+    array and scalar parameters. Since the program has some overhead per 
+    call, x arrays with fewer than min_size points (where the lambda is 
+    faster) are also evaluated with the lambda.
+    
+    Parameters
+    ----------
+    expression
+        String function, e.g., 'a*exp(-(x-b)**2/c**2)+d'.
+    argnames
+        List of argument names, e.g., ['x','a','b','c','d']. The first is 
+        the independent variable.
+    globals
+        Dictionary of globals used to interpret the other names.
+    """
+    
+    # Number of array elements per chunk (2**15 doubles = 256 kB per buffer)
+    chunk_size = 2**15
+    
+    # Smallest x array for which the program is used. Below roughly 2*10**5
+    # points, the lambda is faster (0.2-0.9x at 10**3-10**5 points).
+    min_size = 2**18
+    
+    # Binary operators
+    _binary_ops = {'Add':_n.add, 'Sub':_n.subtract, 'Mult':_n.multiply, 
+                   'Div':_n.true_divide, 'Pow':_n.power}
+    
+    def __init__(self, expression, argnames, globals):
+        self.expression = expression
+        self.__name__   = expression
+        self._argnames  = list(argnames)
+        self._lambda    = eval('lambda ' + ', '.join(argnames) + ': ' + expression, globals)
+        
+        # Per-thread buffers
+        import threading
+        self._local = threading.local()
+        
+        # Try to compile; otherwise just use the lambda.
+        try:    self._compile(globals)
+        except: self._program = None
+    
+    def __repr__(self):
+        if self._program is None: return '<_compiled_function (lambda): '+self.expression+'>'
+        return '<_compiled_function ('+str(len(self._program))+' array operations, '+str(self._buffers)+' buffers): '+self.expression+'>'
+    
+    def is_compiled(self):
+        """
+        Returns True if the expression was compiled (False means the plain 
+        lambda is used).
+        """
+        return self._program is not None
+    
+    def _compile(self, globals):
+        """
+        Parses the expression into self._scalars (scalar program) and 
+        self._program (array program), with buffer assignments.
+        """
+        import ast as _ast
+        
+        tree = _ast.parse(self.expression.strip(), mode='eval').body
+        
+        # Values are referenced by tuples:
+        #   ('x',)           the x array
+        #   ('p', i)         parameter i
+        #   ('c', value)     constant
+        #   ('s', i)         scalar intermediate i
+        #   ('a', i)         array intermediate i
+        scalars = [] # list of (ufunc, operand refs)
+        arrays  = [] # list of (ufunc, operand refs)
+        memo    = dict()
+        
+        def constant(value):
+            
+            # Python ints too big for int64 would become object arrays 
+            if isinstance(value, int) and abs(value) >= 2**63: value = float(value)
+            return ('c', value)
+        
+        def emit(ufunc, operands):
+            
+            # Fold constants with python arithmetic, as the lambda would
+            # (numpy integer ufuncs silently overflow, e.g., 10**20)
+            if all([o[0] == 'c' for o in operands]):
+                values = [o[1] for o in operands]
+                if ufunc in _python_ops: return constant(_python_ops[ufunc](*values))
+                return constant(ufunc(*[float(v) for v in values]))
+            
+            # Common subexpressions
+            key = (ufunc, tuple(operands))
+            if key in memo: return memo[key]
+            
+            # Array or scalar operation
+            if any([o[0] in ['x', 'a'] for o in operands]):
+                arrays.append((ufunc, operands))
+                ref = ('a', len(arrays)-1)
+            else:
+                scalars.append((ufunc, operands))
+                ref = ('s', len(scalars)-1)
+            
+            memo[key] = ref
+            return ref
+        
+        def visit(node):
+            name = type(node).__name__
+            
+            if name in ['Constant', 'Num']:
+                value = node.n if name == 'Num' else node.value
+                if not _s.fun.is_a_number(value) or isinstance(value, (bool, str)): raise ValueError
+                return constant(value)
+            
+            elif name == 'Name':
+                if node.id == self._argnames[0]:   return ('x',)
+                if node.id in self._argnames:      return ('p', self._argnames.index(node.id)-1)
+                value = globals[node.id]
+                if isinstance(value, (int, float)) and not isinstance(value, bool): return constant(value)
+                if isinstance(value, _n.number): return constant(value.item())
+                raise ValueError
+            
+            elif name == 'BinOp':
+                op    = type(node.op).__name__
+                left  = visit(node.left)
+                right = visit(node.right)
+                
+                # Cheaper special powers
+                if op == 'Pow' and right[0] == 'c':
+                    if right[1] == 2:   return emit(_n.square, [left])
+                    if right[1] == 0.5: return emit(_n.sqrt,   [left])
+                    if right[1] == 1:   return left
+                
+                return emit(self._binary_ops[op], [left, right])
+            
+            elif name == 'UnaryOp':
+                op = type(node.op).__name__
+                if op == 'UAdd': return visit(node.operand)
+                if op == 'USub': return emit(_n.negative, [visit(node.operand)])
+                raise ValueError
+            
+            elif name == 'Call':
+                if node.keywords or not type(node.func).__name__ == 'Name': raise ValueError
+                ufunc = globals[node.func.id]
+                if not isinstance(ufunc, _n.ufunc) or not ufunc.nin == len(node.args) or not ufunc.nout == 1: 
+                    raise ValueError
+                return emit(ufunc, [visit(a) for a in node.args])
+            
+            raise ValueError
+        
+        result = visit(tree)
+        
+        # Nothing to gain if the result is not an array computed by ufuncs
+        if not result[0] == 'a': raise ValueError
+        
+        # Assign buffers: reuse a buffer as soon as its value is no longer 
+        # needed (writing in place over an operand that dies here).
+        last_use = dict()
+        for i in range(len(arrays)):
+            for o in arrays[i][1]: 
+                if o[0] == 'a': last_use[o[1]] = i
+        
+        free    = []
+        buffers = dict() # array intermediate -> buffer index
+        nbuffers = 0
+        program = []
+        for i in range(len(arrays)):
+            ufunc, operands = arrays[i]
+            
+            # Release buffers whose last use is this operation
+            for o in operands:
+                if o[0] == 'a' and last_use[o[1]] == i and not buffers[o[1]] in free: 
+                    free.append(buffers[o[1]])
+            
+            # Get a buffer for the output
+            if len(free): buffers[i] = free.pop()
+            else:         
+                buffers[i] = nbuffers
+                nbuffers  += 1
+            
+            program.append((ufunc, operands, buffers[i]))
+        
+        self._scalars = scalars
+        self._program = program
+        self._result  = buffers[result[1]]
+        self._buffers = nbuffers
+    
+    def __call__(self, *args):
+        
+        # Fast path for the usual fit situation on large arrays
+        x = args[0]
+        if self._program is None or not isinstance(x, _n.ndarray) or not x.ndim == 1 or len(x) < self.min_size \
+        or not x.dtype.kind == 'f' or not all([_n.ndim(p) == 0 for p in args[1:]]):
+            return self._lambda(*args)
+        
+        # Evaluate the scalar program once
+        scalars = []
+        for ufunc, operands in self._scalars:
+            scalars.append(ufunc(*[self._value(o, args, scalars) for o in operands]))
+        
+        # Output array with the type the lambda would produce
+        dtype = _n.result_type(x, *[s for s in args[1:]+tuple(scalars) if _n.ndim(s) == 0])
+        if not dtype.kind == 'f': dtype = x.dtype
+        y = _n.empty(len(x), dtype=dtype)
+        
+        # Get this thread's buffers
+        N = min(len(x), self.chunk_size)
+        key = (dtype, N)
+        if not getattr(self._local, 'key', None) == key:
+            self._local.key     = key
+            self._local.buffers = [_n.empty(N, dtype=dtype) for n in range(self._buffers)]
+        buffers = self._local.buffers
+        
+        # Resolve the operands: 0 = value, 1 = x chunk, 2 = buffer
+        program = []
+        for ufunc, operands, out in self._program:
+            resolved = []
+            for o in operands:
+                if   o[0] == 'x': resolved.append((1, None))
+                elif o[0] == 'a': resolved.append((2, self._program[o[1]][2]))
+                elif o[0] == 'p': resolved.append((0, args[o[1]+1]))
+                elif o[0] == 'c': resolved.append((0, o[1]))
+                else:             resolved.append((0, scalars[o[1]]))
+            program.append((ufunc, resolved, out))
+        
+        # Loop over chunks
+        for i in range(0, len(x), N):
+            j  = min(i+N, len(x))
+            xc = x[i:j]
+            bs = buffers if j-i == N else [b[0:j-i] for b in buffers]
+            for ufunc, operands, out in program:
+                ufunc(*[xc if k == 1 else bs[v] if k == 2 else v for k, v in operands], out=bs[out])
+            y[i:j] = bs[self._result]
+        
+        return y
+    
+    def _value(self, ref, args, scalars):
+        """
+        Returns the value of a scalar reference during evaluation.
+        """
+        if ref[0] == 'p': return args[ref[1]+1]
+        if ref[0] == 'c': return ref[1]
+        return scalars[ref[1]]
+    
+    def benchmark(self, x=None, p=None, repeat=20):
+        """
+        Times this function against the plain lambda, returning 
+        (lambda time, compiled time) per call in seconds.
+        
+        Parameters
+        ----------
+        x=None
+            Array of x-values to use. None means numpy.linspace(1,2,1e6).
+        p=None
+            List of parameter values. None means all 1.0.
+        repeat=20
+            Number of calls to average.
+        """
+        if x is None: x = _n.linspace(1,2,10**6)
+        if p is None: p = [1.0]*(len(self._argnames)-1)
+        args = (_n.asarray(x),) + tuple(p)
+        
+        times = []
+        for f in [self._lambda, self]:
+            f(*args)
+            t0 = _time.perf_counter()
+            for n in range(repeat): f(*args)
+            times.append((_time.perf_counter()-t0)/repeat)
+        return tuple(times)
+
+
+
+
 ###########################################
 # Class for fitting data
 ###########################################
 
+def _sum_of_squares(r, chunk_size=2**16):
+    """
+    Returns the sum of r**2, accumulated in float64 (chunk by chunk, to 
+    avoid a full-size float64 copy of lower-precision arrays).
+    """
+    r = _n.asarray(r)
+    if r.dtype == _n.float64 or len(r) <= chunk_size: 
+        r = r.astype(_n.float64, copy=False)
+        return _n.dot(r, r)
+    
+    total = 0.0
+    for i in range(0, len(r), chunk_size):
+        c = r[i:i+chunk_size].astype(_n.float64)
+        total += _n.dot(c, c)
+    return total
+
+def _hash_update(h, v):
+    """
+    Feeds v (arrays, lists, tuples, dictionaries, and anything with a 
+    repr()) into the hashlib object h.
+    """
+    if isinstance(v, _n.ndarray):
+        h.update(repr((v.dtype.str, v.shape)).encode())
+        h.update(_n.ascontiguousarray(v).view(_n.uint8))
+    elif isinstance(v, (list, tuple)):
+        h.update(('%s%d[' % (type(v).__name__, len(v))).encode())
+        for x in v: _hash_update(h, x)
+        h.update(b']')
+    elif isinstance(v, dict):
+        _hash_update(h, sorted(v.items(), key=repr))
+    else:
+        h.update(repr(v).encode())
+
+def _read_only(a):
+    """
+    Returns a read-only view of the array a (leaving a itself writeable), or
+    a unchanged if it is not an array (e.g., None).
+    """
+    if not isinstance(a, _n.ndarray): return a
+    a = a.view()
+    a.setflags(write=False)
+    return a
+
+def _function_args(xdata, p):
+    """
+    Returns the argument tuple (xdata, p0, p1, ...) for a fit function. For 
+    lower-precision data (e.g., float32), the parameters are passed as python
+    floats, which do not promote the arrays to float64.
+    """
+    if isinstance(xdata, _n.ndarray) and xdata.dtype.kind == 'f' and xdata.dtype.itemsize < 8:
+        return (xdata,) + tuple([float(v) for v in p])
+    return (xdata,) + tuple(p)
+
 class fitter():
     """
     Creates an object for fitting data to functions.
@@ -1481,8 +1831,46 @@ class fitter():
     ----------------
     silent = False
         Ignore warnings and non-crash errors (don't print anything).
+    solver = 'leastsq'
+        Which algorithm fit() uses. 'leastsq' is scipy.optimize.leastsq 
+        (dense Jacobian, no bounds). 'trf' and 'dogbox' are the bounded
+        trust-region methods of scipy.optimize.least_squares (see 
+        set_bounds()). 'sparse' determines which parameters each 
+        function actually uses and solves with least_squares ('trf')
+        using the resulting block-sparse Jacobian structure (see 
+        get_jacobian_sparsity()), which is much faster for global fits of 
+        many data sets sharing only a few parameters.
+    x_scale = 1.0
+        Characteristic scale of each parameter for the least_squares 
+        solvers: a number, a list (one per parameter), or 'jac' (see 
+        scipy.optimize.least_squares).
+    profile = False
+        Count model evaluations and residual calls, and time the data 
+        processing, model, solver, and plotting phases. See get_profile().
+    profile_trace = False
+        When profiling, also record chi^2 and the parameters at every 
+        residual call (i.e., a convergence trace).
     autoplot      = True     
         Automatically (re)plot when changing stuff?
+    plot_min_interval = 0
+        Minimum time (seconds) between automatic redraws. Automatic redraws
+        requested sooner are coalesced into one, drawn when the interval 
+        has elapsed (using a figure timer, if the backend has an event loop).
+    
+    Class Options
+    -------------
+    fitter.headless = False
+        Setting spinmob.data.fitter.headless = True disables automatic 
+        plotting for all fitters (e.g., in batch scripts or on servers 
+        without a display), regardless of their 'autoplot' setting. It can 
+        also be overridden for a single instance. Explicit calls to plot() 
+        still work.
+    fitter.compile_functions = True
+        Whether string functions are compiled into fast numpy programs (see
+        benchmark_functions()), rather than evaluated as plain lambdas. 
+        The programs are only used for data sets of at least 2**18 points
+        (smaller ones still use the lambdas, which are faster there). 
+        Takes effect at the next set_functions().
     
     Figure Options
     --------------
@@ -1504,6 +1892,12 @@ class fitter():
         Include the guess(es)?
     plot_guess_zoom = False,  
         Zoom to include guess(es)?
+    plot_incremental = True
+        If the figure still holds the same curves as the last plot, update
+        their data rather than clearing and redrawing the whole figure.
+    plot_max_points = None
+        If not None, data sets with more points than this are decimated 
+        (every n'th point) before drawing.
     style_data   = dict(marker='o', color='b', ls='')
         Style for data curve(s).
     style_fit    = dict(marker='',  color='r', ls='-')
@@ -1538,6 +1932,11 @@ class fitter():
     coarsen       = 1
         How much to coarsen the data, i.e., averaging each group of the 
         specified number of points into a single point (and propagating errors).
+    coarsen_mode  = 'linear'
+        How to coarsen. 'linear' groups every coarsen points. 'log' groups 
+        points into bins whose x-edges grow by a factor of coarsen (e.g., 
+        coarsen=1.05), which is ideal for log-spaced spectra; see 
+        spinmob.fun.coarsen_data(). Only positive x-values are kept.
 
     
     Typical workflow
@@ -1572,7 +1971,9 @@ class fitter():
     See the spinmob wiki on github, or use IPython's autocomplete to play around!
     """
     
-    figures = None
+    figures  = None
+    headless = False
+    compile_functions = True
 
     def __init__(self, **kwargs):
         
@@ -1585,19 +1986,30 @@ class fitter():
         self._set_xdata  = [] # definitions from which data is derived during fits
         self._set_ydata  = []
         self._set_eydata = []
-        #self._set_exdata = []
+        self._set_exdata = []
         self._set_data_globals = dict(_n.__dict__) # defaults to numpy + scipy special
         self._set_data_globals.update(_special.__dict__)
 
         self._xdata_massaged  = None
         self._ydata_massaged  = None
         self._eydata_massaged = None
+        self._exdata_massaged = None
         self._guessed_eydata  = False
-        #self._exdata_massaged = None
 
         self._settings = dict()   # dictionary containing all the fitter settings
     
         self.results = None  # full output from the fitter.
+        self._processed_data = dict() # cached output of get_processed_data()
+        self._fit_cache = _collections.OrderedDict() # fit results by input fingerprint (see fit())
+        self._odr_cache = (None, None, None) # (data digest, RealData, ifixx) for ODR fits
+        self._fit_hook = None # called with (p, residuals) during fits (see fit_async())
+        self._fit_job  = None # last fit_job from fit_async()
+        
+        # plotting state
+        self._plot_artists = dict() # artists from the last plot() for incremental updates
+        self._plot_time    = 0      # time of the last plot()
+        self._plot_pending = False  # whether an automatic redraw was postponed
+        self._plot_timer   = None   # timer for drawing postponed redraws
         
         # make sure all the awesome stuff from numpy is visible.
         self._globals  = dict(_n.__dict__)
@@ -1608,30 +2020,54 @@ class fitter():
         self._bgnames   = []
         self._pguess    = []
         self._constants = []
+        self._bounds    = dict() # (min, max) for each bounded parameter name
         
         # Silence warnings
         self._settings['silent'] = False
+        
+        # Instrumentation (see get_profile()), locked for multistart threads
+        import threading
+        self._settings['profile'] = False
+        self._profile_lock = threading.Lock()
+        self.reset_profile()
 
         # settings that don't require a re-fit
         self._safe_settings =list(['bg_names', 'fpoints', 'f_names', 'plot_all_data',
                                    'plot_bg', 'plot_errors', 'plot_guess', 'plot_guess_zoom', 'plot_fit',
-                                   'silent', 'style_bg', 'style_data', 'style_guess',
+                                   'fit_cache', 'plot_incremental', 'plot_max_points', 'plot_min_interval',
+                                   'profile', 'profile_trace', 'silent', 'style_bg', 'style_data', 'style_guess',
                                    'style_fit', 'subtract_bg', 'xscale', 'yscale',
                                    'xlabel', 'ylabel'])
 
+        # settings that determine the fit results, given the processed data.
+        # Profiling is a safe setting, but a profiled fit should really run.
+        self._fit_settings = list(['coarsen', 'coarsen_mode', 'xmin', 'xmax', 'ymin', 'ymax',
+                                   'scale_eydata', 'scale_exdata', 'solver', 'x_scale', 
+                                   'profile', 'profile_trace'])
+
         # settings that should not be lists in general (i.e. not one per data set)
-        self._single_settings = list(['autoplot', 'first_figure', 'silent'])
+        self._single_settings = list(['autoplot', 'first_figure', 'fit_cache', 'silent', 
+                                      'plot_incremental', 'plot_min_interval',
+                                      'profile', 'profile_trace', 'solver', 'x_scale'])
 
         # default settings
         self._initializing = True
         self.set(silent        = False,    # Ignore warnings
                  autoplot      = True,     # whether we always plot when changing stuff
+                 solver        = 'leastsq',# 'leastsq', 'trf', 'dogbox', or 'sparse' (block-sparse Jacobian)
+                 x_scale       = 1.0,      # parameter scales for the least_squares solvers
+                 fit_cache     = 16,       # number of fit results to remember for identical re-fits (0 disables)
+                 profile       = False,    # count evaluations and time the fit phases?
+                 profile_trace = False,    # also record chi^2 and parameters at each residual call?
                  plot_all_data = False,    # Plot all of the data even after trimming?
                  plot_fit      = True,     # include f in plots?
                  plot_bg       = True,     # include bg in plots?
                  plot_errors   = True,     # include the y error bars?
                  plot_guess    = True,     # include the guess?
                  plot_guess_zoom = False,  # zoom to include plot?
+                 plot_incremental  = True, # update existing curves rather than redrawing?
+                 plot_max_points   = None, # decimate data sets with more points than this
+                 plot_min_interval = 0,    # minimum time between automatic redraws (seconds)
                  subtract_bg   = False,    # subtract bg from plots?
                  first_figure  = 0,        # first figure number to use
                  fpoints       = 1000,     # number of points to use when plotting f
@@ -1646,6 +2082,7 @@ class fitter():
                  scale_eydata  = 1.0,      # by how much should we scale the eydata?
                  #scale_exdata  = 1.0,      # by how much should we scale the exdata?
                  coarsen       = 1,        # how much to coarsen the data
+                 coarsen_mode  = 'linear', # 'linear' or 'log' (coarsen is then the bin ratio)
 
                  # styles of plots
                  style_data   = dict(marker='o', color='b',   ls='', mec='b'),
@@ -1669,7 +2106,7 @@ class fitter():
         for k in list(kwargs.keys()): self[k] = kwargs[k]
         
         # Plot if we're supposed to.
-        if self['autoplot'] and not self._initializing: self.plot()
+        if not self._initializing: self._autoplot()
 
         return self
 
@@ -1753,7 +2190,10 @@ class fitter():
                         self.degrees_of_freedom())
         
         # Always print the guess parameters
-        for p in self._pnames: s = s + "  {:10s} = {:s}\n".format(p, str(self[p]))
+        for p in self._pnames: 
+            s = s + "  {:10s} = {:s}".format(p, str(self[p]))
+            if p in self._bounds: s = s + "  (bounds {:G}, {:G})".format(*self._bounds[p])
+            s = s + "\n"
 
 
 
@@ -1841,7 +2281,7 @@ class fitter():
     def _error(self, message): 
         raise BaseException(str(message))
 
-    def set_functions(self,  f='a*x*cos(b*x)+c', p='a=-0.2, b, c=3', c=None, bg=None, **kwargs):
+    def set_functions(self,  f='a*x*cos(b*x)+c', p=None, c=None, bg=None, **kwargs):
         """
         Sets the function(s) used to describe the data.
 
@@ -1849,8 +2289,9 @@ class fitter():
         ----------
         f=['a*x*cos(b*x)+c', 'a*x+c']  
             This can be a string function, a defined function
-            my_function(x,a,b), or a list of some combination
-            of these two types of objects. The length of such
+            my_function(x,a,b), a spinmob.models model (e.g.,
+            models.lorentzian+models.linear), or a list of some 
+            combination of these types of objects. The length of such
             a list must be equal to the number of data sets
             supplied to the fit routine.
         p='a=1.5, b'    
@@ -1859,6 +2300,9 @@ class fitter():
             not specified, 1.0 will be used.
             If a function object is supplied, it is assumed that
             this string lists the parameter names in order.
+            Models take their parameters by name. None means use
+            the parameters of the model(s) (see autoguess()), or, 
+            if there are none, 'a=-0.2, b, c=3'.
         c=None          
             Fit _constants; like p, but won't be allowed to float
             during the fit. This can also be None.
@@ -1879,10 +2323,23 @@ class fitter():
         
         # Update the globals
         self._globals.update(kwargs)
+        
+        # New functions (or globals): cached fit results no longer apply
+        self._fit_cache.clear()
 
         # store these for later
         self._f_raw  = f
         self._bg_raw = bg
+        
+        # Get the parameters from the models
+        if p is None:
+            ps = []
+            for m in (f if _s.fun.is_iterable(f) else [f]):
+                if isinstance(m, _models.model): 
+                    for s in m.get_pstring().split(', '): 
+                        if not s.split('=')[0] in [q.split('=')[0] for q in ps]: ps.append(s)
+            if len(ps): p = ', '.join(ps)
+            else:       p = 'a=-0.2, b, c=3'
 
         # break up the constant names and initial values.
         if c:
@@ -1916,7 +2373,7 @@ class fitter():
         # use the internal settings we just set to create the functions
         self._update_functions()
         
-        if self['autoplot']: self.plot()
+        self._autoplot()
         
         return self
 
@@ -1930,7 +2387,6 @@ class fitter():
         self.bg            = []
         self._fnames       = []
         self._bgnames      = []
-        self._odr_models   = [] # Like f, but different parameters, for use in ODR
 
 
         f  = self._f_raw
@@ -1941,13 +2397,6 @@ class fitter():
         if not _s.fun.is_iterable(bg): bg = [bg]
         while len(bg) < len(f): bg.append(None)
 
-        # get a comma-delimited string list of parameter names for the "normal" function
-        pstring = 'x, ' + ', '.join(self._pnames)
-        
-        # get the comma-delimited string for the ODR function
-        pstring_odr = 'x, '
-        for n in range(len(self._pnames)): pstring_odr = pstring_odr+'p['+str(n)+'], '
-
         # update the globals for the functions
         # the way this is done, we must redefine the functions
         # every time we change a constant
@@ -1959,12 +2408,13 @@ class fitter():
             # if f[n] is a string, define a function on the fly.
             if isinstance(f[n], str):
                 
-                # "Normal" least squares function (y-error bars only)
-                self.f.append( eval('lambda ' + pstring + ': ' + f[n],  self._globals))
+                self.f.append(self._make_function(f[n]))
                 self._fnames.append(f[n])
             
-                # "ODR" compatible function (for x-error bars), based on self.f
-                self._odr_models.append( _odr.Model(eval('lambda p,x: self.f[n]('+pstring_odr+')', dict(self=self, n=n))))
+            # Models take their parameters by name
+            elif isinstance(f[n], _models.model):
+                self.f.append(f[n].bind(self._pnames, dict(zip(self._cnames, self._constants))))
+                self._fnames.append(f[n].name)
             
             # Otherwise, just append it.
             else:
@@ -1973,7 +2423,7 @@ class fitter():
 
             # if bg[n] is a string, define a function on the fly.
             if isinstance(bg[n], str):
-                self.bg.append(eval('lambda ' + pstring + ': ' + bg[n], self._globals))
+                self.bg.append(self._make_function(bg[n]))
                 self._bgnames.append(bg[n])
             else:
                 self.bg.append(bg[n])
@@ -1987,7 +2437,48 @@ class fitter():
         self.clear_results()
 
 
-    def set_data(self, xdata=[1,2,3,4,5], ydata=[1.7,2,3,4,3], eydata=None, dtype=_n.float64, **kwargs):
+    def _make_function(self, expression):
+        """
+        Returns a function f(x, *pnames) evaluating the supplied string
+        expression with self._globals, compiled if self.compile_functions 
+        is True.
+        """
+        if self.compile_functions: 
+            return _compiled_function(expression, ['x']+self._pnames, self._globals)
+        return eval('lambda ' + ', '.join(['x']+self._pnames) + ': ' + expression, self._globals)
+
+    def benchmark_functions(self, repeat=20):
+        """
+        Times each compiled string function (and background function) 
+        against the plain lambda, using the processed xdata (or 10^6 points 
+        if there is no data) and the guess parameters. Prints the speedups
+        (unless 'silent') and returns a list of (lambda time, compiled time)
+        per call for each function in self.f + self.bg that is compiled.
+        
+        Parameters
+        ----------
+        repeat=20
+            Number of calls to average.
+        """
+        if len(self._set_xdata) and len(self._set_ydata): xs = self.get_processed_data()[0]
+        else:                                             xs = []
+        
+        results = []
+        for n in range(len(self.f)):
+            for name, f in [('f', self.f[n]), ('bg', self.bg[n])]:
+                if not isinstance(f, _compiled_function) or not f.is_compiled(): continue
+                
+                if n < len(xs): x = xs[n]
+                else:           x = None
+                
+                t = f.benchmark(x, self._pguess, repeat)
+                results.append(t)
+                if not self['silent']: 
+                    print(name+'['+str(n)+']: '+'{:.3G}x faster ({:.3G} s -> {:.3G} s per call)'.format(t[0]/t[1], t[0], t[1]))
+        
+        return results
+
+    def set_data(self, xdata=[1,2,3,4,5], ydata=[1.7,2,3,4,3], eydata=None, dtype=_n.float64, exdata=None, **kwargs):
         """
         This will handle the different types of supplied data and put everything
         in a standard format for processing.
@@ -2001,6 +2492,18 @@ class fitter():
             / numbers matching the dimensionality of xdata and ydata
         dtype=numpy.float64
             When converting the data to arrays, use this conversion function.
+            Using numpy.float32 halves the memory of very large data sets: 
+            the data, function evaluations, and residuals then stay float32, 
+            while chi^2 sums are accumulated in float64 and finite-difference
+            steps are chosen for float32 precision. Expect parameter values
+            to agree with float64 fits to a small fraction of their errors.
+        exdata=None
+            Optional error bars for xdata, in the same format as eydata (None
+            meaning no x-error). If any data set has x-errors, fit() uses 
+            orthogonal distance regression (scipy.odr), and the residuals 
+            and chi^2 include the x-error propagated through the function.
+            ODR fits do not support parameter bounds or solvers other than
+            'leastsq'.
 
         Notes
         -----
@@ -2037,6 +2540,34 @@ class fitter():
         Additional optional keyword arguments are added to the globals for 
         script evaluation.
         """
+        xdata, ydata, eydata, exdata = self._match_data_lists(xdata, ydata, eydata, exdata)
+        
+        # store the data, script, or whatever it is!
+        self._set_xdata  = xdata
+        self._set_ydata  = ydata
+        self._set_eydata = eydata
+        self._set_exdata = exdata
+        self._dtype = dtype
+        self._set_data_globals.update(kwargs)
+
+        # set the eyscale to 1 for each data set
+        self['scale_eydata'] = [1.0]*len(self._set_xdata)
+        #self['scale_exdata'] = [1.0]*len(self._set_xdata)
+        
+        # Update the settings so they match the number of data sets.
+        for k in self._settings.keys(): self[k] = self[k]
+        
+        # Plot if necessary
+        self._autoplot()
+        
+        return self
+
+    def _match_data_lists(self, xdata, ydata, eydata, exdata=None):
+        """
+        Puts the supplied xdata, ydata, eydata, and exdata into the standard format
+        used by set_data(): lists of matching length (one element per data 
+        set / function).
+        """
         # SET UP DATA SETS TO MATCH EACH OTHER AND NUMBER OF FUNCTIONS
         
         # At this stage:
@@ -2047,7 +2578,7 @@ class fitter():
         if type(xdata)  is str: xdata  = [xdata]
         if type(ydata)  is str: ydata  = [ydata]
         if type(eydata) is str or _s.fun.is_a_number(eydata) or eydata is None: eydata = [eydata]
-        #if type(exdata) is str or _s.fun.is_a_number(exdata) or exdata is None: exdata = [exdata]
+        if type(exdata) is str or _s.fun.is_a_number(exdata) or exdata is None: exdata = [exdata]
 
         # xdata and ydata   ['script'], [1,2,3], [[1,2,3],'script'], ['script', [1,2,3]]
         # eydata            ['script'], [1,1,1], [[1,1,1],'script'], ['script', [1,1,1]], [3], [3,[1,2,3]], [None]
@@ -2062,7 +2593,7 @@ class fitter():
         # if the first element of eydata is a number, this could also just be an error bar value
         # Note: there is some ambiguity here, if the number of data sets equals the number of data points!
         if _s.fun.is_a_number(eydata[0]) and len(eydata) == len(ydata[0]): eydata = [eydata]
-        #if _s.fun.is_a_number(exdata[0]) and len(exdata) == len(xdata[0]): exdata = [exdata]
+        if _s.fun.is_a_number(exdata[0]) and len(exdata) == len(xdata[0]): exdata = [exdata]
         
         # xdata and ydata   ['script'], [[1,2,3]], [[1,2,3],'script'], ['script', [1,2,3]]
         # eydata            ['script'], [[1,1,1]], [[1,1,1],'script'], ['script', [1,1,1]], [3], [3,[1,2,3]], [None]
@@ -2070,7 +2601,7 @@ class fitter():
         # Inflate the x, ex, and ey data sets to match the ydata sets
         while len(xdata)  < len(ydata): xdata .append( xdata[0])
         while len(ydata)  < len(xdata): ydata .append( ydata[0])
-        #while len(exdata) < len(xdata): exdata.append(exdata[0])
+        while len(exdata) < len(xdata): exdata.append(exdata[0])
         while len(eydata) < len(ydata): eydata.append(eydata[0])
 
 
@@ -2078,38 +2609,15 @@ class fitter():
         while len(ydata)  < len(self.f): ydata.append(ydata[0])
         while len(xdata)  < len(self.f): xdata.append(xdata[0])
         while len(eydata) < len(self.f): eydata.append(eydata[0])
-        #while len(exdata) < len(self.f): exdata.append(exdata[0])
+        while len(exdata) < len(self.f): exdata.append(exdata[0])
 
         # xdata and ydata   ['script','script'], [[1,2,3],[1,2,3]], [[1,2,3],'script'], ['script', [1,2,3]]
         # eydata            ['script','script'], [[1,1,1],[1,1,1]], [[1,1,1],'script'], ['script', [1,1,1]], [3,3], [3,[1,2,3]], [None,None]
 
-        # Clean up exdata. If any element isn't None, the other None elements need
-        # to be set to 0 so that ODR works.
-#        if not exdata.count(None) == len(exdata):
-#            # Search for and replace all None's with 0
-#            for n in range(len(exdata)):
-#                if exdata[n] == None: exdata[n] = 0
-#        
-        
-        # store the data, script, or whatever it is!
-        self._set_xdata  = xdata
-        self._set_ydata  = ydata
-        self._set_eydata = eydata
-        self._dtype = dtype
-        #self._set_exdata = exdata
-        self._set_data_globals.update(kwargs)
+        # Note exdata elements can stay None (x-values without error); these 
+        # are held fixed by ODR.
 
-        # set the eyscale to 1 for each data set
-        self['scale_eydata'] = [1.0]*len(self._set_xdata)
-        #self['scale_exdata'] = [1.0]*len(self._set_xdata)
-        
-        # Update the settings so they match the number of data sets.
-        for k in self._settings.keys(): self[k] = self[k]
-        
-        # Plot if necessary
-        if self['autoplot']: self.plot()
-        
-        return self
+        return xdata, ydata, eydata, exdata
 
     def evaluate_script(self, script, **kwargs):
         """
@@ -2129,13 +2637,16 @@ class fitter():
         self._set_data_globals.update(kwargs)
         return eval(script, self._set_data_globals)
 
-    def get_data(self):
+    def get_data(self, include_exdata=False):
         """
         Returns current xdata, ydata, eydata, after set_data() 
-        has been run.
+        has been run. If include_exdata is True, also returns exdata (a list 
+        whose elements are None for data sets without x-errors).
         """
         # make sure we've done a "set data" call
-        if len(self._set_xdata)==0 or len(self._set_ydata)==0: return [[],[],[]]
+        if len(self._set_xdata)==0 or len(self._set_ydata)==0: 
+            if include_exdata: return [[],[],[],[]]
+            return [[],[],[]]
 
         # update the globals with the current fit parameter guess values
         for n in range(len(self._pnames)): self._set_data_globals[self._pnames[n]] = self._pguess[n]
@@ -2154,14 +2665,14 @@ class fitter():
         xdata  = list(self._set_xdata)
         ydata  = list(self._set_ydata)
         eydata = list(self._set_eydata)
-        #exdata = list(self._set_exdata)
+        exdata = list(self._set_exdata)
 
         # make sure they're all lists of numpy arrays
         for n in range(len(xdata)):
 
             # For xdata, handle scripts or arrays
             if type(xdata[n]) is str: xdata[n] = self.evaluate_script(xdata[n], **self._set_data_globals)
-            else:                     xdata[n] = _n.array(xdata[n])*1.0
+            else:                     xdata[n] = _n.asarray(xdata[n], dtype=self._dtype)
 
         # update the globals
         self._set_data_globals['x'] = xdata
@@ -2171,7 +2682,7 @@ class fitter():
 
             # For ydata, handle scripts or arrays
             if type(ydata[n]) is str: ydata[n] = self.evaluate_script(ydata[n], **self._set_data_globals)
-            else:                     ydata[n] = _n.array(ydata[n])*1.0
+            else:                     ydata[n] = _n.asarray(ydata[n], dtype=self._dtype)
 
         # update the globals
         self._set_data_globals['y'] = ydata
@@ -2194,33 +2705,31 @@ class fitter():
                 eydata[n] = _n.ones(len(xdata[n])) * eydata[n]
 
             # make it an array
-            eydata[n] = _n.array(eydata[n]) * self["scale_eydata"][n]
-
-#        # make sure they're all lists of numpy arrays
-#        for n in range(len(exdata)):
-#
-#            # handle scripts
-#            if type(exdata[n]) is str:
-#                exdata[n] = self.evaluate_script(exdata[n], **self._set_data_globals)
-#
-#            # None is okay for exdata
-#
-#            # handle constant error bars (possibly returned by script)
-#            if _s.fun.is_a_number(exdata[n]):
-#                exdata[n] = _n.ones(len(xdata[n])) * exdata[n]
-#
-#            # make it an array
-#            if not exdata[n] == None:
-#                exdata[n] = _n.array(exdata[n]) * self["scale_exdata"][n]
+            eydata[n] = _n.asarray(eydata[n], dtype=self._dtype) * self["scale_eydata"][n]
+
+        # make sure they're all lists of numpy arrays
+        for n in range(len(exdata)):
+
+            # handle scripts
+            if type(exdata[n]) is str:
+                exdata[n] = self.evaluate_script(exdata[n], **self._set_data_globals)
+
+            # None is okay for exdata
+
+            # handle constant error bars (possibly returned by script)
+            if _s.fun.is_a_number(exdata[n]):
+                exdata[n] = _n.ones(len(xdata[n])) * exdata[n]
 
         # Make sure everything is a nice array of the right type.
         # Note we have to do this loop because not all sets are the same length.
         for n in range(len(xdata)):
-            xdata[n]  = _n.array(xdata[n],  dtype=self._dtype)
-            ydata[n]  = _n.array(ydata[n],  dtype=self._dtype)
-            eydata[n] = _n.array(eydata[n], dtype=self._dtype)
+            xdata[n]  = _n.asarray(xdata[n],  dtype=self._dtype)
+            ydata[n]  = _n.asarray(ydata[n],  dtype=self._dtype)
+            eydata[n] = _n.asarray(eydata[n], dtype=self._dtype)
+            if exdata[n] is not None: exdata[n] = _n.asarray(exdata[n], dtype=self._dtype)
         
         # Return it
+        if include_exdata: return xdata, ydata, eydata, exdata
         return xdata, ydata, eydata
 
 
@@ -2272,7 +2781,50 @@ class fitter():
         d['reduced_chi2s']      = self.reduced_chi_squareds()
         d['degrees_of_freedom'] = self.degrees_of_freedom()
         
+        # Instrumentation
+        if self['profile']: d['profile'] = self.get_profile()
+        
+        return d
+
+    def get_profile(self):
+        """
+        Returns a dictionary of the instrumentation collected while the 
+        'profile' setting is True (see also reset_profile()):
+        
+        model_evaluations, jacobian_evaluations, residual_calls, fits
+            Number of evaluations of the (individual) model functions and 
+            their Jacobians, calls to the residual function (e.g., by the
+            solver), and fits.
+        fit_cache_hits
+            Number of fit() calls answered from the fit cache (see fit()).
+        time_data, time_model, time_solver, time_plot
+            Cumulative time (seconds) spent processing data (including 
+            scripts, coarsening, and trimming), evaluating the model functions, 
+            inside the solver, and plotting. Phases are inclusive, e.g., 
+            time_solver includes the model evaluations done by the solver.
+        trace
+            If 'profile_trace' is True, a list of (chi2, parameters) for each
+            residual call.
+        """
+        d = dict(self._profile)
+        d['trace'] = list(self._profile['trace'])
         return d
+    
+    def reset_profile(self):
+        """
+        Zeros all the counters and timers reported by get_profile().
+        """
+        self._profile = dict(model_evaluations    = 0,
+                             jacobian_evaluations = 0,
+                             residual_calls       = 0,
+                             fits                 = 0,
+                             fit_cache_hits       = 0,
+                             time_data            = 0.0,
+                             time_model           = 0.0,
+                             time_solver          = 0.0,
+                             time_plot            = 0.0,
+                             trace                = [])
+        return self
 
     def get_pnames(self):
         """
@@ -2280,6 +2832,41 @@ class fitter():
         """
         return list(self._pnames)
     
+    def set_bounds(self, **kwargs):
+        """
+        Sets (min, max) bounds on fit parameters, e.g., 
+        set_bounds(a=(0,None), b=(-1,1)). None means unbounded on that side, 
+        and a=None removes the bounds on a. Bounds are used by the 'trf', 
+        'dogbox', and 'sparse' solvers (see the 'solver' setting), and as 
+        the default multistart sampling range. Bounds are kept by name, 
+        e.g., through fix() and free(). Fits to data with x error bars 
+        (ODR) do not support bounds.
+        """
+        for k in kwargs:
+            if not k in self._pnames: self._error("'"+k+"' is not a valid fit parameter name.")
+            
+            if kwargs[k] is None: 
+                self._bounds.pop(k, None)
+                continue
+            
+            lower, upper = kwargs[k]
+            if lower is None: lower = -_n.inf
+            if upper is None: upper =  _n.inf
+            if not lower < upper: self._error("Bounds for '"+k+"' must satisfy min < max.")
+            self._bounds[k] = (float(lower), float(upper))
+        
+        self.clear_results()
+        return self
+    
+    def get_bounds(self):
+        """
+        Returns arrays of lower and upper bounds (+/- inf meaning unbounded),
+        one element per parameter.
+        """
+        lower = _n.array([self._bounds.get(k, (-_n.inf, _n.inf))[0] for k in self._pnames])
+        upper = _n.array([self._bounds.get(k, (-_n.inf, _n.inf))[1] for k in self._pnames])
+        return lower, upper
+    
     def get_cnames(self):
         """
         Returns a list of constant names.
@@ -2298,15 +2885,41 @@ class fitter():
         # loop over the results and set the guess values
         for n in range(len(self._pguess)): self._pguess[n] = self.results[0][n]
 
-        if self['autoplot']: self.plot()
+        self._autoplot()
+
+        return self
 
+    def autoguess(self):
+        """
+        Sets the guess values of all parameters belonging to models (see
+        spinmob.models) using the models' guess heuristics on the processed
+        data. If several data sets share a parameter, the first one wins.
+        """
+        f = self._f_raw
+        if not _s.fun.is_iterable(f): f = [f]
+        
+        xs, ys = self.get_processed_data()[0:2]
+        done   = []
+        for n in range(min(len(f), len(xs))):
+            if isinstance(f[n], _models.model):
+                guess = f[n].guess(xs[n], ys[n])
+                for pname, value in zip(f[n].get_pnames(), guess):
+                    if pname in self._pnames and not pname in done:
+                        self._pguess[self._pnames.index(pname)] = value
+                        done.append(pname)
+        
+        # Same as setting the guess by hand
+        self.clear_results()
+        self._autoplot()
+        
         return self
 
-    def get_processed_data(self, do_coarsen=True, do_trim=True):
+    def get_processed_data(self, do_coarsen=True, do_trim=True, include_exdata=False):
         """
         This will coarsen and then trim the data sets according to settings.
         
-        Returns processed xdata, ydata, eydata.
+        Returns processed xdata, ydata, eydata (and exdata if include_exdata
+        is True).
         
         Parameters
         ----------
@@ -2314,18 +2927,34 @@ class fitter():
             Whether we should coarsen the data
         do_trim=True
             Whether we should trim the data
+        include_exdata=False
+            Whether to also return the x error bars (elements are None for 
+            data sets without x-errors).
         
         Settings
         --------
         xmin, xmax, ymin, ymax
             Limits on x and y data points for trimming.    
-        coarsen
-            Break the data set(s) into this many groups of points, and average
-            each group into one point, propagating errors.
-        """
-
+        coarsen, coarsen_mode
+            Average each group of coarsen points (coarsen_mode='linear') or the
+            points in each bin of x-ratio coarsen (coarsen_mode='log') into 
+            one point, propagating errors.
+        
+        The result is cached (as read-only arrays) until the settings, data, 
+        functions, or guess change, or the next fit() reprocesses the data. 
+        If you modify the arrays sent to set_data() in place, call 
+        clear_results() (or set_data() again) to update it before plotting.
+        """
+        # Use the cached result if nothing changed
+        key = self._processed_data_key(do_coarsen, do_trim)
+        if key in self._processed_data: 
+            if include_exdata: return [list(a) for a in self._processed_data[key]]
+            return [list(a) for a in self._processed_data[key][0:3]]
+
+        if self._settings['profile']: t0 = _time.perf_counter()
+        
         # get the data
-        xdatas, ydatas, eydatas = self.get_data()
+        xdatas, ydatas, eydatas, exdatas = self.get_data(include_exdata=True)
 
         # get the trim limits (trimits)
         xmins   = self['xmin']
@@ -2345,21 +2974,26 @@ class fitter():
         xdata_massaged  = []
         ydata_massaged  = []
         eydata_massaged = []
-        #exdata_massaged = []
+        exdata_massaged = []
         for n in range(len(xdatas)):
             
             x  = xdatas[n]
             y  = ydatas[n]
             ey = eydatas[n]
-            #ex = exdatas[n]
+            ex = exdatas[n]
             
             # coarsen the data
-            if do_coarsen:
-                x  =         _s.fun.coarsen_array(x,     self['coarsen'][n], 'mean')
-                y  =         _s.fun.coarsen_array(y,     self['coarsen'][n], 'mean')
-                ey = _n.sqrt(_s.fun.coarsen_array(ey**2, self['coarsen'][n], 'mean')/self['coarsen'][n])
-#                if not ex == None:
-#                    ex = _n.sqrt(_s.fun.coarsen_array(ex**2, self['coarsen'][n], 'mean')/self['coarsen'][n])
+            if do_coarsen and self['coarsen_mode'][n] == 'log':
+                if self['coarsen'][n] > 1: 
+                    if ex is None: x, y, ey     = _s.fun.coarsen_data(x, y, ey,     level=self['coarsen'][n], exponential=True)
+                    else:          x, y, ey, ex = _s.fun.coarsen_data(x, y, ey, ex, level=self['coarsen'][n], exponential=True)
+                
+            elif do_coarsen:
+                x  = _s.fun.coarsen_array(x,  self['coarsen'][n], 'mean')
+                y  = _s.fun.coarsen_array(y,  self['coarsen'][n], 'mean')
+                ey = _s.fun.coarsen_array(ey, self['coarsen'][n], 'quadrature')
+                if not ex is None:
+                    ex = _s.fun.coarsen_array(ex, self['coarsen'][n], 'quadrature')
             
             if do_trim:
                 # Create local mins and maxes
@@ -2375,9 +3009,9 @@ class fitter():
                 if ymax is None: ymax = max(y)
     
                 # trim the data
-                [xt, yt, eyt] = _s.fun.trim_data_uber([x, y, ey],
-                                                      [x>=xmin, x<=xmax,
-                                                       y>=ymin, y<=ymax])
+                [xt, yt, eyt, ext] = _s.fun.trim_data_uber([x, y, ey, ex],
+                                                           [x>=xmin, x<=xmax,
+                                                            y>=ymin, y<=ymax])
 
                 # Catch the over-trimmed case
                 if(len(xt)==0): 
@@ -2386,94 +3020,653 @@ class fitter():
                     x = xt
                     y = yt
                     ey = eyt
-                    #ex = ext
+                    ex = ext
             
-            # store the result
-            xdata_massaged.append(x)
-            ydata_massaged.append(y)
-            eydata_massaged.append(ey)
-            #exdata_massaged.append(ex)
-            
-        return xdata_massaged, ydata_massaged, eydata_massaged#, exdata_massaged
+            # store the result (as read-only views, since it is cached)
+            xdata_massaged.append(_read_only(x))
+            ydata_massaged.append(_read_only(y))
+            eydata_massaged.append(_read_only(ey))
+            exdata_massaged.append(_read_only(ex))
+        
+        if self._settings['profile']: self._profile['time_data'] += _time.perf_counter()-t0
+        
+        if len(self._processed_data) > 8: self._processed_data.clear()
+        self._processed_data[key] = (xdata_massaged, ydata_massaged, eydata_massaged, exdata_massaged)
+        
+        if include_exdata: return list(xdata_massaged), list(ydata_massaged), list(eydata_massaged), list(exdata_massaged)
+        return list(xdata_massaged), list(ydata_massaged), list(eydata_massaged)
+
+    def _processed_data_key(self, do_coarsen=True, do_trim=True):
+        """
+        Returns the key under which get_processed_data() caches its output.
+        """
+        return (do_coarsen, do_trim, tuple(self._pguess), tuple(self._constants))
 
     def _massage_data(self):
         """
         Processes the data and stores it.
         """
-        self._xdata_massaged, self._ydata_massaged, self._eydata_massaged = self.get_processed_data()
-        
-#        # Create the odr data.
-#        self._odr_datas = []
-#        for n in range(len(self._xdata_massaged)):
-#            # Only exdata can be None; make sure it's zeros at least.
-#            ex = self._exdata_massaged[n]
-#            if ex == None: ex = _n.zeros(len(self._eydata_massaged[n]))
-#            self._odr_datas.append(_odr.RealData(self._xdata_massaged[n],
-#                                                 self._ydata_massaged[n], 
-#                                                 sx=ex, 
-#                                                 sy=self._eydata_massaged[n]))
+        self._xdata_massaged, self._ydata_massaged, self._eydata_massaged, self._exdata_massaged = \
+            self.get_processed_data(include_exdata=True)
+        
+        # Create the (concatenated) ODR data, reused while the processed data
+        # are unchanged (even across fits, which reprocess the data)
+        if self._has_exdata():
+            digest = self._data_digest()
+            if not self._odr_cache[0] == digest:
+                x  = _n.concatenate(self._xdata_massaged)
+                ey = _n.concatenate(self._eydata_massaged)
+                ex = []
+                for n in range(len(self._xdata_massaged)):
+                    if self._exdata_massaged[n] is None: ex.append(_n.zeros(len(self._xdata_massaged[n])))
+                    else:                                ex.append(_n.absolute(self._exdata_massaged[n]))
+                ex = _n.concatenate(ex)
+                
+                # x-values without error are held fixed (and their sx ignored)
+                ifixx = (ex > 0).astype(int)
+                ex[ifixx == 0] = 1.0
+                
+                self._odr_cache = (digest, _odr.RealData(x, _n.concatenate(self._ydata_massaged), 
+                                                         sx=ex, sy=_n.absolute(ey)), ifixx)
+            self._odr_data, self._odr_ifixx = self._odr_cache[1:]
+        
         return self
+    
+    def _data_digest(self):
+        """
+        Returns a digest of the processed data, cached along with them (i.e.,
+        computed once per fit). Assumes _massage_data() has been called.
+        """
+        key = ('digest',) + self._processed_data_key()
+        if not key in self._processed_data:
+            h = _hashlib.sha1()
+            _hash_update(h, [self._xdata_massaged, self._ydata_massaged, 
+                             self._eydata_massaged, self._exdata_massaged])
+            self._processed_data[key] = h.digest()
+        return self._processed_data[key]
+    
+    def _has_exdata(self):
+        """
+        Returns True if any data set has x error bars.
+        """
+        for ex in self._set_exdata: 
+            if ex is not None: return True
+        return False
 
-    def fit(self, **kwargs):
+    def fit(self, multistart=0, bounds=None, sampler='latin', keep=4, workers=1, force=False, seed=None, **kwargs):
         """
         This will try to determine fit parameters using scipy.optimize.leastsq
-        algorithm. This function relies on a previous call of set_data() and 
+        algorithm (or least_squares; see the 'solver' setting). This function relies on a previous call of set_data() and 
         set_functions().
 
+        Parameters
+        ----------
+        multistart=0
+            If larger than 0, perform a global search: this many candidate
+            guesses are drawn from the parameter bounds, their chi^2 values are
+            evaluated in vectorized batches, and the best few are used as
+            starting points for local leastsq runs. The best result is kept.
+        bounds=None
+            Dictionary of (min, max) sampling ranges for multistart, e.g. 
+            bounds=dict(a=(-1,1), b=(0,10)). Unspecified parameters (or 
+            sides given as None, e.g., a=(None,5)) are sampled within their
+            (finite) set_bounds() bounds, or over guess +/- max(abs(guess), 1).
+        sampler='latin'
+            How to draw the multistart candidates. Can be 'latin' (Latin 
+            hypercube), 'sobol' (scrambled Sobol sequence, requires 
+            scipy >= 1.7), or 'random'.
+        keep=4
+            Number of best candidates (plus the current guess) from which to
+            launch local fits.
+        workers=1
+            Number of threads used for the local multistart fits (None lets
+            concurrent.futures decide). The solvers hold the GIL, so more
+            than one only helps if the fit functions release it for most
+            of their run time (e.g., numpy on large data sets).
+        force=False
+            If False, and the processed data, functions, guess, constants,
+            bounds, and fit settings (trimming, coarsening, solver, ...) are 
+            identical to those of one of the last self['fit_cache'] fits, the
+            results of that fit are reused rather than running the optimizer
+            again. Set force=True to re-fit regardless (e.g., if a callable 
+            fit function has changed its internal state), skipping the cache
+            entirely.
+        seed=None
+            Optional seed for the multistart sampler, for reproducible 
+            searches.
+
         Notes
         -----
         results of the fit algorithm are stored in self.results. 
-        See scipy.optimize.leastsq for more information.
+        See scipy.optimize.leastsq for more information. If any data set has
+        x error bars (see set_data()), the fit is done by orthogonal distance
+        regression (scipy.odr) instead. For multistart fits,
+        self.results[2]['nfev_total'] holds the total number of function
+        evaluations spent on the search.
 
         Optional keyword arguments are sent to self.set() prior to
         fitting. 
         """
+        self._prepare_fit(**kwargs)
+        self.results = self._fit_results(multistart, bounds, sampler, keep, workers, force, seed)
+
+        # plot if necessary
+        self._autoplot()
+
+        return self
+    
+    def _prepare_fit(self, **kwargs):
+        """
+        Checks that there are data and functions, sends the keyword arguments
+        to self.set(), and processes the data for fit() and fit_async().
+        """
         if len(self._set_xdata)==0 or len(self._set_ydata)==0:
             return self._error("No data. Please use set_data() prior to fitting.")
         if self._f_raw is None:
             return self._error("No functions. Please use set_functions() prior to fitting.")
 
-        # Do the processing once, to increase efficiency
-        self._massage_data()
-        
-        # Send the keyword arguments to the settings
+        # Send the keyword arguments to the settings (before processing, 
+        # since they may change the processed data)
         self.set(**kwargs)
+        
+        # Do the processing once, to increase efficiency. The data may have 
+        # been modified in place, so don't trust the cache from before.
+        self._processed_data.clear()
+        self._massage_data()
+        return self
+    
+    def _fit_results(self, multistart=0, bounds=None, sampler='latin', keep=4, workers=1, force=False, seed=None):
+        """
+        Runs the optimization for fit() and fit_async() (see fit() for the
+        arguments), or takes the results of an identical fit from the fit
+        cache, and returns them. Assumes _prepare_fit() has been called.
+        """
+        # Reuse the results of an identical fit if we can
+        key = None
+        if self['fit_cache'] and not force: 
+            key = self._fit_fingerprint(multistart, bounds, sampler, keep, seed)
+            if key in self._fit_cache:
+                self._fit_cache.move_to_end(key)
+                while len(self._fit_cache) > self['fit_cache']: self._fit_cache.popitem(last=False)
+                if self['profile']: self._profile['fit_cache_hits'] += 1
+                return self._fit_cache[key]
 
         # do the actual optimization
-        self.results = _opt.leastsq(self._studentized_residuals_concatenated, self._pguess, full_output=1)
-
-        # plot if necessary
-        if self['autoplot']: self.plot()
-
-        return self
+        if self['profile']: t0 = _time.perf_counter()
+        if multistart: results = self._fit_multistart(multistart, bounds, sampler, keep, workers, seed)
+        else:          results = self._local_fit(self._pguess)
+        if self['profile']: 
+            self._profile['time_solver'] += _time.perf_counter()-t0
+            self._profile['fits']        += 1
+            self._profile['jacobian_evaluations'] += results[2].get('njev', 0)
+
+        # Remember the results, forgetting the least recently used
+        if key is not None:
+            self._fit_cache[key] = results
+            self._fit_cache.move_to_end(key)
+            while len(self._fit_cache) > self['fit_cache']: self._fit_cache.popitem(last=False)
+        
+        return results
 
-    def fix(self, *args, **kwargs):
+    def _fit_fingerprint(self, *args):
         """
-        Turns parameters to constants. As arguments, parameters must be strings.
-        As keyword arguments, they can be set at the same time.
+        Returns a digest of everything that determines the fit results: the
+        processed data, functions, parameter names, guess, constants, bounds,
+        the settings in self._fit_settings, and any additional arguments 
+        (e.g., the multistart options). Assumes _massage_data() has been 
+        called.
+        """
+        # The processed data themselves (hashed once per fit, since the 
+        # arrays sent to set_data() may have been modified in place)
+        h = _hashlib.sha1(self._data_digest())
         
-        Note this will NOT work when specifying a non-string fit function, 
-        because there is no flexibility in the number of arguments. To get
-        around this, suppose you've defined a function stuff(x,a,b). Instead
-        of sending the stuff object to self.set_functions() directly, make it
-        a string function, e.g.:
+        settings = [self._settings.get(k) for k in self._fit_settings]
+        _hash_update(h, [self._f_raw, self._bg_raw, self._pnames, 
+                         [float(v) for v in self._pguess], self._cnames, 
+                         [float(v) for v in self._constants],
+                         sorted(self._bounds.items()), settings, args])
+        return h.hexdigest()
+
+    def fit_async(self, callback=None, progress=None, progress_interval=0.2, multistart=0, bounds=None, 
+                  sampler='latin', keep=4, workers=1, force=False, seed=None, **kwargs):
+        """
+        Runs fit() in a background thread, so that GUIs (and live plots) stay
+        responsive. The data are processed before starting, and the results
+        are delivered in the calling thread by the returned fit_job's poll() 
+        method, which also plots (if autoplot is on) and calls callback. If 
+        Qt is available (e.g., when using spinmob.egg), a timer calls poll() 
+        automatically from the event loop. 
         
-          self.set_functions('stuff(x,a,b)', 'a,b', stuff=stuff)
+        Don't change the fitter's data, functions, or settings while the job 
+        is running.
+        
+        Parameters
+        ----------
+        callback=None
+            Function called as callback(self) when the fit finishes 
+            successfully. Not called if the fit is cancelled or fails.
+        progress=None
+            Function called (from poll()) as progress(info) at most every 
+            progress_interval seconds during the fit, where info is a 
+            dictionary with the number of residual 'calls', the current 'chi2'
+            (None for ODR fits), parameters 'p', and 'elapsed' time.
+        progress_interval=0.2
+            Minimum time (seconds) between progress reports.
+        multistart=0, bounds=None, sampler='latin', keep=4, workers=1, force=False, seed=None
+            Same as for fit(), including the reuse of cached results. 
+            
+        Optional keyword arguments are sent to self.set() prior to fitting.
+        
+        Returns
+        -------
+        fit_job object, which can be cancelled with cancel(), or waited 
+        upon with wait().
         """
-
-        # first set all the keyword argument values
-        self.set(**kwargs)
-
-        # get everything into one big list
-        pnames = list(args) + list(kwargs.keys())
-
-        # move each pname to the constants
-        for pname in pnames:
-            if not pname in self._pnames:
-                self._error("Naughty. '"+pname+"' is not a valid fit parameter name.")
-
+        self._prepare_fit(**kwargs)
+        
+        # Keep a reference, so the job (and its Qt timer) outlives the caller's
+        self._fit_job = fit_job(self, callback, progress, progress_interval, 
+                                dict(multistart=multistart, bounds=bounds, sampler=sampler, keep=keep, 
+                                     workers=workers, force=force, seed=seed)).start()
+        return self._fit_job
+
+    def _fit_multistart(self, N, bounds=None, sampler='latin', keep=4, workers=1, seed=None):
+        """
+        Draws N candidate guesses within the bounds, evaluates chi^2 for all of
+        them in batches, then runs leastsq from the current guess and the 
+        best keep candidates (in workers threads, if not 1). Returns the leastsq
+        output with the lowest chi^2, with the total number of function
+        evaluations in results[2]['nfev_total']. Assumes _massage_data() has 
+        been called.
+        """
+        import concurrent.futures as _futures
+        
+        if bounds is None: bounds = dict()
+        for k in bounds:
+            if not k in self._pnames: self._error("'"+k+"' is not a valid fit parameter name.")
+        
+        # Assemble the sampling range for each parameter
+        lower = []
+        upper = []
+        for n in range(len(self._pnames)):
+            pname = self._pnames[n]
+            
+            # Default range
+            if pname in self._bounds and _n.isfinite(self._bounds[pname]).all():
+                l, u = self._bounds[pname]
             else:
-                n = self._pnames.index(pname)
+                w = max(abs(self._pguess[n]), 1.0)
+                l, u = self._pguess[n]-w, self._pguess[n]+w
+            
+            # Specified range, with None meaning the default on that side
+            if pname in bounds: 
+                if bounds[pname][0] is not None: l = bounds[pname][0]
+                if bounds[pname][1] is not None: u = bounds[pname][1]
+                if not (_n.isfinite([l, u]).all() and l < u):
+                    self._error("Multistart bounds for '"+pname+"' must be finite with min < max, not "+repr((l,u))+".")
+            
+            lower.append(l)
+            upper.append(u)
+        lower = _n.array(lower, dtype=float)
+        upper = _n.array(upper, dtype=float)
+        
+        # Draw candidates on the unit hypercube and scale them
+        candidates = lower + _s.fun.sample_unit_hypercube(int(N), len(self._pnames), sampler, seed)*(upper-lower)
+        
+        # Cheap batched chi^2 for all of them
+        chi2s = self._chi_squareds_batch(candidates)
+        chi2s[_n.isnan(chi2s)] = _n.inf
+        
+        # Starting points: the current guess and the best few candidates
+        starts = [_n.array(self._pguess, dtype=float)] + list(candidates[_n.argsort(chi2s)[0:int(keep)]])
+        
+        # Run the local fits
+        if workers == 1: outputs = [self._local_fit(p0) for p0 in starts]
+        else:
+            with _futures.ThreadPoolExecutor(max_workers=workers) as pool: 
+                outputs = list(pool.map(self._local_fit, starts))
+        
+        # Pick the best, preferring converged fits (with a covariance matrix)
+        best = None
+        nfev = len(candidates)
+        for output in outputs:
+            nfev += output[2]['nfev']
+            chi2 = _n.sum(output[2]['fvec']**2)
+            key  = (output[1] is None, chi2)
+            if best is None or key < best[0]: best = (key, output)
+        
+        results = best[1]
+        results[2]['nfev_total']   = nfev
+        results[2]['multistart']   = len(candidates)
+        results[2]['local_starts'] = len(starts)
+        
+        if not self['silent']: 
+            print("fit(): multistart spent "+str(nfev)+" function evaluations ("
+                  +str(len(candidates))+" candidates, "+str(len(starts))+" local fits).")
+        
+        return results
+
+    def fit_sequence(self, datasets, warm_start=True, extrapolate='linear', **kwargs):
+        """
+        Fits a sequence of data sets (e.g., traces taken while stepping a 
+        field or temperature) with the current functions and settings, 
+        without plotting, and returns the stacked results. After this call,
+        the fitter holds the last data set and its fit results.
+        
+        Parameters
+        ----------
+        datasets
+            List of data for each step. Each element can be a tuple 
+            (xdata, ydata), (xdata, ydata, eydata), or 
+            (xdata, ydata, eydata, exdata), or a dictionary of set_data() 
+            keyword arguments.
+        warm_start=True
+            Start each fit from the previous solution rather than the guess.
+        extrapolate='linear'
+            With warm_start, start each fit from the linear extrapolation 
+            of the previous two solutions if it has a lower chi^2 than the 
+            previous solution. Can also be None.
+            
+        Optional keyword arguments are sent to self.set() prior to fitting.
+        
+        Returns
+        -------
+        Dictionary with an array (one element per step) for each parameter
+        name, its error (pname+'.std'), 'chi2', 'reduced_chi2', 
+        'degrees_of_freedom', 'nfev', and 'ier', plus a list of 'covariance'
+        matrices. Errors of fits that didn't converge are nan.
+        """
+        if self._f_raw is None:
+            return self._error("No functions. Please use set_functions() prior to fitting.")
+        if not extrapolate in [None, 'linear']:
+            return self._error("extrapolate must be None or 'linear'.")
+        
+        self.set(**kwargs)
+        
+        N  = len(datasets)
+        Np = len(self._pnames)
+        d  = dict(chi2=_n.zeros(N), reduced_chi2=_n.zeros(N), degrees_of_freedom=_n.zeros(N),
+                  nfev=_n.zeros(N, dtype=int), ier=_n.zeros(N, dtype=int), covariance=[])
+        ps = _n.zeros((N, Np))
+        es = _n.zeros((N, Np))
+        
+        for k in range(N):
+            
+            # Get the data in set_data() format
+            data = datasets[k]
+            if isinstance(data, dict): data = dict(data)
+            else:                      data = dict(zip(['xdata', 'ydata', 'eydata', 'exdata'], data))
+            data.setdefault('eydata', None)
+            data.setdefault('exdata', None)
+            dtype = data.pop('dtype', getattr(self, '_dtype', _n.float64))
+            
+            xdata, ydata, eydata, exdata = self._match_data_lists(data.pop('xdata'), data.pop('ydata'), 
+                                                                  data.pop('eydata'), data.pop('exdata'))
+            self._set_data_globals.update(data)
+            self._dtype = dtype
+            
+            # Only do the full set_data() if the number of data sets changes
+            if len(xdata) != len(self._set_xdata) or len(self['scale_eydata']) != len(xdata):
+                autoplot = self['autoplot']
+                self._settings['autoplot'] = False
+                self.set_data(xdata, ydata, eydata, dtype, exdata)
+                self._settings['autoplot'] = autoplot
+            else:
+                self._set_xdata  = xdata
+                self._set_ydata  = ydata
+                self._set_eydata = eydata
+                self._set_exdata = exdata
+                self.clear_results()
+            
+            self._massage_data()
+            
+            # Starting point
+            p0 = _n.array(self._pguess, dtype=float)
+            if warm_start and k > 0:
+                p0 = ps[k-1]
+                if extrapolate == 'linear' and k > 1:
+                    pe = 2*ps[k-1]-ps[k-2]
+                    r0 = self._studentized_residuals_concatenated(p0)
+                    re = self._studentized_residuals_concatenated(pe)
+                    if _sum_of_squares(re) < _sum_of_squares(r0): p0 = pe
+            
+            # Fit
+            if self['profile']: t0 = _time.perf_counter()
+            self.results = self._local_fit(p0)
+            if self['profile']: 
+                self._profile['time_solver'] += _time.perf_counter()-t0
+                self._profile['fits']        += 1
+                self._profile['jacobian_evaluations'] += self.results[2].get('njev', 0)
+            
+            # Stack the results
+            r   = self.results[2]['fvec']
+            dof = len(r)-Np
+            ps[k] = self.results[0]
+            if self.results[1] is None: es[k] = _n.nan
+            else:                       es[k] = _n.sqrt(_n.diagonal(self.results[1]))
+            d['chi2'][k]               = _sum_of_squares(r)
+            d['reduced_chi2'][k]       = d['chi2'][k]/dof
+            d['degrees_of_freedom'][k] = dof
+            d['nfev'][k]               = self.results[2]['nfev']
+            d['ier'][k]                = self.results[4]
+            d['covariance'].append(self.results[1])
+        
+        for n in range(Np):
+            d[self._pnames[n]]        = ps[:,n]
+            d[self._pnames[n]+'.std'] = es[:,n]
+        
+        return d
+
+    def _local_fit(self, p0):
+        """
+        Runs the local optimizer selected by self['solver'] from p0 and 
+        returns the output in scipy.optimize.leastsq's full_output format.
+        Assumes _massage_data() has been called.
+        
+        If any data set has x error bars, this uses ODR instead (see 
+        _fit_odr()), which supports neither bounds nor the other solvers.
+        """
+        if self._has_exdata(): 
+            lower, upper = self.get_bounds()
+            if _n.isfinite(lower).any() or _n.isfinite(upper).any():
+                self._error("Parameter bounds are not supported for data with x error bars (ODR fit).")
+            if self['solver'] != 'leastsq':
+                self._error("solver="+repr(self['solver'])+" is not supported for data with x error bars (ODR fit). Use solver='leastsq'.")
+            return self._fit_odr(p0)
+        
+        # Analytic Jacobian if all the functions are models
+        jacobian = None
+        if all([hasattr(f, 'jacobian') for f in self.f]): jacobian = self._studentized_jacobian
+        
+        if not self['solver'] in ['leastsq', 'trf', 'dogbox', 'sparse']:
+            self._error("solver must be 'leastsq', 'trf', 'dogbox', or 'sparse', not "+repr(self['solver'])+".")
+        
+        # Finite-difference steps must be resolvable at the data precision
+        eps = self._get_data_eps()
+        
+        lower, upper = self.get_bounds()
+        if self['solver'] == 'leastsq':
+            if _n.isfinite(lower).any() or _n.isfinite(upper).any():
+                self._error("Parameter bounds require solver='trf', 'dogbox', or 'sparse'.")
+            return _opt.leastsq(self._studentized_residuals_concatenated, p0, Dfun=jacobian, full_output=1, epsfcn=eps)
+        
+        # least_squares solvers
+        kwargs = dict(bounds=(lower, upper), x_scale=self['x_scale'])
+        if eps: kwargs['diff_step'] = eps**0.5
+        if self['solver'] == 'sparse':
+            kwargs['method'] = 'trf'
+            S = self.get_jacobian_sparsity()
+            
+            # An analytic Jacobian without much structure is used as is
+            if jacobian is not None and S.nnz >= 0.5*S.shape[0]*S.shape[1]: 
+                kwargs['jac'] = jacobian
+            
+            else:
+                kwargs['tr_solver'] = 'lsmr'
+                if jacobian is None: kwargs['jac_sparsity'] = S
+                else:
+                    # Fill the known structure with the analytic values
+                    import scipy.sparse as _sparse
+                    rows, cols = S.nonzero()
+                    kwargs['jac'] = lambda p: _sparse.csr_matrix((jacobian(p)[rows, cols], (rows, cols)), shape=S.shape)
+        else:
+            kwargs['method'] = self['solver']
+            if jacobian is not None: kwargs['jac'] = jacobian
+        
+        # The starting point must be within the bounds
+        p0 = _n.clip(_n.array(p0, dtype=float), lower, upper)
+        
+        r = _opt.least_squares(self._studentized_residuals_concatenated, p0, **kwargs)
+        return self._least_squares_to_leastsq(r)
+
+    def _get_data_eps(self):
+        """
+        Returns the machine epsilon of the (massaged) data if it is less 
+        precise than float64 (e.g., float32), otherwise None.
+        """
+        eps = None
+        for y in self._ydata_massaged:
+            if y.dtype.kind == 'f' and y.dtype.itemsize < 8: 
+                eps = max(eps or 0, float(_n.finfo(y.dtype).eps))
+        return eps
+
+    def _fit_odr(self, p0):
+        """
+        Orthogonal distance regression (scipy.odr) of all data sets at once,
+        using the cached RealData from _massage_data() and the (compiled) 
+        functions. Returns the output in leastsq's full_output format, with 
+        the scipy.odr.Output in infodict['odr'].
+        """
+        # Segments of the concatenated x-data belonging to each function
+        Ns = _n.cumsum([0]+[len(x) for x in self._xdata_massaged])
+        nfev = [0]
+        
+        def f(p, x):
+            nfev[0] += 1
+            if self._fit_hook is not None: self._fit_hook(p, None)
+            y = _n.zeros(len(x))
+            for n in range(len(Ns)-1): y[Ns[n]:Ns[n+1]] = self._evaluate_f(n, x[Ns[n]:Ns[n+1]], p)
+            return y
+        
+        o = _odr.ODR(self._odr_data, _odr.Model(f), beta0=_n.array(p0, dtype=float), ifixx=self._odr_ifixx).run()
+        
+        # ODR's info: last digit 1-3 converged, 4 iteration limit; 
+        # the fifth digit flags fatal errors, the second rank deficiency.
+        if   o.info >= 10000:  ier = 0
+        elif o.info % 10 == 4: ier = 5
+        else:                  ier = o.info % 10
+        
+        # Unscaled covariance, like leastsq
+        cov = o.cov_beta
+        if ier == 0 or (o.info//10) % 10 or not _n.all(_n.isfinite(cov)): cov = None
+        
+        infodict = dict(nfev=nfev[0], njev=0, odr=o,
+                        fvec=_n.concatenate(self._studentized_residuals_fast(o.beta)))
+        
+        return o.beta, cov, infodict, '; '.join(o.stopreason), ier
+
+    def _least_squares_to_leastsq(self, r):
+        """
+        Converts the output of scipy.optimize.least_squares into the 
+        (p, covariance, infodict, message, ier) format of leastsq, so the 
+        rest of the fitter does not care which solver was used.
+        """
+        J = r.jac
+        if hasattr(J, 'toarray'): JTJ = (J.T*J).toarray()
+        else:                     JTJ = _n.dot(J.T, J)
+        
+        # Same as leastsq: no covariance if the curvature matrix is singular
+        try:    
+            cov = _n.linalg.inv(JTJ)
+            if not _n.all(_n.isfinite(cov)): cov = None
+        except _n.linalg.LinAlgError: cov = None
+        
+        infodict = dict(nfev=r.nfev, njev=r.njev if r.njev is not None else 0, fvec=r.fun)
+        
+        # leastsq's ier: 1-4 converged, 5 too many function calls
+        if r.status > 0: ier = r.status
+        else:            ier = 5
+        
+        return r.x, cov, infodict, r.message, ier
+
+    def get_parameter_usage(self):
+        """
+        Returns a boolean array of shape (number of functions, number of 
+        parameters), True where a function depends on a parameter. String 
+        functions are parsed to find the names they use; function objects 
+        are assumed to depend on all parameters, and models on theirs.
+        """
+        import ast as _ast
+        
+        f = self._f_raw
+        if not _s.fun.is_iterable(f): f = [f]
+        
+        usage = _n.ones((len(f), len(self._pnames)), dtype=bool)
+        for n in range(len(f)):
+            if isinstance(f[n], _models.model):
+                usage[n] = [pname in f[n].get_pnames() for pname in self._pnames]
+            
+            elif isinstance(f[n], str):
+                names = set()
+                for node in _ast.walk(_ast.parse(f[n].strip(), mode='eval')):
+                    if isinstance(node, _ast.Name): names.add(node.id)
+                usage[n] = [pname in names for pname in self._pnames]
+        return usage
+
+    def get_jacobian_sparsity(self):
+        """
+        Returns a scipy.sparse matrix with one row per (massaged) data point 
+        and one column per fit parameter, nonzero where the studentized 
+        residual can depend on the parameter (see get_parameter_usage()).
+        This is the structure used by the 'sparse' solver. Assumes 
+        _massage_data() has been called.
+        """
+        import scipy.sparse as _sparse
+        
+        usage = self.get_parameter_usage()
+        
+        rows = []
+        cols = []
+        row0 = 0
+        for n in range(len(self._ydata_massaged)):
+            N     = len(self._ydata_massaged[n])
+            used  = _n.nonzero(usage[n])[0]
+            rows.append(_n.repeat(_n.arange(row0, row0+N), len(used)))
+            cols.append(_n.tile(used, N))
+            row0 += N
+        rows = _n.concatenate(rows)
+        cols = _n.concatenate(cols)
+        
+        return _sparse.csr_matrix((_n.ones(len(rows), dtype=int), (rows, cols)), 
+                                  shape=(row0, len(self._pnames)))
+
+    def fix(self, *args, **kwargs):
+        """
+        Turns parameters to constants. As arguments, parameters must be strings.
+        As keyword arguments, they can be set at the same time.
+        
+        Note this will NOT work when specifying a non-string fit function, 
+        because there is no flexibility in the number of arguments. To get
+        around this, suppose you've defined a function stuff(x,a,b). Instead
+        of sending the stuff object to self.set_functions() directly, make it
+        a string function, e.g.:
+        
+          self.set_functions('stuff(x,a,b)', 'a,b', stuff=stuff)
+        """
+
+        # first set all the keyword argument values
+        self.set(**kwargs)
+
+        # get everything into one big list
+        pnames = list(args) + list(kwargs.keys())
+
+        # move each pname to the constants
+        for pname in pnames:
+            if not pname in self._pnames:
+                self._error("Naughty. '"+pname+"' is not a valid fit parameter name.")
+
+            else:
+                n = self._pnames.index(pname)
 
                 # use the fit result if it exists
                 if self.results: value = self.results[0][n]
@@ -2531,9 +3724,10 @@ class fitter():
 
     def clear_results(self):
         """
-        Removes any fit results.
+        Removes any fit results (and the cached processed data).
         """
         self.results = None
+        self._processed_data = dict()
         return self
 
     def _evaluate_all_functions(self, xdata, p=None):
@@ -2563,10 +3757,67 @@ class fitter():
         elif p is None and self.results is None:     p = self._pguess
 
         # assemble the arguments for the function
-        args = (xdata,) + tuple(p)
+        args = _function_args(xdata, p)
 
         # evaluate this function.
-        return self.f[n](*args)
+        if not self._settings['profile']: return self.f[n](*args)
+        
+        # evaluate it with instrumentation
+        t0 = _time.perf_counter()
+        y  = self.f[n](*args)
+        with self._profile_lock:
+            self._profile['time_model']        += _time.perf_counter()-t0
+            self._profile['model_evaluations'] += 1
+        return y
+
+    def _evaluate_f_batch(self, n, xdata, P):
+        """
+        Evaluates function n for many parameter sets at once. P is an 
+        (M, number of parameters) array, and the result is an (M, len(xdata))
+        array. This tries a single broadcasted call first (works for most 
+        numpy-based string functions) and falls back to a loop otherwise.
+        """
+        P = _n.array(P, dtype=float)
+        try:
+            args = (xdata[_n.newaxis,:],) + tuple(P[:,[k]] for k in range(P.shape[1]))
+            y = _n.broadcast_to(self.f[n](*args), (len(P), len(xdata)))
+            
+            # Make sure the function really broadcast the way we think
+            if not _n.allclose(y[0], self._evaluate_f(n, xdata, P[0]), equal_nan=True): raise ValueError
+        except:
+            y = _n.array([self._evaluate_f(n, xdata, p) for p in P])
+        return y
+
+    def _chi_squareds_batch(self, P, chunk_size=2**20):
+        """
+        Returns an array of total chi^2 values, one for each row of the 
+        (M, number of parameters) array P, using the massaged data (assumes
+        self._massage_data() has been called). Evaluations are done in chunks
+        of rows such that no temporary array exceeds roughly chunk_size 
+        elements. As in _studentized_residuals_fast(), x error bars are 
+        propagated through the function into an effective y error.
+        """
+        P = _n.atleast_2d(_n.array(P, dtype=float))
+        N = max(1, max([len(x) for x in self._xdata_massaged]))
+        M = max(1, int(chunk_size/N))
+        
+        chi2s = _n.zeros(len(P))
+        for i in range(0, len(P), M):
+            for n in range(min(len(self.f), len(self._xdata_massaged))):
+                x = self._xdata_massaged[n]
+                y = self._evaluate_f_batch(n, x, P[i:i+M])
+                denominator = _n.absolute(self._eydata_massaged[n])
+                
+                # Include the x-error, propagated through the function
+                ex = self._exdata_massaged[n]
+                if ex is not None:
+                    dy = 0.5*(self._evaluate_f_batch(n, x+ex, P[i:i+M]) - 
+                              self._evaluate_f_batch(n, x-ex, P[i:i+M]))
+                    denominator = _n.sqrt(denominator**2 + dy**2)
+                
+                r = (self._ydata_massaged[n]-y)/denominator
+                chi2s[i:i+M] += _n.sum(r*r, axis=1)
+        return chi2s
 
     def _evaluate_bg(self, n, xdata, p=None):
         """
@@ -2582,7 +3833,7 @@ class fitter():
         if self.bg[n] is None: return None
 
         # assemble the arguments for the function
-        args = (xdata,) + tuple(p)
+        args = _function_args(xdata, p)
 
         # evaluate the function
         return self.bg[n](*args)
@@ -2630,9 +3881,32 @@ class fitter():
         for n in range(len(f)):
             numerator = self._ydata_massaged[n]-f[n]
             denominator = _n.absolute(self._eydata_massaged[n])
+            
+            # Include the x-error, propagated through the function
+            ex = self._exdata_massaged[n]
+            if ex is not None:
+                x  = self._xdata_massaged[n]
+                dy = 0.5*(self._evaluate_f(n, x+ex, p)-self._evaluate_f(n, x-ex, p))
+                denominator = _n.sqrt(denominator**2 + dy**2)
+            
             residuals.append(numerator/denominator)
         return residuals
     
+    def _studentized_jacobian(self, p):
+        """
+        Returns the Jacobian of _studentized_residuals_concatenated() (one 
+        row per point, one column per parameter) from the functions' 
+        analytic jacobian() methods (i.e., for models). Assumes 
+        _massage_data() has been called.
+        """
+        Js = []
+        for n in range(len(self.f)):
+            if len(self._xdata_massaged) > n:
+                J = self.f[n].jacobian(self._xdata_massaged[n], *p)
+                Js.append(-J.transpose()/_n.absolute(self._eydata_massaged[n])[:,_n.newaxis])
+        
+        return _n.concatenate(Js)
+
     def _studentized_residuals_concatenated(self, p=None):
         """
         This function returns a big long list of residuals so leastsq() knows
@@ -2640,7 +3914,16 @@ class fitter():
 
         p=None means use the fit results
         """
-        return _n.concatenate(self._studentized_residuals_fast(p))
+        r = _n.concatenate(self._studentized_residuals_fast(p))
+        
+        if self._fit_hook is not None: self._fit_hook(p, r)
+        
+        if self._settings['profile']:
+            with self._profile_lock:
+                self._profile['residual_calls'] += 1
+                if self['profile_trace']: self._profile['trace'].append((_sum_of_squares(r), _n.array(p)))
+        
+        return r
 
     def studentized_residuals(self, p=None):
         """
@@ -2674,7 +3957,7 @@ class fitter():
 
         # square em and sum em.
         cs = []
-        for r in rs: cs.append(sum(r**2))
+        for r in rs: cs.append(_sum_of_squares(r))
         return cs
 
     def chi_squared(self, p=None):
@@ -2688,6 +3971,125 @@ class fitter():
         
         return sum(self.chi_squareds(p))
 
+    def chi2_grid(self, grid, others='fixed', p=None, chunk_size=2**20, progress=True, return_parameters=False):
+        """
+        Evaluates the total chi^2 on a grid of parameter values, e.g., to 
+        visualize the chi^2 landscape and parameter correlations.
+        
+        Parameters
+        ----------
+        grid
+            Dictionary of parameter names and 1D arrays of values, e.g., 
+            dict(a=linspace(0,1,100), b=linspace(2,3,50)). The returned array
+            has one axis per key, in this order.
+        others='fixed'
+            What to do with the parameters not in grid. 'fixed' holds them
+            at p, so every chunk of grid points costs one broadcasted model
+            evaluation. 'profile' re-optimizes them (leastsq) at each grid 
+            point, warm-starting from the neighboring point's solution by 
+            walking the grid in a "snake" order.
+        p=None
+            Values for the parameters not in grid (and starting values for the
+            profile). None means use the fit results, or the guess if there
+            are none.
+        chunk_size=2**20
+            Approximate maximum number of elements per temporary array in the
+            'fixed' mode.
+        progress=True
+            If True, prints the progress (unless 'silent'). Can also be a 
+            function progress(done, total) called after each chunk.
+        return_parameters=False
+            If True, also return a dictionary of arrays (matching the chi^2 
+            array) holding the values of all the other parameters at each 
+            grid point.
+        
+        Returns
+        -------
+        chi2 array (and the dictionary of other parameters, if requested)
+        """
+        if len(self._set_xdata)==0 or len(self._set_ydata)==0:
+            return self._error("No data. Please use set_data() prior to chi2_grid().")
+        if not others in ['fixed', 'profile']: 
+            return self._error("others must be 'fixed' or 'profile'.")
+        
+        # Get the grid parameter names, values, and indices
+        gnames  = list(grid.keys())
+        gvalues = [_n.array(grid[k], dtype=float).ravel() for k in gnames]
+        for k in gnames:
+            if not k in self._pnames: self._error("'"+k+"' is not a valid fit parameter name.")
+        gis   = [self._pnames.index(k) for k in gnames]
+        ois   = [i for i in range(len(self._pnames)) if not i in gis]
+        shape = tuple(len(v) for v in gvalues)
+        total = int(_n.prod(shape))
+        
+        # Parameters not on the grid
+        if p is None:
+            if self.results is None: p = self._pguess
+            else:                    p = self.results[0]
+        p = _n.array(p, dtype=float)
+        
+        # Process the data once
+        self._massage_data()
+        
+        # Progress reporter
+        last_report = [0]
+        def report(done):
+            if callable(progress): progress(done, total)
+            elif progress and not self['silent']:
+                percent = int(100*done/total)
+                if percent//10 > last_report[0] or done == total: 
+                    print("chi2_grid(): "+str(percent)+"% ("+str(done)+"/"+str(total)+")")
+                    last_report[0] = percent//10
+        
+        chi2s = _n.zeros(total)
+        pout  = _n.zeros((total, len(p)))
+        
+        # Hold the others fixed: one broadcasted evaluation per chunk
+        if others == 'fixed':
+            N = max(1, sum([len(x) for x in self._xdata_massaged]))
+            M = max(1, int(chunk_size/N))
+            for i in range(0, total, M):
+                j = min(i+M, total)
+                P = _n.repeat(p[_n.newaxis,:], j-i, axis=0)
+                indices = _n.unravel_index(_n.arange(i,j), shape)
+                for k in range(len(gis)): P[:,gis[k]] = gvalues[k][indices[k]]
+                chi2s[i:j] = self._chi_squareds_batch(P, chunk_size)
+                pout [i:j] = P
+                report(j)
+        
+        # Profile: re-optimize the others at each grid point
+        else:
+            # Walk the grid so that consecutive points are neighbors
+            order   = _s.fun.snake_indices(shape)
+            indices = _n.unravel_index(order, shape)
+            po      = p[ois]
+            
+            def residuals(po, P):
+                P[ois] = po
+                return self._studentized_residuals_concatenated(P)
+            
+            for m in range(total):
+                P = _n.array(p)
+                for k in range(len(gis)): P[gis[k]] = gvalues[k][indices[k][m]]
+                
+                # Optimize the others, using the previous solution as a guess
+                if len(ois): 
+                    po = _opt.leastsq(residuals, po, args=(P,), full_output=1)[0]
+                    P[ois] = po
+                
+                r = self._studentized_residuals_concatenated(P)
+                chi2s[order[m]] = _sum_of_squares(r)
+                pout [order[m]] = P
+                if (m+1) % max(1, total//100) == 0 or m+1 == total: report(m+1)
+        
+        chi2s = chi2s.reshape(shape)
+        if not return_parameters: return chi2s
+        
+        # Assemble the other parameters
+        d = dict()
+        for i in ois: d[self._pnames[i]] = pout[:,i].reshape(shape)
+        return chi2s, d
+
     def degrees_of_freedom(self):
         """
         Returns the number of degrees of freedom.
@@ -2771,12 +4173,46 @@ class fitter():
         self.clear_results()
 
         # replot
-        if self['autoplot']: self.plot()
+        self._autoplot()
 
         return self
     
     
 
+    def _autoplot(self):
+        """
+        Called whenever something changes. Plots if 'autoplot' is True and
+        the fitter is not headless, postponing the redraw if the last one
+        happened less than 'plot_min_interval' seconds ago.
+        """
+        if not self['autoplot'] or self.headless: return self
+        
+        # Coalesce redraws that come too quickly
+        dt = self['plot_min_interval']
+        if dt and _time.time()-self._plot_time < dt:
+            
+            # Schedule a single redraw for later (if there is an event loop)
+            if not self._plot_pending:
+                self._plot_pending = True
+                
+                if self.figures == None: fig = _p.figure(self['first_figure'])
+                else:                    fig = self.figures[0]
+                
+                self._plot_timer = fig.canvas.new_timer(interval=int(1000*dt))
+                self._plot_timer.single_shot = True
+                self._plot_timer.add_callback(self._plot_if_pending)
+                self._plot_timer.start()
+            
+            return self
+        
+        return self.plot()
+    
+    def _plot_if_pending(self):
+        """
+        Draws a postponed redraw, if there is one.
+        """
+        if self._plot_pending: self.plot()
+    
     def plot(self, **kwargs):
         """
         This will plot the data (with error) for inspection.
@@ -2785,6 +4221,10 @@ class fitter():
         will override the creation of new figures. If you specify
         a list, its length had better be at least as large as the
         number of data sets.
+        
+        If 'plot_incremental' is True and a figure still holds the curves
+        from the previous call (with the same layout), their data are updated
+        in place rather than clearing and redrawing the whole figure.
 
         kwargs will update the settings
         """
@@ -2792,202 +4232,70 @@ class fitter():
         # Make sure there is data to plot.
         if len(self._set_xdata)==0 or len(self._set_ydata)==0: return self
         
+        if self['profile']: t0 = _time.perf_counter()
+        
         # Make sure the figures is a list
         if not self.figures == None and not type(self.figures) == list:
             self.figures = [self.figures]
         
+        # update settings
+        for k in kwargs: self[k] = kwargs[k]
+        
+        # Remember when we last drew, for coalescing automatic redraws
+        self._plot_time    = _time.time()
+        self._plot_pending = False
         
-        # Get the trimmed and full processed data
+        # Get the trimmed and (only if needed) full processed data
         xts, yts, eyts = self.get_processed_data()
-        xas, yas, eyas = self.get_processed_data(do_trim=False)
+        if True in self['plot_all_data']: xas, yas, eyas = self.get_processed_data(do_trim=False)
+        else:                             xas, yas, eyas = xts, yts, eyts
         
-        # update settings
-        for k in kwargs: self[k] = kwargs[k]
-
-        # Calculate all studentized residuals
-        if len(self.f) > 0: rt = self.studentized_residuals()
+        # Which parameters to use for the residuals
+        if self.results is None: p = self._pguess
+        else:                    p = self.results[0]
         
         # make a new figure for each data set
         for n in range(len(self._set_xdata)):
-            xt = xts[n]
-            xa = xas[n]
-            yt = yts[n]
-            ya = yas[n]
-            eyt = eyts[n]
-            eya = eyas[n]
-            #ext = exts[n]
-            eyt = eyts[n]
+            
+            # Calculate the studentized residuals from the processed data
+            if n < len(self.f): rt = (yts[n]-self._evaluate_f(n, xts[n], p))/_n.absolute(eyts[n])
+            else:               rt = None
+            
+            # Everything that needs drawing for this data set
+            items = self._get_plot_items(n, xts[n], yts[n], eyts[n], xas[n], yas[n], eyas[n], rt)
+            key   = [(i['name'], i['kind']) for i in items] + [self['xscale'][n], self['yscale'][n]]
             
             # get the next figure
             if self.figures == None: fig = _p.figure(self['first_figure']+n)
             else: fig = self.figures[n]
-                    
-            # turn off interactive mode and clear the figure
+            
+            # turn off interactive mode
             _p.ioff()
-            fig.clear()
             
-            # set up two axes. One for data and one for residuals.
-            a1 = fig.add_subplot(211)            # Residuals
-            a2 = fig.add_subplot(212, sharex=a1) # Data
-            a1.set_position([0.15, 0.72, 0.75, 0.15])
-            a2.set_position([0.15, 0.10, 0.75, 0.60])
-
-            # set the scales
-            a1.set_xscale(self['xscale'][n])
-            a2.set_xscale(self['xscale'][n])
-            a2.set_yscale(self['yscale'][n])
-
-            # Get the function xdata
-            fxa = self._get_xdata_for_function(n,xa)
-            fxt = self._get_xdata_for_function(n,xt)
+            # See if we can just update the existing curves
+            old = self._plot_artists.get(n)
+            if self['plot_incremental'] and old is not None and old['fig'] is fig \
+            and old['key'] == key and fig.axes == [old['a1'], old['a2']]:
+                a1, a2 = old['a1'], old['a2']
+                self._update_plot_items(items, old['artists'], a1, a2)
             
-            # get the values to subtract from ydata if subtracting the background
-            if self['subtract_bg'][n] and not self.bg[n] is None:
-
-                # if we have a fit, use that for the background
-                if self.results: p = self.results[0]
-                else:            p = self._pguess
-                
-                # Get the background data
-                d_ya  = self._evaluate_bg(n, xa,  p)
-                d_fya = self._evaluate_bg(n, fxa, p)
-                d_yt  = self._evaluate_bg(n, xt,  p)
-                d_fyt = self._evaluate_bg(n, fxt, p)
-
-            # Otherwise just make some zero arrays
+            # Otherwise clear the figure and draw everything
             else:
-                d_ya  = 0*xa
-                d_fya = 0*fxa
-                d_yt  = 0*xt
-                d_fyt = 0*fxt
-
-            
-            
-            # PLOT DATA FIRST
-
-            # If we're supposed to, add the "all" data and function
-            if self['plot_all_data'][n]:
-                
-                # Make it faint.
-                style_data  = dict(self['style_data' ][n]); style_data ['alpha'] = 0.3
-                
-                if self['plot_errors'][n]: a2.errorbar(xa, ya-d_ya, eya, zorder=5, **style_data)
-                else:                      a2.plot    (xa, ya-d_ya,      zorder=5, **style_data)
-            
-            # add the trimmed data
-            if self['plot_errors'][n]:     a2.errorbar(xt, yt-d_yt, eyt, zorder=7, **self['style_data'][n])
-            else:                          a2.plot(    xt, yt-d_yt,      zorder=7, **self['style_data'][n])
-                           
-            # Zoom on just the data for now
-            _s.tweaks.auto_zoom(axes=a2, draw=False)
-            
-            
-            
-            # PLOT FUNCTIONS
+                fig.clear()
             
-            if n < len(self.f): # If there are any functions to plot
-                
-                
-                # Plot the GUESS under the fit
-                if self['plot_guess'][n]:
-                                    
-                    # FULL GUESS
-                    if self['plot_all_data'][n]:
-                        
-                        # Make it faint.
-                        style_guess = dict(self['style_guess'][n]); style_guess['alpha'] = 0.3
-                
-                        # FULL background GUESS
-                        if self['plot_bg'][n] and self.bg[n] is not None:
-                            bg_gya = self._evaluate_bg(n, fxa, self._pguess)
-                            a2.plot(fxa, bg_gya-d_fya, zorder=9, **style_guess)
-                        
-                        # FULL guess
-                        gya = self._evaluate_f (n, fxa, self._pguess)
-                        a2.plot(fxa, gya-d_fya, zorder=9, **style_guess)
-                        
-                        # Update the trimmed datas so that the points line up
-                        [fxt] = _s.fun.trim_data_uber([fxt], [fxt>=min(xt), fxt<=max(xt)])
-
-                    # TRIMMED GUESS BACKGROUND
-                    
-                    # TRIMMED guess background curve
-                    if self['plot_bg'][n] and self.bg[n] is not None:
-                        bg_gyt = self._evaluate_bg(n, fxt, self._pguess)
-                        a2.plot(fxt, bg_gyt-d_fyt, zorder=9, **self['style_guess'][n])
-
-                    # TRIMMED main guess curve
-                    gyt = self._evaluate_f (n, fxt, self._pguess)
-                    a2.plot(fxt, gyt-d_fyt, zorder=9, **self['style_guess'][n])
+                # set up two axes. One for data and one for residuals.
+                a1 = fig.add_subplot(211)            # Residuals
+                a2 = fig.add_subplot(212, sharex=a1) # Data
+                a1.set_position([0.15, 0.72, 0.75, 0.15])
+                a2.set_position([0.15, 0.10, 0.75, 0.60])
     
+                # set the scales
+                a1.set_xscale(self['xscale'][n])
+                a2.set_xscale(self['xscale'][n])
+                a2.set_yscale(self['yscale'][n])
                 
-                
-                # Plot the FIT if there is one
-                if not self.results == None:
-    
-                    # FULL FIT
-                    if self['plot_all_data'][n]:
-                        
-                        # Make it faint.
-                        style_fit = dict(self['style_fit'][n]); style_fit['alpha'] = 0.3
-                
-                        # FULL background fit
-                        if self['plot_bg'][n] and self.bg[n] is not None:
-                            bg_fya = self._evaluate_bg(n, fxa, self.results[0])
-                            a2.plot(fxa, bg_fya-d_fya, zorder=10, **style_fit)
-                        
-                        # FULL fit
-                        fya = self._evaluate_f (n, fxa, self.results[0])
-                        a2.plot(fxa, fya-d_fya, zorder=10, **style_fit)
-    
-                        # Update the trimmed datas so that the points line up
-                        [fxt] = _s.fun.trim_data_uber([fxt], [fxt>=min(xt), fxt<=max(xt)])
-                            
-                    # TRIMMED FIT BACKGROUND
-                    if self['plot_bg'][n] and self.bg[n] is not None: 
-                        bg_fyt = self._evaluate_bg(n, fxt, self.results[0])                    
-                        a2.plot(fxt, bg_fyt-d_fyt, zorder=10, **self['style_fit'][n])
-    
-                    # TRIMMED main curve
-                    fyt = self._evaluate_f(n, fxt, self.results[0])
-                    a2.plot(fxt, fyt-d_fyt, zorder=10, **self['style_fit'][n])
-
-                if self['plot_guess_zoom'][n]: _s.tweaks.auto_zoom(axes=a2, draw=False)
-            
-            
-            # plot the residuals only if there are functions defined
-            if len(self.f):
-                
-                # If we're supposed to also plot all the data, we have to 
-                # Manually calculate the residuals. Clunky, I know.
-                if self['plot_all_data'][n]:
-                    
-                    # Figure out what guy to use for the residuals
-                    if self.results is None: 
-                        p = self._pguess
-                        style = style_guess
-                    else:                    
-                        p = self.results[0]
-                        style = style_fit
-                    
-                    # Calculate them
-                    ra = (ya-self._evaluate_f(n, xa, p))/eya
-                        
-                    # style_data, style_guess, and style_fit should already be faint
-                    a1.errorbar(xa, ra, _n.ones(len(ra)), **style_data)
-                    
-                    # Put the line on top
-                    a1.plot([min(xa), max(xa)], [0,0], **style)
-                
-                # Figure out what style to use for the line
-                if self.results is None: style = self['style_guess'][n]
-                else:                    style = self['style_fit'  ][n]
-
-                # Main residuals plot
-                if n < len(rt):
-                    a1.errorbar (xt, rt[n], _n.ones(len(xt)), **self['style_data'][n])
-                    a1.plot([min(xt), max(xt)], [0,0], **style)
-                
+                artists = self._draw_plot_items(items, a1, a2)
+                self._plot_artists[n] = dict(fig=fig, a1=a1, a2=a2, key=key, artists=artists)
                 
             # Tidy up
             yticklabels = a1.get_yticklabels()
@@ -3048,8 +4356,197 @@ class fitter():
                 _p.show()
         
         # End of new figure for each data set loop
+        if self['profile']: self._profile['time_plot'] += _time.perf_counter()-t0
         return self
 
+    def _get_plot_items(self, n, xt, yt, eyt, xa, ya, eya, rt):
+        """
+        Assembles a list of dictionaries describing everything plot() draws 
+        for data set n, in drawing order. Each has a 'name', the 'axes' 
+        ('a1' for residuals, 'a2' for data), a 'kind' ('line', 'errorbar', 
+        or 'zoom', the latter meaning "auto zoom a2 on what's drawn so far"),
+        the data 'x', 'y', 'ey', the 'style', and the 'zorder'. 
+        
+        Data are decimated to at most 'plot_max_points' points.
+        """
+        items = []
+        def add(name, axes, kind, x=None, y=None, ey=None, style=None, zorder=None):
+            
+            # Decimate big data sets
+            N = self['plot_max_points'][n]
+            if N and x is not None and len(x) > N:
+                step = int(_n.ceil(float(len(x))/N))
+                x = x[::step]
+                y = y[::step]
+                if _s.fun.is_iterable(ey): ey = ey[::step]
+            
+            items.append(dict(name=name, axes=axes, kind=kind, x=x, y=y, ey=ey, style=style, zorder=zorder))
+        
+        # Faint styles for the untrimmed data
+        style_data  = dict(self['style_data' ][n]); style_data ['alpha'] = 0.3
+        style_guess = dict(self['style_guess'][n]); style_guess['alpha'] = 0.3
+        style_fit   = dict(self['style_fit'  ][n]); style_fit  ['alpha'] = 0.3
+        
+        # Get the function xdata
+        fxa = self._get_xdata_for_function(n,xa)
+        fxt = self._get_xdata_for_function(n,xt)
+        
+        # get the values to subtract from ydata if subtracting the background
+        if self['subtract_bg'][n] and not self.bg[n] is None:
+
+            # if we have a fit, use that for the background
+            if self.results: p = self.results[0]
+            else:            p = self._pguess
+            
+            # Get the background data
+            d_ya  = self._evaluate_bg(n, xa,  p)
+            d_fya = self._evaluate_bg(n, fxa, p)
+            d_yt  = self._evaluate_bg(n, xt,  p)
+            d_fyt = self._evaluate_bg(n, fxt, p)
+
+        # Otherwise just make some zero arrays
+        else:
+            d_ya  = 0*xa
+            d_fya = 0*fxa
+            d_yt  = 0*xt
+            d_fyt = 0*fxt
+        
+        
+        
+        # DATA FIRST
+        if self['plot_errors'][n]: kind = 'errorbar'
+        else:                      kind = 'line'
+
+        # If we're supposed to, add the faint "all" data
+        if self['plot_all_data'][n]: add('data_all', 'a2', kind, xa, ya-d_ya, eya, style_data, 5)
+        
+        # add the trimmed data
+        add('data', 'a2', kind, xt, yt-d_yt, eyt, self['style_data'][n], 7)
+        
+        # Zoom on just the data for now
+        add('zoom', 'a2', 'zoom')
+        
+        
+        
+        # FUNCTIONS
+        if n < len(self.f): # If there are any functions to plot
+            
+            # Plot the GUESS under the fit, then the FIT if there is one
+            curves = []
+            if self['plot_guess'][n]:    curves.append(('guess', self._pguess,     self['style_guess'][n], style_guess,  9))
+            if not self.results == None: curves.append(('fit',   self.results[0], self['style_fit'  ][n], style_fit,   10))
+            
+            for name, p, style, style_faint, zorder in curves:
+                
+                # Full curves
+                if self['plot_all_data'][n]:
+                    if self['plot_bg'][n] and self.bg[n] is not None:
+                        add(name+'_bg_all', 'a2', 'line', fxa, self._evaluate_bg(n, fxa, p)-d_fya, None, style_faint, zorder)
+                    add(name+'_all', 'a2', 'line', fxa, self._evaluate_f(n, fxa, p)-d_fya, None, style_faint, zorder)
+                
+                # Trimmed curves
+                if self['plot_bg'][n] and self.bg[n] is not None:
+                    add(name+'_bg', 'a2', 'line', fxt, self._evaluate_bg(n, fxt, p)-d_fyt, None, style, zorder)
+                add(name, 'a2', 'line', fxt, self._evaluate_f(n, fxt, p)-d_fyt, None, style, zorder)
+
+            if self['plot_guess_zoom'][n]: add('zoom_guess', 'a2', 'zoom')
+            
+            
+            
+            # RESIDUALS
+            
+            # Figure out what guy to use for the residuals
+            if self.results is None: 
+                p = self._pguess
+                style_faint = style_guess
+                style       = self['style_guess'][n]
+            else:                    
+                p = self.results[0]
+                style_faint = style_fit
+                style       = self['style_fit'][n]
+            
+            # If we're supposed to also plot all the data, we have to 
+            # Manually calculate the residuals. Clunky, I know.
+            if self['plot_all_data'][n]:
+                ra = (ya-self._evaluate_f(n, xa, p))/eya
+                add('residuals_all',      'a1', 'errorbar', xa, ra, _n.ones(len(ra)), style_data)
+                add('residuals_all_zero', 'a1', 'line', _n.array([min(xa), max(xa)]), _n.array([0,0]), None, style_faint)
+            
+            # Main residuals plot
+            add('residuals',      'a1', 'errorbar', xt, rt, _n.ones(len(xt)), self['style_data'][n])
+            add('residuals_zero', 'a1', 'line', _n.array([min(xt), max(xt)]), _n.array([0,0]), None, style)
+        
+        return items
+    
+    def _draw_plot_items(self, items, a1, a2):
+        """
+        Draws the items from _get_plot_items() on freshly created axes, 
+        returning a list of the created artists (None for 'zoom' items).
+        """
+        axes = dict(a1=a1, a2=a2)
+        artists = []
+        for i in items:
+            a = axes[i['axes']]
+            
+            if i['kind'] == 'zoom': 
+                _s.tweaks.auto_zoom(axes=a, draw=False)
+                artists.append(None)
+                continue
+            
+            kwargs = dict(i['style'])
+            if i['zorder'] is not None: kwargs['zorder'] = i['zorder']
+            
+            if i['kind'] == 'errorbar': artists.append(a.errorbar(i['x'], i['y'], i['ey'], **kwargs))
+            else:                       artists.append(a.plot    (i['x'], i['y'],          **kwargs)[0])
+        
+        return artists
+
+    def _update_plot_items(self, items, artists, a1, a2):
+        """
+        Updates the data of existing artists (from _draw_plot_items()) with
+        the supplied items (whose layout must match), then rescales the axes.
+        """
+        # Update the data
+        for n in range(len(items)):
+            i = items[n]
+            if   i['kind'] == 'line': artists[n].set_data(i['x'], i['y'])
+            elif i['kind'] == 'errorbar':
+                line, caps, bars = artists[n].lines
+                x, y, ey = i['x'], i['y'], _n.absolute(i['ey'])
+                line.set_data(x, y)
+                if len(caps) == 2:
+                    caps[0].set_data(x, y-ey)
+                    caps[1].set_data(x, y+ey)
+                for b in bars: b.set_segments(_n.array([[x,y-ey],[x,y+ey]]).transpose((2,0,1)))
+        
+        # Rescale a2 the same way a full draw would: first on the data only,
+        # then on everything if there is a second zoom.
+        zooms = [n for n in range(len(items)) if items[n]['kind'] == 'zoom']
+        for z in zooms:
+            self._relim(a2, [artists[n] for n in range(z) if items[n]['axes'] == 'a2' and items[n]['kind'] != 'zoom'])
+            _s.tweaks.auto_zoom(axes=a2, draw=False)
+        
+        # Rescale the residuals
+        self._relim(a1, [artists[n] for n in range(len(items)) if items[n]['axes'] == 'a1'])
+        a1.autoscale(enable=True)
+        a1.autoscale_view()
+    
+    def _relim(self, axes, artists):
+        """
+        Resets the data limits of axes to include only the supplied artists
+        (lines and errorbar containers).
+        """
+        axes.ignore_existing_data_limits = True
+        for a in artists:
+            if hasattr(a, 'lines'): 
+                line, caps, bars = a.lines
+                for b in bars: 
+                    segments = b.get_segments()
+                    if len(segments): axes.update_datalim(_n.concatenate(segments))
+            else: line = a
+            xy = line.get_xydata()
+            if len(xy): axes.update_datalim(xy)
+
     def _get_xdata_for_function(self, n, xdata):
         """
         Generates the x-data for plotting the function.
@@ -3115,7 +4612,7 @@ class fitter():
 
         # now show the update.
         self.clear_results()
-        if self['autoplot']: self.plot()
+        self._autoplot()
 
         return self
 
@@ -3145,7 +4642,7 @@ class fitter():
             
         # now show the update.
         self.clear_results()
-        if self['autoplot']: self.plot()
+        self._autoplot()
         return self
     
     def zoom(self, n='all', xfactor=2.0, yfactor=2.0):
@@ -3194,7 +4691,7 @@ class fitter():
 
         # now show the update.
         self.clear_results()
-        if self['autoplot']: self.plot()
+        self._autoplot()
 
         return self
 
@@ -3217,6 +4714,367 @@ class fitter():
 
 
 
+class fit_job():
+    """
+    Handle for a fit running in a background thread, returned by
+    fitter.fit_async(). 
+    
+    The worker thread only queues its progress and outcome; poll() (called 
+    from the thread that owns the fitter, or automatically by a Qt timer) 
+    delivers them: it stores the results in the fitter, plots, and calls the 
+    callbacks.
+    
+    Attributes
+    ----------
+    cancelled
+        True if the fit was cancelled.
+    error
+        The exception raised by the fit, if any.
+    """
+    
+    def __init__(self, fitter, callback=None, progress=None, progress_interval=0.2, fit_kwargs=None):
+        import threading as _threading
+        import queue     as _queue
+        
+        self.fitter            = fitter
+        self.callback          = callback
+        self.progress          = progress
+        self.progress_interval = progress_interval
+        self.fit_kwargs        = dict() if fit_kwargs is None else fit_kwargs
+        
+        self.cancelled = False
+        self.error     = None
+        
+        self._cancel   = _threading.Event()
+        self._done     = _threading.Event()
+        self._queue    = _queue.Queue()
+        self._thread   = _threading.Thread(target=self._run, daemon=True)
+        self._results  = None
+        self._finished = False
+        self._timer    = None
+        
+    def __repr__(self):
+        if   self.cancelled:      s = 'cancelled'
+        elif self.error:          s = 'failed'
+        elif self._done.is_set(): s = 'done'
+        else:                     s = 'running'
+        return '<fit_job '+s+'>'
+    
+    class _cancelled(Exception): pass
+    
+    def start(self):
+        """
+        Starts the worker thread (and, if Qt is available, the timer that 
+        calls poll()).
+        """
+        if _s._qtc is not None and _s._qtapp is not None:
+            self._timer = _s._qtc.QTimer()
+            self._timer.setInterval(max(1, int(1000*min(self.progress_interval, 0.05))))
+            self._timer.timeout.connect(self.poll)
+            self._timer.start()
+        
+        self._thread.start()
+        return self
+    
+    def _run(self):
+        """
+        Worker: runs the fitter's optimization (as fit() does) with a hook 
+        that reports progress and stops at the next residual call after 
+        cancel().
+        """
+        f     = self.fitter
+        t0    = _time.time()
+        last  = [0.0]
+        calls = [0]
+        
+        def hook(p, r):
+            if self._cancel.is_set(): raise fit_job._cancelled()
+            calls[0] += 1
+            t = _time.time()
+            if self.progress and t-last[0] >= self.progress_interval:
+                last[0] = t
+                if r is None: chi2 = None
+                else:         chi2 = _sum_of_squares(r)
+                self._queue.put(('progress', dict(calls=calls[0], chi2=chi2, p=_n.array(p), elapsed=t-t0)))
+        
+        f._fit_hook = hook
+        try:
+            self._queue.put(('results', f._fit_results(**self.fit_kwargs)))
+        
+        # ODR reports exceptions from the model as RuntimeErrors
+        except BaseException as e:
+            if self._cancel.is_set(): self._queue.put(('cancelled', None))
+            else:                     self._queue.put(('error', e))
+        
+        finally:
+            f._fit_hook = None
+            self._done.set()
+    
+    def cancel(self):
+        """
+        Asks the fit to stop at its next iteration. The fitter's previous 
+        results are left untouched.
+        """
+        self._cancel.set()
+        return self
+    
+    def is_running(self):
+        """
+        Returns True until the worker thread has finished.
+        """
+        return not self._done.is_set()
+    
+    def poll(self):
+        """
+        Delivers the queued progress reports and, once the fit is over, the
+        results (or cancellation / error) in the calling thread. Returns True
+        once everything has been delivered.
+        """
+        import queue as _queue
+        
+        while True:
+            try:    kind, value = self._queue.get_nowait()
+            except _queue.Empty: break
+            
+            if kind == 'progress': 
+                if self.progress: self.progress(value)
+                continue
+            
+            # The end
+            self._finished = True
+            if self._timer is not None: self._timer.stop()
+            
+            if kind == 'results':
+                self.fitter.results = value
+                self.fitter._autoplot()
+                if self.callback: self.callback(self.fitter)
+            
+            elif kind == 'cancelled': 
+                self.cancelled = True
+            
+            else:
+                self.error = value
+                if not self.fitter['silent']: print('fit_async(): fit failed: '+repr(value))
+        
+        return self._finished
+    
+    def wait(self, timeout=None):
+        """
+        Blocks until the fit is over (or timeout seconds have passed), then
+        calls poll(). Returns the fitter.
+        """
+        self._thread.join(timeout)
+        self.poll()
+        return self.fitter
+
+
+
+###########################################
+# Incremental fitting of linear models
+###########################################
+
+class online_fitter():
+    """
+    Incremental (recursive) least-squares fitter for models that are linear 
+    in their parameters, i.e., 
+    
+        y = p0*basis[0](x) + p1*basis[1](x) + ...
+    
+    Rather than storing the data, this keeps only the weighted sufficient 
+    statistics (the p x p normal matrix, a p-element vector, and the 
+    weighted sum of y^2), so adding a point costs O(p^2) regardless of how 
+    much data has been added before. This is useful for refitting 
+    live-streaming data (e.g., a polynomial calibration) every time a new 
+    frame arrives.
+    
+    Parameters
+    ----------
+    basis=['1','x']
+        List of basis functions. Each can be a string of x (evaluated with
+        all of numpy and scipy.special, plus any keyword arguments) or a 
+        function f(x) returning an array (or a number).
+    pnames=None
+        Optional comma-delimited string or list of parameter names. None 
+        means 'p0, p1, ...'.
+    forgetting=1.0
+        Forgetting factor. Each time a point is added, the weight of all 
+        previous points is multiplied by this number, so values below 1 
+        (e.g., 0.999) let the fit follow drifting signals with an 
+        effective memory of 1/(1-forgetting) points.
+    
+    Additional keyword arguments are added to the globals used when 
+    evaluating string basis functions.
+    
+    Typical workflow
+    ----------------
+    my_fitter = online_fitter(['1','x','x**2'], 'a,b,c')
+    my_fitter.add(x, y, ey)                  (repeat as data arrive)
+    my_fitter.get_fit_results()
+    
+    Note that the normal equations square the condition number of the 
+    problem, so for high-order polynomials it helps to use a basis that is 
+    centered and scaled, e.g., '((x-x0)/w)**2'.
+    """
+    
+    def __init__(self, basis=['1','x'], pnames=None, forgetting=1.0, **kwargs):
+        
+        # make sure all the awesome stuff from numpy is visible.
+        self._globals = dict(_n.__dict__)
+        self._globals.update(_special.__dict__)
+        self._globals.update(kwargs)
+        
+        # Build the basis functions
+        if not _s.fun.is_iterable(basis): basis = [basis]
+        self.basis   = []
+        self._bnames = []
+        for b in basis:
+            if isinstance(b, str): 
+                self.basis.append(eval('lambda x: '+b, self._globals))
+                self._bnames.append(b)
+            else:
+                self.basis.append(b)
+                self._bnames.append(b.__name__)
+        
+        # Parameter names
+        if pnames is None:        pnames = ['p'+str(n) for n in range(len(self.basis))]
+        if isinstance(pnames, str): pnames = [s.strip() for s in pnames.split(',')]
+        if not len(pnames) == len(self.basis): 
+            raise ValueError("The number of pnames must match the number of basis functions.")
+        self._pnames = list(pnames)
+        
+        self.forgetting = forgetting
+        self.reset()
+    
+    def __repr__(self):
+        s = "<online_fitter: y = "
+        s = s + " + ".join([self._pnames[n]+"*("+self._bnames[n]+")" for n in range(len(self._pnames))])
+        return s + ", N="+str(self.N)+">"
+    
+    def reset(self):
+        """
+        Forgets all of the data.
+        """
+        p = len(self.basis)
+        self.N     = 0                 # Number of points added
+        self._A    = _n.zeros((p,p))   # sum of w*phi*phi^T/ey^2
+        self._b    = _n.zeros(p)       # sum of w*phi*y/ey^2
+        self._c    = 0.0               # sum of w*y^2/ey^2
+        self._w    = 0.0               # sum of weights w
+        self._w2   = 0.0               # sum of w^2
+        return self
+    
+    def _design_matrix(self, x):
+        """
+        Returns the (len(x), number of parameters) matrix of basis function
+        values.
+        """
+        X = _n.empty((len(x), len(self.basis)))
+        for n in range(len(self.basis)): X[:,n] = self.basis[n](x)
+        return X
+    
+    def add(self, x, y, ey=None):
+        """
+        Adds a point or block of points to the fit, updating the sufficient
+        statistics in O(number of points * number of parameters^2).
+        
+        Parameters
+        ----------
+        x, y
+            Number or array of x and y values.
+        ey=None
+            Number or array of y uncertainties. None means 1.
+        """
+        x = _n.atleast_1d(_n.array(x, dtype=float))
+        y = _n.atleast_1d(_n.array(y, dtype=float))
+        k = len(x)
+        if k == 0: return self
+        
+        # Weights from the forgetting factor (the newest point has weight 1)
+        # and the error bars
+        w = self.forgetting**_n.arange(k-1,-1,-1, dtype=float)
+        if ey is None: u = w
+        else:          u = w/_n.array(ey, dtype=float)**2 * _n.ones(k)
+        
+        # Age the existing statistics
+        decay = self.forgetting**k
+        X = self._design_matrix(x)
+        
+        # Update
+        self._A  = decay*self._A  + _n.dot(X.T*u, X)
+        self._b  = decay*self._b  + _n.dot(X.T, u*y)
+        self._c  = decay*self._c  + _n.dot(u, y*y)
+        self._w  = decay*self._w  + _n.sum(w)
+        self._w2 = decay*decay*self._w2 + _n.sum(w*w)
+        self.N  += k
+        
+        return self
+    
+    def get_pnames(self):
+        """
+        Returns a list of parameter names.
+        """
+        return list(self._pnames)
+    
+    def get_fit_parameters(self):
+        """
+        If there is enough data, returns values, errors.
+        """
+        r = self.get_fit_results()
+        if r is None: return None
+        return _n.array([r[k] for k in self._pnames]), _n.array([r[k+'.std'] for k in self._pnames])
+    
+    def degrees_of_freedom(self):
+        """
+        Returns the (effective) number of degrees of freedom. With a 
+        forgetting factor, the number of points is replaced by the Kish
+        effective sample size, (sum of weights)^2 / (sum of weights^2).
+        """
+        if self._w2 == 0: return 0.0
+        return self._w**2/self._w2 - len(self._pnames)
+    
+    def get_fit_results(self):
+        """
+        If there is enough data, returns a dictionary with all the fit 
+        results (in the same format as fitter.get_fit_results()).
+        """
+        if self.N < len(self._pnames): return None
+        
+        # Solve the normal equations
+        try: covariance = _n.linalg.inv(self._A)
+        except _n.linalg.LinAlgError: return None
+        p = _n.dot(covariance, self._b)
+        
+        d = dict()
+        for n in range(len(self._pnames)):
+            d[self._pnames[n]]        = p[n]
+            d[self._pnames[n]+'.std'] = covariance[n][n]**0.5
+        
+        # chi^2 from the sufficient statistics
+        chi2 = max(self._c - _n.dot(p, self._b), 0.0)
+        dof  = self.degrees_of_freedom()
+        
+        d['covariance']         = covariance
+        d['chi2']               = chi2
+        d['chi2s']              = [chi2]
+        d['reduced_chi2']       = _n.divide(chi2, dof)
+        d['reduced_chi2.std']   = _n.sqrt(_n.divide(2.0, dof))
+        d['reduced_chi2s']      = [d['reduced_chi2']]
+        d['degrees_of_freedom'] = dof
+        
+        return d
+    
+    def evaluate(self, x, p=None):
+        """
+        Evaluates the model at x with parameters p (None means use the 
+        current fit result).
+        """
+        if p is None: p = self.get_fit_parameters()[0]
+        x = _n.atleast_1d(_n.array(x, dtype=float))
+        return _n.dot(self._design_matrix(x), p)
+
+
+
+
 ############################
 # Dialogs for loading data
 ############################
@@ -248,33 +248,95 @@ class averager:
 
 
 
-def coarsen_array(a, level=2, method='mean'):
-    """
-    Returns a coarsened (binned) version of the data. Currently supports
-    any of the numpy array operations, e.g. min, max, mean, std, ...
+def _coarsen_quadrature(b, axis):
+    s = (b*b).sum(axis)
+    return _n.sqrt(s)/(b.size//max(s.size,1))
+
+def _coarsen_pick(b, axis, index):
+    if not isinstance(axis, tuple): axis = (axis,)
+    # Copy, so the result doesn't share memory with the input like the others
+    return b[tuple([index if k in axis else slice(None) for k in range(b.ndim)])].copy()
+
+# Reductions for coarsen_array() and coarsen_matrix(), each taking (b, axis), 
+# where b has the points of each bin along axis (an integer or tuple of axes)
+_coarsen_reductions = dict(
+    mean       = lambda b, axis: b.mean(axis),
+    sum        = lambda b, axis: b.sum(axis),
+    min        = lambda b, axis: b.min(axis),
+    max        = lambda b, axis: b.max(axis),
+    std        = lambda b, axis: b.std(axis),
+    median     = lambda b, axis: _n.median(b, axis),
+    quadrature = _coarsen_quadrature,
+    rms        = lambda b, axis: _n.sqrt((b*b).mean(axis)),
+    first      = lambda b, axis: _coarsen_pick(b, axis, 0),
+    last       = lambda b, axis: _coarsen_pick(b, axis, -1))
+_coarsen_reductions['average'] = _coarsen_reductions['mean']
+_coarsen_reductions['maximum'] = _coarsen_reductions['max']
+_coarsen_reductions['minimum'] = _coarsen_reductions['min']
+
+# Element-wise equivalents of some reductions (see coarsen_matrix())
+_coarsen_ufuncs = dict(min=_n.minimum, minimum=_n.minimum, max=_n.maximum, maximum=_n.maximum)
+
+def coarsen_array(a, level=2, method='mean', axis=0, tail='drop'):
+    """
+    Returns a coarsened (binned) version of the data, reducing every level
+    points along the specified axis to one.
     
-    level=2 means every two data points will be binned.
-    level=0 or 1 just returns a copy of the array
+    Parameters
+    ----------
+    a
+        Array (or list) to coarsen. Can be N-dimensional.
+    level=2
+        Number of points per bin. level=0 or 1 just returns a copy of the 
+        array.
+    method='mean'
+        How to reduce each bin. Can be 'mean' (or 'average'), 'sum', 'min' 
+        (or 'minimum'), 'max' (or 'maximum'), 'std', 'median', 'rms', 
+        'first', 'last', or 'quadrature' (the error of the mean of 
+        uncorrelated points with these error bars, sqrt(sum(a**2))/N). Can 
+        also be a function f(b, axis) reducing the array b along axis.
+    axis=0
+        Axis along which to coarsen.
+    tail='drop'
+        What to do with the points left over at the end when the length is
+        not a multiple of level: 'drop' them, 'pad' them to a full bin by 
+        repeating the last point, or reduce them as a 'partial' (smaller) bin.
     """
     if a is None: return None    
     
-    # make sure it's a numpy array, and that we don't destroy the original.
-    a = _n.array(a)
-    
     # Make sure it's an integer!
     level=int(level)
     
-    # quickest option
-    if level in [0,1,False]: return a
-
-    # otherwise assemble the python code to execute
-    code = 'a.reshape(-1, level).'+method+'(axis=1)'
-
-    # execute, making sure the array can be reshaped!
-    try: return eval(code, dict(a=a[0:int(len(a)/level)*level], level=level))
-    except:
+    # quickest option (makes sure we don't destroy the original)
+    if level in [0,1,False]: return _n.array(a)
+    
+    # Get the reduction
+    if callable(method): f = method
+    elif method in _coarsen_reductions: f = _coarsen_reductions[method]
+    else:
         print("ERROR: Could not coarsen array with method "+repr(method))
-        return a
+        return _n.array(a)
+    
+    if not tail in ['drop', 'pad', 'partial']:
+        raise ValueError("tail must be 'drop', 'pad', or 'partial'.")
+    
+    a    = _n.asarray(a)
+    axis = axis % a.ndim
+    N    = a.shape[axis]
+    M    = N - N%level
+    
+    # Reduce the full bins, reshaped to (..., bins, level, ...) (a view if possible)
+    i    = (slice(None),)*axis
+    b    = a[i+(slice(0,M),)].reshape(a.shape[:axis] + (M//level, level) + a.shape[axis+1:])
+    c    = f(b, axis+1)
+    if M == N or tail == 'drop': return c
+    
+    # Reduce the leftover points as one more bin
+    rest = a[i+(slice(M,N),)]
+    if tail == 'pad':
+        pad  = _n.repeat(a[i+(slice(N-1,N),)], level-(N-M), axis)
+        rest = _n.concatenate([rest, pad], axis)
+    return _n.concatenate([c, f(_n.expand_dims(rest, axis), axis+1)], axis)
 
 def coarsen_data(x, y, ey=None, ex=None, level=2, exponential=False):
     """
@@ -285,10 +347,14 @@ def coarsen_data(x, y, ey=None, ex=None, level=2, exponential=False):
     ----------
     x, y
         Data arrays. Can be lists (will convert to numpy arrays).
-        These are coarsened by taking an average.
+        These are coarsened by taking an average. y can also be a list of 
+        arrays or 2D array (one row per column of data, e.g., all the columns
+        of a databox), in which case all the rows are coarsened in one pass.
     ey=None, ex=None
         y and x uncertainties. Accepts arrays, lists, or numbers. 
-        These are coarsened by averaging in quadrature.
+        These are coarsened by averaging in quadrature. For multiple y rows,
+        ey can be a single array (or number) for all rows, or a list with 
+        one array (or number) per row.
     level=2
         For linear coarsening (default, see below), every n=level points will
         be averaged together (in quadrature for errors). For exponential
@@ -301,62 +367,55 @@ def coarsen_data(x, y, ey=None, ex=None, level=2, exponential=False):
         exponentially spaced by the specified level. 
     """
     
+    # Make sure the data are arrays, with errors matching the data shapes
+    x = _n.asarray(x)
+    y = _n.asarray(y)
+    if not ey is None: 
+        if y.ndim > 1 and isinstance(ey, (list, tuple)) and len(ey) == len(y):
+            ey = _n.array([_n.broadcast_to(e, y.shape[1:]) for e in ey])
+        else: 
+            ey = _n.broadcast_to(_n.asarray(ey), y.shape)
+    if not ex is None: ex = _n.broadcast_to(_n.asarray(ex), x.shape)
+    
     # Normal coarsening
     if not exponential:
         
-        # Coarsen the data
-        xc  = coarsen_array(x, level, 'mean')
-        yc  = coarsen_array(y, level, 'mean')
-        
-        # Coarsen the y error in quadrature
-        if not ey is None:
-            if not is_iterable(ey): ey = [ey]*len(y)
-            eyc = _n.sqrt(coarsen_array(_n.power(ey,2)/level, level, 'mean'))
-        
-        # Coarsen the x error in quadrature
-        if not ex is None:
-            if not is_iterable(ey): ex = [ex]*len(x)
-            exc = _n.sqrt(coarsen_array(_n.power(ex,2)/level, level, 'mean'))
+        # Coarsen the data (each row of y), and the errors in quadrature
+        xc  = coarsen_array(x, level, 'mean', -1)
+        yc  = coarsen_array(y, level, 'mean', -1)
+        if not ey is None: eyc = coarsen_array(ey, level, 'quadrature', -1)
+        if not ex is None: exc = coarsen_array(ex, level, 'quadrature', -1)
         
     # Exponential coarsen    
     else:
-        # Make sure the data are arrays
-        x = _n.array(x)
-        y = _n.array(y)
-        
-        # Create the new arrays to fill
-        xc = []
-        yc = []
-        if not ey is None: 
-            if not is_iterable(ey): ey = _n.array([ey]*len(y))
-            eyc = []
-        if not ex is None:
-            if not is_iterable(ex): ex = _n.array([ex]*len(x))
-            exc = []
         
         # Find the first element that is greater than zero    
         x0 = x[x>0][0]
         
-        # Now loop over the exponential bins
-        n  = 0
-        while x0*level**n < x[-1]:
-            
-            # Get all the points between x[n] and x[n]*r
-            mask = _n.logical_and(x0*level**n <= x, x < x0*level**(n+1))
-                    
-            # Only do something if points exist from this range!
-            if len(x[mask]):
-                
-                # Take the average x value
-                xc.append(_n.average(x[mask]))
-                yc.append(_n.average(y[mask]))
-            
-                # do the errors in quadrature
-                if not ey is None: eyc.append(_n.sqrt(_n.average((ey**2)[mask])/len(ey[mask])))
-                if not ex is None: exc.append(_n.sqrt(_n.average((ex**2)[mask])/len(ex[mask])))
-            
-            # Increment the counter
-            n += 1
+        # Bin edges x0*level**n, up to the first one beyond the last point
+        edges = [x0]
+        while edges[-1] < x[-1]: edges.append(x0*level**len(edges))
+        edges = _n.array(edges)
+        M     = len(edges)-1
+        
+        # Bin index of each point; points outside all the bins are dropped
+        i    = _n.searchsorted(edges, x, side='right')-1
+        keep = _n.logical_and(i >= 0, i < M)
+        i    = i[keep]
+        
+        # Sums over each (non-empty) bin, for each row of a
+        N  = _n.bincount(i, minlength=M)
+        ok = N > 0
+        N  = N[ok]
+        def bin_sums(a):
+            if a.ndim == 1: return _n.bincount(i, a[keep], M)[ok]
+            return _n.array([bin_sums(r) for r in a])
+        
+        # Average the points, and do the errors in quadrature
+        xc = bin_sums(x) / N
+        yc = bin_sums(y) / N
+        if not ey is None: eyc = _n.sqrt(bin_sums(_n.power(ey,2))) / N
+        if not ex is None: exc = _n.sqrt(bin_sums(_n.power(ex,2))) / N
         
         # Done exponential loop
 
@@ -369,41 +428,72 @@ def coarsen_data(x, y, ey=None, ex=None, level=2, exponential=False):
         
         
 
-def coarsen_matrix(Z, xlevel=0, ylevel=0, method='average'):
-    """
-    This returns a coarsened numpy matrix.
-
-    method can be 'average', 'maximum', or 'minimum'
+def coarsen_matrix(Z, xlevel=0, ylevel=0, method='average', tail='drop'):
     """
-
-    # coarsen x
-    if not ylevel:
-        Z_coarsened = Z
+    Returns a coarsened version of the 2D array Z, reducing each block of 
+    xlevel by ylevel elements (along the first and second index of Z, 
+    respectively) to one. The blocks are reduced in one step on a 
+    reshaped view of Z.
+    
+    Parameters
+    ----------
+    Z
+        2D array to coarsen.
+    xlevel=0, ylevel=0
+        Block size along the first and second index. 0 or 1 means no 
+        coarsening along that index.
+    method='average'
+        How to reduce each block; see coarsen_array() for the options.
+    tail='drop'
+        What to do with the leftover rows and columns when the shape is not 
+        a multiple of the block size: 'drop' them, 'pad' them to full blocks 
+        by repeating the last row / column, or reduce them as 'partial' 
+        (smaller) blocks.
+    """
+    Z = _n.asarray(Z)
+    lx, ly = max(int(xlevel),1), max(int(ylevel),1)
+    
+    # quickest option (makes sure we don't destroy the original)
+    if lx == 1 and ly == 1: return _n.array(Z)
+    
+    # Get the reduction
+    if callable(method): f = method
+    elif method in _coarsen_reductions: f = _coarsen_reductions[method]
     else:
-        temp = []
-        for z in Z: temp.append(coarsen_array(z, ylevel, method))
-        Z_coarsened = _n.array(temp)
-
-    # coarsen y
-    if xlevel:
-        Z_coarsened = Z_coarsened.transpose()
-        temp = []
-        for z in Z_coarsened: temp.append(coarsen_array(z, xlevel, method))
-        Z_coarsened = _n.array(temp).transpose()
-
-    return Z_coarsened
-
-
-
-    # first coarsen the columns (if necessary)
-    if ylevel:
-        Z_ycoarsened = []
-        for c in Z: Z_ycoarsened.append(coarsen_array(c, ylevel, method))
-        Z_ycoarsened = _n.array(Z_ycoarsened)
-
-    # now coarsen the rows
-    if xlevel: return coarsen_array(Z_ycoarsened, xlevel, method)
-    else:      return _n.array(Z_ycoarsened)
+        print("ERROR: Could not coarsen matrix with method "+repr(method))
+        return _n.array(Z)
+    
+    if not tail in ['drop', 'pad', 'partial']:
+        raise ValueError("tail must be 'drop', 'pad', or 'partial'.")
+    
+    if tail == 'pad': 
+        Z = _n.pad(Z, [(0, -Z.shape[0]%lx), (0, -Z.shape[1]%ly)], mode='edge')
+    
+    # Reduces a block-divisible array with the supplied block size. numpy's 
+    # min / max are slow along short axes, so for small blocks these combine
+    # strided slices instead.
+    u = _coarsen_ufuncs.get(method) if not callable(method) else None
+    def reduce(A, bx, by): 
+        if u is None or bx*by > 64:
+            return f(A.reshape(A.shape[0]//bx, bx, A.shape[1]//by, by), (1,3))
+        B = _n.array(A[:, 0::by])
+        for j in range(1, by): u(B, A[:, j::by], out=B)
+        C = _n.array(B[0::bx])
+        for i in range(1, bx): u(C, B[i::bx], out=C)
+        return C
+    
+    Nx, Ny = Z.shape
+    Mx, My = Nx-Nx%lx, Ny-Ny%ly
+    C = reduce(Z[0:Mx, 0:My], lx, ly)
+    if tail != 'partial' or (Mx == Nx and My == Ny): return C
+    
+    # Leftover columns, then the leftover rows (and corner)
+    if My < Ny: C = _n.concatenate([C, reduce(Z[0:Mx, My:], lx, Ny-My)], 1)
+    if Mx < Nx:
+        R = reduce(Z[Mx:, 0:My], Nx-Mx, ly)
+        if My < Ny: R = _n.concatenate([R, reduce(Z[Mx:, My:], Nx-Mx, Ny-My)], 1)
+        C = _n.concatenate([C, R], 0)
+    return C
 
 
 def erange(start, end, steps):
@@ -591,15 +681,11 @@ def derivative(xdata, ydata):
     performs d(ydata)/d(xdata) with nearest-neighbor slopes
     must be well-ordered, returns new arrays [xdata, dydx_data]
 
-    neighbors:
+    The end points are dropped; handles non-uniform spacing.
     """
-    D_ydata = []
-    D_xdata = []
-    for n in range(1, len(xdata)-1):
-        D_xdata.append(xdata[n])
-        D_ydata.append((ydata[n+1]-ydata[n-1])/(xdata[n+1]-xdata[n-1]))
-
-    return [D_xdata, D_ydata]
+    x = _n.asarray(xdata)
+    y = _n.asarray(ydata)
+    return [x[1:-1], (y[2:]-y[:-2])/(x[2:]-x[:-2])]
 
 def derivative_fit(xdata, ydata, neighbors=1):
     """
@@ -610,27 +696,30 @@ def derivative_fit(xdata, ydata, neighbors=1):
 
     neighbors   How many data point on the left and right to include.
     """
-
-    x    = []
-    dydx = []
-    nmax = len(xdata)-1
-
-    for n in range(nmax+1):
-        # get the indices of the data to fit
-        i1 = max(0, n-neighbors)
-        i2 = min(nmax, n+neighbors)
-
-        # get the sub data to fit
-        xmini = _n.array(xdata[i1:i2+1])
-        ymini = _n.array(ydata[i1:i2+1])
-
-        slope, intercept = fit_linear(xmini, ymini)
-
-        # make x the average of the xmini
-        x.append(float(sum(xmini))/len(xmini))
-        dydx.append(slope)
-
-    return _n.array(x), _n.array(dydx)
+    x = _n.array(xdata, dtype=float)
+    y = _n.array(ydata, dtype=float)
+    N = len(x)
+    
+    # Window sums of x and y relative to each point (which keeps the sums 
+    # small and precise), accumulated one neighbor offset at a time. At the
+    # ends, the windows are truncated.
+    n   = _n.zeros(N)
+    sx  = _n.zeros(N)
+    sy  = _n.zeros(N)
+    sxx = _n.zeros(N)
+    sxy = _n.zeros(N)
+    for d in range(-neighbors, neighbors+1):
+        i1, i2 = max(0, -d), min(N, N-d)
+        dx = x[i1+d:i2+d]-x[i1:i2]
+        dy = y[i1+d:i2+d]-y[i1:i2]
+        n  [i1:i2] += 1
+        sx [i1:i2] += dx
+        sy [i1:i2] += dy
+        sxx[i1:i2] += dx*dx
+        sxy[i1:i2] += dx*dy
+    
+    # Least-squares slope, and the average x of each window
+    return x+sx/n, (sxy-sx*sy/n)/(sxx-sx*sx/n)
 
 def difference(ydata1, ydata2):
     """
@@ -675,22 +764,18 @@ def distort_matrix_X(Z, X, f, new_xmin, new_xmax, subsample=3):
     target_old_x = max(X)
     new_xmax = find_zero_bisect(zero_me, new_xmin, new_xmax, _n.abs(new_xmax-new_xmin)*0.0001)
 
-    # now loop over all the new x values
-    new_X = []
-    new_Z = []
+    # all the new x values, and their old x values
     bin_width = float(new_xmax-new_xmin)/(points)
-    for new_x in frange(new_xmin, new_xmax, bin_width):
-
-        # make sure we're in the range of X
-        if f(new_x) <= max(X) and f(new_x) >= min(X):
-
-            # add this guy to the array
-            new_X.append(new_x)
-
-            # get the interpolated column
-            new_Z.append( interpolate(X,Z,f(new_x)) )
-
-    return _n.array(new_Z), _n.array(new_X)
+    new_X = frange(new_xmin, new_xmax, bin_width)
+    try:    old_X = _n.broadcast_to(f(new_X), new_X.shape).astype(float)
+    except: old_X = _n.array([f(new_x) for new_x in new_X], dtype=float)
+    
+    # make sure we're in the range of X
+    keep  = (old_X <= max(X)) & (old_X >= min(X))
+    new_X = new_X[keep]
+    
+    # get the interpolated columns all at once
+    return interpolate(X, Z, old_X[keep]), new_X
 
 
 
@@ -711,7 +796,7 @@ def distort_matrix_Y(Z, Y, f, new_ymin, new_ymax, subsample=3):
 
     # just use the same methodology as before by transposing, distorting X, then
     # transposing back
-    new_Z, new_Y = distort_matrix_X(Z.transpose(), Y, f, new_ymin, new_ymax, subsample)
+    new_Z, new_Y = distort_matrix_X(_n.transpose(Z), Y, f, new_ymin, new_ymax, subsample)
     return new_Z.transpose(), new_Y
 
 
@@ -790,94 +875,85 @@ def equalize_list_lengths(a,b):
 
 def find_N_peaks(array, N=4, max_iterations=100, rec_max_iterations=3, recursion=1):
     """
-    This will run the find_peaks algorythm, adjusting the baseline until exactly N peaks are found.
+    Returns a list of the indices (in ascending order) of the N most 
+    prominent peaks in array, or None if there are fewer than N peaks. 
+    
+    The prominence of a peak is how far it rises above the higher of the
+    two minima separating it from higher peaks (or the ends of the data); see 
+    scipy.signal.peak_prominences(). The remaining arguments are ignored, 
+    and only kept for compatibility with the previous (baseline bisection) 
+    algorithm.
     """
-
-    if recursion<0: return None
-
-    # get an initial guess as to the baseline
-    ymin = min(array)
-    ymax = max(array)
-
-    for n in range(max_iterations):
-
-        # bisect the range to estimate the baseline
-        y1 = (ymin+ymax)/2.0
-
-        # now see how many peaks this finds. p could have 40 for all we know
-        p, s, i = find_peaks(array, y1, True)
-
-        # now loop over the subarrays and make sure there aren't two peaks in any of them
-        for n in range(len(i)):
-            # search the subarray for two peaks, iterating 3 times (75% selectivity)
-            p2 = find_N_peaks(s[n], 2, rec_max_iterations, rec_max_iterations=rec_max_iterations, recursion=recursion-1)
-
-            # if we found a double-peak
-            if not p2 is None:
-                # push these non-duplicate values into the master array
-                for x in p2:
-                    # if this point is not already in p, push it on
-                    if not x in p: p.append(x+i[n]) # don't forget the offset, since subarrays start at 0
-
-
-        # if we nailed it, finish up
-        if len(p) == N: return p
-
-        # if we have too many peaks, we need to increase the baseline
-        if len(p) > N: ymin = y1
-
-        # too few? decrease the baseline
-        else:          ymax = y1
-
-    return None
+    import scipy.signal as _signal
+    
+    a = _n.asarray(array, dtype=float)
+    
+    # All local maxima, sorted by prominence
+    candidates = _signal.find_peaks(a)[0]
+    if len(candidates) < N: return None
+    prominences = _signal.peak_prominences(a, candidates)[0]
+    best = _n.argsort(-prominences, kind='stable')[0:N]
+    
+    return sorted([int(i) for i in candidates[best]])
 
 
-def find_peaks(array, baseline=0.1, return_subarrays=False):
+def find_peaks(array, baseline=0.1, return_subarrays=False, prominence=None, width=None):
     """
     This will try to identify the indices of the peaks in array, returning a list of indices in ascending order.
 
-    Runs along the data set until it jumps above baseline. Then it considers all the subsequent data above the baseline
-    as part of the peak, and records the maximum of this data as one peak value.
-    """
-
-    peaks = []
-
-    if return_subarrays:
-        subarray_values  = []
-        subarray_indices = []
-
-    # loop over the data
-    n = 0
-    while n < len(array):
-        # see if we're above baseline, then start the "we're in a peak" loop
-        if array[n] > baseline:
-
-            # start keeping track of the subarray here
-            if return_subarrays:
-                subarray_values.append([])
-                subarray_indices.append(n)
-
-            # find the max
-            ymax=baseline
-            nmax = n
-            while n < len(array) and array[n] > baseline:
-                # add this value to the subarray
-                if return_subarrays:
-                    subarray_values[-1].append(array[n])
-
-                if array[n] > ymax:
-                    ymax = array[n]
-                    nmax = n
-
-                n = n+1
-
-            # store the max
-            peaks.append(nmax)
-
-        else: n = n+1
-
-    if return_subarrays: return peaks, subarray_values, subarray_indices
-    else:                return peaks
+    Each run of consecutive data above the baseline is considered one peak, 
+    and the index of its maximum is recorded as the peak position.
+    
+    Parameters
+    ----------
+    array
+        Data array.
+    baseline=0.1
+        Data must rise above this value to be part of a peak.
+    return_subarrays=False
+        If True, also return a list of the data in each peak, and a list of 
+        the index at which each of these starts.
+    prominence=None, width=None
+        If specified, only keep peaks with at least this prominence, or at
+        least this width (in points, at half the prominence); see 
+        scipy.signal.peak_prominences() and peak_widths().
+    """
+    a = _n.asarray(array)
+    if a.size == 0: 
+        if return_subarrays: return [], [], []
+        return []
+    
+    # Start and end (exclusive) of each run above the baseline
+    above  = a > baseline
+    edges  = _n.diff(_n.concatenate([[0], above.astype(_n.int8), [0]]))
+    starts = _n.where(edges ==  1)[0]
+    ends   = _n.where(edges == -1)[0]
+    
+    # Maximum of each run (values outside the runs can't win), and the 
+    # index of its first occurrence
+    if len(starts):
+        masked = _n.where(above, a, a[above].min() if above.any() else 0)
+        ymax   = _n.maximum.reduceat(masked, starts)
+        run    = _n.cumsum(edges[:-1] == 1)-1
+        first  = _n.where(above & (masked == ymax[run]))[0]
+        peaks  = first[_n.unique(run[first], return_index=True)[1]]
+    else: 
+        peaks = _n.array([], dtype=int)
+    
+    # Filters
+    keep = _n.ones(len(peaks), dtype=bool)
+    if len(peaks) and (prominence is not None or width is not None):
+        import scipy.signal as _signal
+        p = _signal.peak_prominences(a, peaks)
+        if prominence is not None: keep &= p[0] >= prominence
+        if width      is not None: keep &= _signal.peak_widths(a, peaks, 0.5, p)[0] >= width
+    
+    peaks = [int(i) for i in peaks[keep]]
+    if not return_subarrays: return peaks
+    
+    starts = starts[keep]
+    ends   = ends[keep]
+    return peaks, [a[starts[n]:ends[n]] for n in range(len(starts))], [int(i) for i in starts]
 
 
 def find_two_peaks(data, remove_background=True):
@@ -1217,30 +1293,31 @@ def integrate_data(xdata, ydata, xmin=None, xmax=None, autozero=0):
     imin = xdata.searchsorted(xmin)
     imax = xdata.searchsorted(xmax)
 
-    xint = [xdata[imin]]
-    yint = [0]
-
     # get the autozero
     if autozero >= 1:
         zero = _n.average(ydata[imin:imin+int(autozero)])
         ydata = ydata-zero
+    
+    # cumulative trapezoids, starting from zero at xdata[imin]
+    x = xdata[imin:max(imax, imin+1)]
+    y = ydata[imin:max(imax, imin+1)]
+    yint = _n.zeros(len(x))
+    _n.cumsum(0.5*_n.diff(x)*(y[1:]+y[:-1]), out=yint[1:])
 
-    for n in range(imin+1,imax):
-        if len(yint):
-            xint.append(xdata[n])
-            yint.append(yint[-1]+0.5*(xdata[n]-xdata[n-1])*(ydata[n]+ydata[n-1]))
-        else:
-            xint.append(xdata[n])
-            yint.append(0.5*(xdata[n]-xdata[n-1])*(ydata[n]+ydata[n-1]))
-
-    return _n.array(xint), _n.array(yint)
+    return x, yint
 
 def interpolate(xarray, yarray, x, rigid_limits=True):
     """
 
     returns the y value of the linear interpolated function
-    y(x). Assumes increasing xarray!
+    y(x). x can be a number or an array of values. yarray can also be 
+    a matrix, in which case rows of yarray are interpolated.
+    
+    Monotonic (increasing or decreasing) xarray is fastest, using a binary
+    search. Otherwise, the first pair of points bracketing x is used.
 
+    rigid_limits=True means when x is outside xarray's range, return None
+    (for a single x), or NaN (for each such element of an array x).
     rigid_limits=False means when x is outside xarray's range,
     use the endpoint as the y-value.
 
@@ -1248,27 +1325,45 @@ def interpolate(xarray, yarray, x, rigid_limits=True):
     if not len(xarray) == len(yarray):
         print("lengths don't match.", len(xarray), len(yarray))
         return None
-    if x < xarray[0] or x > xarray[-1]:
-        if rigid_limits:
-            print("x=" + str(x) + " is not in " + str(min(xarray)) + " to " + str(max(xarray)))
-            return None
-        else:
-            if x < xarray[0]: return yarray[0]
-            else:             return yarray[-1]
-
-    # find the index of the first value in xarray higher than x
-    for n2 in range(1, len(xarray)):
-        if x >= min(xarray[n2], xarray[n2-1]) and x <= max(xarray[n2], xarray[n2-1]):
-            break
-        if n2 == len(xarray):
-            print("couldn't find x anywhere.")
-            return None
+    
+    xa = _n.asarray(xarray, dtype=float)
+    ya = _n.asarray(yarray)
+    xs = _n.asarray(x, dtype=float)
+    x  = _n.atleast_1d(xs)
+    
+    # Points outside the range
+    xmin, xmax = xa.min(), xa.max()
+    outside = (x < xmin) | (x > xmax)
+    if xs.ndim == 0 and outside[0] and rigid_limits:
+        print("x=" + str(xs) + " is not in " + str(xmin) + " to " + str(xmax))
+        return None
+    
+    # Find the indices n1, n2=n1+1 surrounding each x value
+    d = _n.diff(xa)
+    if   _n.all(d >= 0): n2 = _n.searchsorted(xa, x, side='left')
+    elif _n.all(d <= 0): n2 = len(xa) - _n.searchsorted(xa[::-1], x, side='right')
+    else:
+        # first bracketing pair, one pair at a time
+        n2 = _n.zeros(len(x), dtype=int)
+        for k in range(len(xa)-1, 0, -1):
+            n2[(x >= min(xa[k], xa[k-1])) & (x <= max(xa[k], xa[k-1]))] = k
+    n2 = _n.clip(n2, 1, max(len(xa)-1, 1))
     n1 = n2-1
-
-    # now we have the indices surrounding the x value
-    # interpolate!
-
-    return yarray[n1] + (x-xarray[n1])*(yarray[n2]-yarray[n1])/(xarray[n2]-xarray[n1])
+    
+    # now interpolate! (clamping to the ends)
+    dx = xa[n2]-xa[n1]
+    with _n.errstate(divide='ignore', invalid='ignore'):
+        w = _n.where(dx == 0, 0.0, (_n.clip(x, xmin, xmax)-xa[n1])/dx)
+    w = w.reshape((-1,)+(1,)*(ya.ndim-1))
+    y = ya[n1] + w*(ya[n2]-ya[n1])
+    
+    # NaN outside the range
+    if rigid_limits and outside.any():
+        y = _n.array(y, dtype=_n.result_type(y, float))
+        y[outside] = _n.nan
+    
+    if xs.ndim == 0: return y[0]
+    return y.reshape(xs.shape + ya.shape[1:])
 
 
 
@@ -1338,7 +1433,7 @@ def _load_object(path=None, text="Load a pickled object."):
     return object
 
 
-def fft(t, y, pow2=False, window=None, rescale=False):
+def fft(t, y, pow2=False, window=None, rescale=False, plan=None, workers=None):
     """
     FFT of y, assuming complex or real-valued inputs. This goes through the 
     numpy fourier transform process, assembling and returning (frequencies, 
@@ -1352,7 +1447,8 @@ def fft(t, y, pow2=False, window=None, rescale=False):
         
     pow2 = False
         Set this to true if you only want to keep the first 2^n data
-        points (speeds up the FFT substantially)
+        points (speeds up the FFT substantially). See also plan, which 
+        discards far less data.
 
     window = None
         Can be set to any of the windowing functions in numpy that require only
@@ -1363,54 +1459,153 @@ def fft(t, y, pow2=False, window=None, rescale=False):
         If True, the FFT will be rescaled by the square root of the ratio of 
         variances before and after windowing, such that the sum of component 
         amplitudes squared is equal to the actual variance.
+    
+    plan = None
+        How to choose an efficient transform length (one with only small 
+        prime factors; see next_fast_length()). None uses all the data 
+        as is, 'pad' zero-pads the (windowed) data up to the next efficient
+        length (giving finer frequency spacing), and 'crop' keeps only the
+        first points, down to the previous efficient length (typically 
+        discarding much less than pow2).
+    
+    workers = None
+        Number of threads for the transform, if scipy.fft is available.
+    
+    Returns frequencies (read-only, and shared between calls with the same 
+    length and time step), complex fft.
     """
-    # make sure they're numpy arrays, and make copies to avoid the referencing error
-    y = _n.array(y)
-    t = _n.array(t)
+    # make sure they're numpy arrays
+    y = _n.asarray(y)
+    dt = t[1]-t[0]
 
     # if we're doing the power of 2, do it
-    if pow2:
-        keep  = 2**int(_n.log2(len(y)))
-
-        # now resize the data
-        y.resize(keep)
-        t.resize(keep)
+    N = len(y)
+    if pow2: N = 2**int(_n.log2(N))
+    
+    # Plan the transform length
+    M = N
+    if   plan == 'pad':  M = next_fast_length(N)
+    elif plan == 'crop': N = M = _previous_fast_length(N)
+    elif plan is not None: raise ValueError("plan must be None, 'pad', or 'crop'.")
+    y = y[0:N]
 
     # Window the data
-    if not window in [None, 'None', False, 'False', 0, '0']:
-        try:
-            # Get the windowing array
-            w = eval("_n."+window, dict(_n=_n))(len(y))
-            
-            # Store the original variance
-            v0 = _n.average(abs(y)**2)
-            
-            # window the time domain data 
-            y = y * w
-            
-            # Rescale by the variance ratio
-            if rescale: y = y * _n.sqrt(v0 / _n.average(abs(y)**2))
-            
-        except:
-            print("ERROR: Bad window!")
-            return
+    try: w = _get_window(window, N)
+    except ValueError:
+        print("ERROR: Bad window!")
+        return
+    
+    if w is not None:
+        # Store the original variance
+        v0 = _n.average(abs(y)**2)
+        
+        # window the time domain data 
+        y = y * w
+        
+        # Rescale by the variance ratio
+        if rescale: y = y * _n.sqrt(v0 / _n.average(abs(y)**2))
 
-    # do the actual fft, and normalize
-    Y = _n.fft.fftshift( _n.fft.fft(y) / len(t) )
-    f = _n.fft.fftshift( _n.fft.fftfreq(len(t), t[1]-t[0]) )
+    # do the actual fft (zero-padded to M points), and normalize by the 
+    # number of data points
+    Y = _n.fft.fftshift( _fft(y, M, workers) / N )
+    f = _get_frequencies(M, dt).copy() # the caller's to modify
     
     return f, Y
+
+def _fft(y, M, workers=None):
+    """
+    Returns the M-point fft of y, using scipy.fft (with workers) if available.
+    """
+    try: import scipy.fft as _scipy_fft
+    except ImportError: return _n.fft.fft(y, M)
+    return _scipy_fft.fft(y, M, workers=workers)
+
+def next_fast_length(N):
+    """
+    Returns the smallest length >= N that the FFT handles efficiently, i.e., 
+    having only small prime factors: scipy.fft.next_fast_len() when 
+    available, otherwise the next number having only 2, 3, and 5.
+    """
+    try: 
+        import scipy.fft as _scipy_fft
+        return int(_scipy_fft.next_fast_len(int(N)))
+    except ImportError: 
+        n = max(int(N), 1)
+        while not _is_5_smooth(n): n += 1
+        return n
+
+def _previous_fast_length(N):
+    """
+    Returns the largest length <= N having only the prime factors 2, 3, and 5.
+    """
+    n = max(int(N), 1)
+    while not _is_5_smooth(n): n -= 1
+    return n
+
+def _is_5_smooth(n):
+    for p in [2,3,5]:
+        while n % p == 0: n //= p
+    return n == 1
+
+# Frequency arrays by (length, time step), see _get_frequencies()
+_frequency_cache = dict()
+
+def _get_frequencies(M, dt):
+    """
+    Returns the (read-only, cached) fftshift-ed frequencies of an M-point 
+    fft with time step dt.
+    """
+    key = (M, dt)
+    if not key in _frequency_cache:
+        if len(_frequency_cache) > 32: _frequency_cache.clear()
+        f = _n.fft.fftshift(_n.fft.fftfreq(M, dt))
+        f.setflags(write=False)
+        _frequency_cache[key] = f
+    return _frequency_cache[key]
     
 
 
 
 
 
-def psd(t, y, pow2=False, window=None, rescale=False):
+# Window arrays by (name, length), see _get_window()
+_window_cache = dict()
+
+def _get_window(window, N):
     """
-    Single-sided power spectral density, assuming real valued inputs. This goes 
+    Returns the (read-only, cached) window array of length N for the name 
+    of one of numpy's windowing functions (e.g., 'hanning'), or None for 
+    no window (None, 'None', False, 'False', 0, '0').
+    """
+    if window in [None, 'None', False, 'False', 0, '0']: return None
+    
+    key = (window, N)
+    if not key in _window_cache:
+        if len(_window_cache) > 32: _window_cache.clear()
+        # Anything that fails (unknown names, windows needing more arguments
+        # like 'kaiser') is a bad window
+        try: w = _n.asarray(getattr(_n, window)(N), dtype=float)
+        except Exception: raise ValueError("Bad window "+repr(window))
+        if not w.shape == (N,): raise ValueError("Bad window "+repr(window))
+        w.setflags(write=False)
+        _window_cache[key] = w
+    return _window_cache[key]
+
+def _median_bias(K):
+    """
+    Returns the (approximate) ratio of the median to the mean of K 
+    periodograms, each chi-squared distributed with 2 degrees of freedom.
+    """
+    i = 2*_n.arange(1, (K-1)//2+1)
+    return 1 + _n.sum(1.0/(i+1) - 1.0/i)
+
+def psd(t, y, pow2=False, window=None, rescale=False, segment=None, overlap=0.5, average='mean', plan=None, workers=None):
+    """
+    Single-sided power spectral density. This goes 
     through the numpy fourier transform process, assembling and returning
-    (frequencies, psd) given time and signal data y. 
+    (frequencies, psd) given time and signal data y. For complex y, the
+    power at each negative frequency is added to that at the corresponding
+    positive frequency.
     
     Note it is defined such that sum(psd)*df, where df is the frequency
     spacing, is the variance of the original signal for any range of frequencies.
@@ -1439,16 +1634,50 @@ def psd(t, y, pow2=False, window=None, rescale=False):
         If True, the FFT will be rescaled by the square root of the ratio of 
         variances before and after windowing, such that the integral 
         sum(PSD)*df is the variance of the *original* time-domain data.
+    
+    segment = None
+        If specified, compute a Welch estimate instead: the PSDs of 
+        (overlapping) segments of this many points are averaged, giving a 
+        less noisy spectrum with frequency spacing 1/(segment*dt). The 
+        segments are windowed and transformed in batches (pow2 is ignored,
+        and plan is not allowed).
+    
+    overlap = 0.5
+        Fraction of each segment overlapping the next one (for segment).
+    
+    average = 'mean'
+        How to average the segments' PSDs (for segment). Can be 'mean' or
+        'median' (robust against glitches; corrected for its bias relative 
+        to the mean).
+    
+    plan = None, workers = None
+        Transform length policy and number of threads; see fft(). The 
+        normalization accounts for zero-padding, so sum(psd)*df is still 
+        the variance of the data. For Welch estimates, only workers applies.
 
     returns frequencies, psd (y^2/Hz)
     """
+    if segment: 
+        if plan is not None: raise ValueError("plan does not apply to Welch estimates (segment sets the transform length).")
+        return _psd_welch(t, y, segment, overlap, window, rescale, average, workers=workers)
+    
     # do the actual fft
-    f, Y = fft(t,y,pow2,window,rescale)
+    f, Y = fft(t,y,pow2,window,rescale,plan,workers)
+    
+    # number of data points and transform length (different if zero-padded)
+    N = min(len(y), len(Y))
+    M = len(Y)
     
     # take twice the negative frequency branch, because it contains the 
     # extra frequency point when the number of points is odd.
     f = _n.abs(f[int(len(f)/2)::-1])
-    P = _n.abs(Y[int(len(Y)/2)::-1])**2 / (f[1]-f[0])
+    P = _n.abs(Y[int(len(Y)/2)::-1])**2 / (f[1]-f[0]) * N/M
+
+    # For complex data, add the positive frequency branch (which lacks the
+    # Nyquist point for an even number of points) instead
+    if _n.iscomplexobj(y):
+        P[1:M-M//2] += _n.abs(Y[M//2+1:])**2 / (f[1]-f[0]) * N/M
+        return f, P
 
     # Since this is the same as the positive frequency branch, double the
     # appropriate frequencies. For even number of points, there is one
@@ -1456,12 +1685,198 @@ def psd(t, y, pow2=False, window=None, rescale=False):
     # avoid the DC value.
     
     # For the even
-    if len(t)%2 == 0: P[1:len(P)-1] = P[1:len(P)-1]*2
+    if M%2 == 0: P[1:len(P)-1] = P[1:len(P)-1]*2
     else:             P[1:]         = P[1:]*2
 
     return f, P
 
 
+def _segments(y, N, step):
+    """
+    Returns a read-only (K, N) strided view of the complete segments of N 
+    points of the 1D array y, starting every step points.
+    """
+    K = max(0, (len(y)-N)//step + 1)
+    return _n.lib.stride_tricks.as_strided(y, (K, N), (step*y.strides[0], y.strides[0]), writeable=False)
+
+def _periodograms(Y, w=None, rescale=False, dt=1.0, workers=None):
+    """
+    Returns the single-sided PSD of each row of Y, windowed by w, with the 
+    same normalization (and complex-data convention) as psd(). Uses 
+    scipy.fft (with workers) if available.
+    """
+    try: 
+        import scipy.fft as _scipy_fft
+        fft  = lambda a: _scipy_fft.fft (a, axis=1, workers=workers)
+        rfft = lambda a: _scipy_fft.rfft(a, axis=1, workers=workers)
+    except ImportError: 
+        fft  = lambda a: _n.fft.fft (a, axis=1)
+        rfft = lambda a: _n.fft.rfft(a, axis=1)
+    
+    N = Y.shape[1]
+    if w is not None: 
+        v0 = _n.mean(_n.abs(Y)**2, axis=1, keepdims=True)
+        Y  = Y * w
+        if rescale: Y = Y * _n.sqrt(v0 / _n.mean(_n.abs(Y)**2, axis=1, keepdims=True))
+    
+    if _n.iscomplexobj(Y):
+        F = _n.abs(fft(Y))**2
+        P = F[:, 0:N//2+1]
+        P[:, 1:(N+1)//2] += F[:, N-1:N//2:-1]
+    else:
+        P = _n.abs(rfft(Y))**2
+        if N%2 == 0: P[:, 1:-1] *= 2
+        else:        P[:, 1:]   *= 2
+    return P * (dt/N)
+
+def _psd_welch(t, y, segment, overlap=0.5, window=None, rescale=False, average='mean', block=2**22, workers=None):
+    """
+    Welch estimate for psd(): averages the PSDs of overlapping segments,
+    transforming up to block points at a time (with workers threads).
+    """
+    y  = _n.asarray(y)
+    dt = t[1]-t[0]
+    N  = min(int(segment), len(y))
+    step = max(1, N-int(round(overlap*N)))
+    
+    if not average in ['mean', 'median']: 
+        raise ValueError("average must be 'mean' or 'median'.")
+    
+    # Segments as a strided view (no copy)
+    segments = _segments(y, N, step)
+    K = len(segments)
+    w = _get_window(window, N)
+    
+    # Batches of segments
+    B = max(1, block//N)
+    if average == 'mean':
+        P = 0
+        for i in range(0, K, B): P = P + _periodograms(segments[i:i+B], w, rescale, dt, workers).sum(0)
+        P = P/K
+    else:
+        P = _n.concatenate([_periodograms(segments[i:i+B], w, rescale, dt, workers) for i in range(0, K, B)])
+        P = _n.median(P, 0)
+        P = P/_median_bias(K)
+        
+    return _n.fft.rfftfreq(N, dt), P
+
+class psd_stream():
+    """
+    Accumulates a Welch-averaged power spectral density (see psd()) from a 
+    continuous stream of data supplied in chunks of any length, e.g., frames 
+    from a data acquisition loop. Segments can straddle chunks: the leftover
+    samples of each chunk are carried over to the next. Each call to add() 
+    costs O(new samples), and the current estimate can be read at any time.
+    
+    Arguments
+    ---------
+    fs
+        Sampling rate (Hz).
+    
+    segment=1024
+        Number of points per segment (sets the frequency spacing fs/segment).
+    
+    window=None, rescale=False
+        Window applied to each segment, as for psd().
+    
+    overlap=0.5
+        Fraction of each segment overlapping the next one.
+    
+    Internal Quantities
+    -------------------
+    self.f
+        Frequencies (Hz).
+    
+    self.mean
+        Running mean PSD of all complete segments.
+    
+    self.N
+        Number of segments that have been included thus far.
+    
+    self.variance_sample, self.variance_mean
+        Variance of the individual segments' PSDs, and of the mean PSD.
+    
+    Methods
+    -------
+    add(y)
+        Add a chunk of data and update the above quantities.
+    
+    get_psd()
+        Returns frequencies, PSD.
+    
+    reset()
+        Forget all the data.
+    """
+    def __init__(self, fs, segment=1024, window=None, overlap=0.5, rescale=False):
+        
+        self.fs      = fs
+        self.segment = int(segment)
+        self.window  = window
+        self.overlap = overlap
+        self.rescale = rescale
+        
+        self.step = max(1, self.segment-int(round(overlap*self.segment)))
+        self.f    = _n.fft.rfftfreq(self.segment, 1.0/fs)
+        self._w   = _get_window(window, self.segment)
+        
+        self.reset()
+    
+    def __repr__(self):
+        return '<psd_stream segment='+str(self.segment)+' N='+str(self.N)+'>'
+    
+    def reset(self):
+        """
+        Forgets all the data (keeping the settings).
+        """
+        self.N               = 0
+        self.mean            = _n.zeros(len(self.f))
+        self.variance_sample = _n.zeros(len(self.f))
+        self.variance_mean   = _n.zeros(len(self.f))
+        self._M2   = _n.zeros(len(self.f)) # sum of squared deviations from the mean
+        self._tail = None                  # samples not yet in a complete segment
+        return self
+    
+    def add(self, y):
+        """
+        Adds a chunk of data, including all the newly completed segments. 
+        Note this modifies the instance and returns it.
+        
+        Parameters
+        ----------
+        y
+            Array of new samples (real or complex).
+        """
+        y = _n.asarray(y)
+        if self._tail is not None and len(self._tail): y = _n.concatenate([self._tail, y])
+        
+        # PSD of each complete segment
+        segments = _segments(y, self.segment, self.step)
+        M = len(segments)
+        
+        # Keep the samples belonging to the next segment(s)
+        self._tail = _n.array(y[M*self.step:])
+        if M == 0: return self
+        P = _periodograms(segments, self._w, self.rescale, 1.0/self.fs)
+        
+        # Merge the batch mean and variance into the running ones (Chan et al.)
+        N     = self.N + M
+        mean  = P.mean(0)
+        delta = mean - self.mean
+        self.mean += delta*(M/N)
+        self._M2  += ((P-mean)**2).sum(0) + delta**2*(self.N*M/N)
+        self.N = N
+        
+        if N > 1:
+            _n.divide(self._M2, N-1, out=self.variance_sample)
+            _n.divide(self.variance_sample, N, out=self.variance_mean)
+        return self
+    
+    def get_psd(self):
+        """
+        Returns frequencies, mean PSD (a copy).
+        """
+        return self.f, _n.array(self.mean)
+
 #if __name__ == '__main__':
 #    t  = _n.linspace(0,10,1000)
 #    y  = _n.cos(t*10)
@@ -1573,6 +1988,40 @@ def _save_object(object, path=None, text="Save this object where?"):
     _cPickle.dump(object, f)
     f.close()
 
+def sample_unit_hypercube(N, dimensions, sampler='latin', seed=None):
+    """
+    Returns an (N, dimensions) array of points distributed within the unit 
+    hypercube [0,1)^dimensions, e.g., for drawing initial guesses.
+    
+    Parameters
+    ----------
+    N
+        Number of points.
+    dimensions
+        Number of dimensions.
+    sampler='latin'
+        Can be 'latin' (Latin hypercube: each dimension is divided into N 
+        equal strata, and each stratum receives exactly one point), 'sobol' 
+        (scrambled Sobol low-discrepancy sequence, requires scipy >= 1.7), 
+        or 'random' (uniform random numbers).
+    seed=None
+        Optional seed for the random number generator.
+    """
+    rng = _n.random.RandomState(seed)
+    
+    if sampler == 'latin':
+        u = _n.empty((N, dimensions))
+        for d in range(dimensions): u[:,d] = (rng.permutation(N) + rng.uniform(size=N))/N
+        return u
+    
+    elif sampler == 'sobol':
+        from scipy.stats import qmc as _qmc
+        return _qmc.Sobol(dimensions, scramble=True, seed=seed).random(N)
+    
+    elif sampler == 'random': return rng.uniform(size=(N, dimensions))
+    
+    else: raise ValueError("sampler must be 'latin', 'sobol', or 'random', not "+repr(sampler))
+
 def shift_feature_to_x0(xdata, ydata, x0=0, feature=imax):
     """
     Finds a feature in the the ydata and shifts xdata so the feature is centered
@@ -1609,36 +2058,138 @@ def smooth(array, index, amount):
 
     return(sum/count)
 
-def smooth_array(array, amount=1):
-    """
-
-    Returns the nearest-neighbor (+/- amount) smoothed array.
-    This does not modify the array or slice off the funny end points.
-
+def smooth_array(array, amount=1, method='boxcar', axis=0, in_place=False, order=2):
     """
-    if amount==0: return array
+    Returns the smoothed array. Near the ends, the smoothing uses only the 
+    available points (i.e., does not slice off or pad the funny end points).
 
-    # we have to store the old values in a temp array to keep the
-    # smoothing from affecting the smoothing
-    new_array = _n.array(array)
-
-    for n in range(len(array)):
-        new_array[n] = smooth(array, n, amount)
-
-    return new_array
+    Parameters
+    ----------
+    array
+        Array (or list) to smooth. Can be N-dimensional.
+    amount=1
+        Size of the smoothing window: for 'boxcar', 'savgol', and 'median', 
+        each point is smoothed with its nearest +/- amount neighbors. For 
+        'gaussian', amount is the standard deviation (in points).
+    method='boxcar'
+        Smoothing kernel. 'boxcar' (nearest-neighbor average, computed
+        with cumulative sums), 'gaussian' (weighted average, renormalized 
+        near the ends), 'savgol' (Savitzky-Golay; local polynomial fits of 
+        the specified order), or 'median' (edges are padded with the end 
+        values).
+    axis=0
+        Axis along which to smooth.
+    in_place=False
+        If True, write the result into array (which must then be a numpy 
+        array) and return it.
+    order=2
+        Polynomial order for method='savgol'.
+    """
+    if in_place and not isinstance(array, _n.ndarray):
+        raise ValueError("in_place=True requires a numpy array.")
+    
+    a = _n.asarray(array)
+    if amount==0 or a.size==0: 
+        if in_place: return array
+        return _n.array(a)
+    
+    # Work in floating point
+    if a.dtype.kind != 'f' and a.dtype.kind != 'c': a = a.astype(float)
+    axis = axis % a.ndim
+
+    if method == 'boxcar':
+        amount = int(amount)
+        b = _n.moveaxis(a, axis, 0)
+        N = len(b)
+        
+        # Cumulative sums (of the deviation from the mean, to keep precision),
+        # with a leading zero
+        m = b.mean(0)
+        c = _n.empty((N+1,)+b.shape[1:], dtype=_n.result_type(b, float))
+        c[0] = 0
+        _n.cumsum(b-m, 0, out=c[1:])
+        
+        # Average over the window [lo, hi) around each point, truncated at 
+        # the ends
+        r = _n.empty_like(c[1:])
+        k = 2*amount+1
+        if N >= k: 
+            _n.subtract(c[k:], c[0:N+1-k], out=r[amount:N-amount])
+            r[amount:N-amount] *= 1.0/k
+        for j in set(range(min(amount,N))) | set(range(max(N-amount,0), N)):
+            lo, hi = max(j-amount, 0), min(j+amount+1, N)
+            r[j] = (c[hi]-c[lo])/(hi-lo)
+        r += m
+        result = _n.moveaxis(r, 0, axis)
+        
+    elif method == 'gaussian':
+        import scipy.ndimage as _ndimage
+        
+        # Total weight of the (truncated) kernel at each point
+        w = _ndimage.gaussian_filter1d(_n.ones(a.shape[axis]), amount, mode='constant')
+        result = _ndimage.gaussian_filter1d(a, amount, axis, mode='constant') \
+               / w.reshape([-1 if k==axis else 1 for k in range(a.ndim)])
+        
+    elif method == 'savgol':
+        import scipy.signal as _signal
+        window = 2*int(amount)+1
+        if window > a.shape[axis]: mode = 'nearest'
+        else:                      mode = 'interp'
+        result = _signal.savgol_filter(a, window, order, axis=axis, mode=mode)
+    
+    elif method == 'median':
+        import scipy.ndimage as _ndimage
+        size = [1]*a.ndim; size[axis] = 2*int(amount)+1
+        result = _ndimage.median_filter(a, size=size, mode='nearest')
+    
+    else: raise ValueError("Unknown smoothing method "+repr(method))
+    
+    # Keep the (floating point) precision of the input
+    result = result.astype(a.dtype, copy=False)
+    
+    if in_place: 
+        array[...] = result
+        return array
+    return result
 
-def smooth_data(xdata, ydata, yerror, amount=1):
+def smooth_data(xdata, ydata, yerror, amount=1, **kwargs):
     """
     Returns smoothed [xdata, ydata, yerror]. Does not destroy the input arrays.
+    
+    Optional keyword arguments (e.g., method) are sent to smooth_array().
     """
 
-    new_xdata  = smooth_array(_n.array(xdata), amount)
-    new_ydata  = smooth_array(_n.array(ydata), amount)
+    new_xdata  = smooth_array(xdata, amount, **kwargs)
+    new_ydata  = smooth_array(ydata, amount, **kwargs)
     if yerror is None:  new_yerror = None
-    else:               new_yerror = smooth_array(_n.array(yerror), amount)
+    else:               new_yerror = smooth_array(yerror, amount, **kwargs)
 
     return [new_xdata, new_ydata, new_yerror]
 
+def snake_indices(shape):
+    """
+    Returns the flat (C-order) indices of an array with the specified shape, 
+    arranged in a "snake" (boustrophedon) order, such that consecutive 
+    indices always refer to neighboring elements. Useful for walking a grid 
+    of parameters while warm-starting each step from the previous one.
+    
+    Parameters
+    ----------
+    shape
+        Shape of the array, e.g., (3,4).
+    """
+    shape = tuple(int(n) for n in shape)
+    raw   = _n.indices(shape).reshape(len(shape), -1)
+    idx   = raw.copy()
+    
+    # Reverse each dimension whenever the (flat) index of the enclosing 
+    # dimensions is odd, so every inner sweep starts where the last one ended
+    for d in range(1, len(shape)):
+        flip = _n.ravel_multi_index(raw[0:d], shape[0:d]) % 2 == 1
+        idx[d][flip] = shape[d]-1-raw[d][flip]
+    
+    return _n.ravel_multi_index(idx, shape)
+
 def sort_matrix(a,n=0):
     """
     This will rearrange the array a[n] from lowest to highest, and
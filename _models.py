@@ -0,0 +1,475 @@
+import numpy         as _n
+import scipy.special as _special
+
+
+
+class model():
+    """
+    Vectorized fit model with named parameters, an analytic Jacobian, and
+    initial-guess heuristics. The library instances (constant, linear,
+    exponential, gaussian, lorentzian, voigt, damped_sine) can be sent
+    directly to spinmob.data.fitter.set_functions(), e.g.,
+
+        f = spinmob.data.fitter()
+        f.set_functions(models.lorentzian + models.linear)
+        f.set_data(x, y, ey).autoguess().fit()
+
+    Models compose with +, -, and *, with numbers, and with string
+    functions (whose parameters are detected automatically), e.g.,
+
+        models.lorentzian + models.lorentzian + 'c*x**2'
+
+    Repeated parameter names are made unique by appending _2, _3, ...;
+    rename() changes names, and renaming two parameters to the same name
+    makes them a single (shared) parameter. Models are also callable as
+    model(x, *parameters), so they can be used inside fitter string
+    functions when passed as globals, e.g.,
+
+        f.set_functions('L(x,A,x0,gamma)*exp(-k*x)', 'A,x0,gamma,k', L=models.lorentzian)
+
+    Parameters
+    ----------
+    name
+        Name (e.g., for legends and the fitter's function names).
+    pnames
+        List of parameter names.
+    function
+        Vectorized function(x, *parameters).
+    jacobian=None
+        Function(x, *parameters) returning the derivatives of function with
+        respect to each parameter (one row per parameter). None means
+        model.jacobian() will use finite differences.
+    guess=None
+        Function(x, y) returning a list of initial guesses (one per
+        parameter) for the supplied data. None means use the defaults.
+    defaults=None
+        List of default parameter values (None means all 1.0).
+    """
+
+    def __init__(self, name, pnames, function, jacobian=None, guess=None, defaults=None):
+        self.name      = name
+        self.__name__  = name
+        self._pnames   = list(pnames)
+        self._function = function
+        self._jacobian = jacobian
+        self._guess    = guess
+
+        if defaults is None: defaults = [1.0]*len(self._pnames)
+        self._defaults = list(defaults)
+
+    def __repr__(self):
+        return '<model '+self.name+'('+self.get_pstring()+')>'
+
+    def __call__(self, x, *p):
+        return self._function(_as_float_array(x), *p)
+
+    def get_pnames(self):
+        """
+        Returns a list of parameter names.
+        """
+        return list(self._pnames)
+
+    def get_pstring(self):
+        """
+        Returns the parameter string (names and defaults) for
+        fitter.set_functions(), e.g. 'A=1.0, x0=0.0, gamma=1.0'.
+        """
+        return ', '.join([self._pnames[n]+'='+repr(float(self._defaults[n])) for n in range(len(self._pnames))])
+
+    def has_jacobian(self):
+        """
+        Returns True if the Jacobian is analytic.
+        """
+        return self._jacobian is not None
+
+    def jacobian(self, x, *p):
+        """
+        Returns an array of derivatives of the model with respect to each
+        parameter, shape (number of parameters, len(x)).
+        """
+        x = _as_float_array(x)
+        if self._jacobian is not None:
+
+            # Rows can be scalars (e.g., the derivative of a constant)
+            J = _n.zeros((len(self._pnames),)+x.shape)
+            for n, j in enumerate(self._jacobian(x, *p)): J[n] = j
+            return J
+
+        # Central finite differences
+        # with a step resolvable at the precision of x
+        if x.dtype.itemsize < 8: step = _n.finfo(x.dtype).eps**(1/3.)
+        else:                    step = 1e-6
+        p = [float(v) for v in p]
+        J = _n.zeros((len(p),)+x.shape)
+        for n in range(len(p)):
+            h = step*max(abs(p[n]), 1.0)
+            p1 = list(p); p1[n] += h
+            p2 = list(p); p2[n] -= h
+            J[n] = (self(x, *p1)-self(x, *p2))/(2*h)
+        return J
+
+    def guess(self, x, y):
+        """
+        Returns a list of initial guesses for the parameters, based on the
+        supplied data.
+        """
+        if self._guess is None: return list(self._defaults)
+
+        x = _n.asarray(x, dtype=float)
+        y = _n.asarray(y, dtype=float)
+
+        # Only use finite data
+        ok = _n.isfinite(x) & _n.isfinite(y)
+        if _n.sum(ok) < 2: return list(self._defaults)
+        x, y = x[ok], y[ok]
+
+        # Guess heuristics assume increasing x
+        i = _n.argsort(x, kind='mergesort')
+        return [float(v) for v in self._guess(x[i], y[i])]
+
+    def rename(self, **names):
+        """
+        Returns a copy of the model with renamed parameters, e.g.,
+        rename(x0='f0', gamma_2='gamma'). If parameters end up with the same
+        name, they become a single (shared) parameter.
+        """
+        for k in names:
+            if not k in self._pnames: raise KeyError("'"+k+"' is not a parameter of "+self.name)
+        return _renamed_model(self, [names.get(k, k) for k in self._pnames])
+
+    # Composition
+    def __add__(self, other):  return _composite_model('+', self, _as_model(other))
+    def __radd__(self, other): return _composite_model('+', _as_model(other), self)
+    def __sub__(self, other):  return _composite_model('-', self, _as_model(other))
+    def __rsub__(self, other): return _composite_model('-', _as_model(other), self)
+    def __mul__(self, other):  return _composite_model('*', self, _as_model(other))
+    def __rmul__(self, other): return _composite_model('*', _as_model(other), self)
+
+    def bind(self, pnames, constants=None):
+        """
+        Returns a function f(x, *p) of the fitter parameters pnames (in that
+        order), with a jacobian(x, *p) method returning one row per fitter
+        parameter. Model parameters not in pnames must be in the
+        constants dictionary.
+        """
+        return _bound_model(self, pnames, constants)
+
+
+
+class _renamed_model(model):
+    """
+    A model with new parameter names, merging duplicates.
+    """
+    def __init__(self, base, names):
+
+        # Unique names in order of appearance
+        pnames = []
+        for k in names:
+            if not k in pnames: pnames.append(k)
+
+        # Index of each base parameter in the new list
+        index = [pnames.index(k) for k in names]
+
+        def function(x, *p): return base._function(x, *[p[i] for i in index])
+
+        if base._jacobian is None: jacobian = None
+        else:
+            def jacobian(x, *p):
+                Jb = base.jacobian(x, *[p[i] for i in index])
+                J  = _n.zeros((len(pnames), len(x)))
+                for n in range(len(index)): J[index[n]] += Jb[n]
+                return J
+
+        def guess(x, y):
+            g  = base.guess(x, y)
+            gs = [None]*len(pnames)
+            for n in range(len(index)):
+                if gs[index[n]] is None: gs[index[n]] = g[n]
+            return gs
+
+        defaults = [None]*len(pnames)
+        for n in range(len(index)):
+            if defaults[index[n]] is None: defaults[index[n]] = base._defaults[n]
+
+        model.__init__(self, base.name, pnames, function, jacobian, guess, defaults)
+
+
+
+class _composite_model(model):
+    """
+    Sum, difference, or product of two models. Parameters of b that clash
+    with those of a get a suffix _2, _3, ...
+    """
+    def __init__(self, operator, a, b):
+        self.operator = operator
+
+        # Unique names for b's parameters
+        pnames = a.get_pnames()
+        for k in b.get_pnames():
+            name = k
+            m    = 2
+            while name in pnames:
+                name = k+'_'+str(m)
+                m   += 1
+            pnames.append(name)
+
+        Na = len(a.get_pnames())
+
+        if   operator == '+': function = lambda x, *p: a._function(x, *p[:Na]) + b._function(x, *p[Na:])
+        elif operator == '-': function = lambda x, *p: a._function(x, *p[:Na]) - b._function(x, *p[Na:])
+        else:                 function = lambda x, *p: a._function(x, *p[:Na]) * b._function(x, *p[Na:])
+
+        # Analytic if both parts are
+        jacobian = None
+        if a.has_jacobian() and b.has_jacobian():
+            def jacobian(x, *p):
+                Ja, Jb = a.jacobian(x, *p[:Na]), b.jacobian(x, *p[Na:])
+                if operator == '+': return _n.concatenate([Ja, Jb])
+                if operator == '-': return _n.concatenate([Ja, -Jb])
+                return _n.concatenate([Ja*b._function(x, *p[Na:]), a._function(x, *p[:Na])*Jb])
+
+        # Guess the first part, then the second on what's left over
+        def guess(x, y):
+            ga = a.guess(x, y)
+            ya = a._function(x, *ga)
+            if   operator == '+': gb = b.guess(x, y-ya)
+            elif operator == '-': gb = b.guess(x, ya-y)
+            else:
+                with _n.errstate(divide='ignore', invalid='ignore'): gb = b.guess(x, y/ya)
+            return list(ga) + list(gb)
+
+        # Parenthesize sums in products and differences
+        names = []
+        for m in [a, b]:
+            if isinstance(m, _composite_model) and operator != '+' and m.operator != '*': names.append('('+m.name+')')
+            else:                                                                           names.append(m.name)
+        name = names[0] + operator + names[1]
+
+        model.__init__(self, name, pnames, function, jacobian, guess, a._defaults+b._defaults)
+
+
+
+class _expression_model(model):
+    """
+    Model from a string function of x (e.g., 'c*x**2'), with parameters
+    being the names not known to numpy / scipy.special, in order of
+    appearance. The Jacobian uses finite differences.
+    """
+    _globals = None
+
+    def __init__(self, expression):
+        import ast as _ast
+        from . import _data
+
+        if _expression_model._globals is None:
+            _expression_model._globals = dict(_n.__dict__)
+            _expression_model._globals.update(_special.__dict__)
+
+        # Find the parameter names
+        pnames = []
+        for node in _ast.walk(_ast.parse(expression.strip(), mode='eval')):
+            if isinstance(node, _ast.Name) and node.id != 'x' and not node.id in self._globals \
+            and not node.id in pnames: pnames.append(node.id)
+
+        f = _data._compiled_function(expression, ['x']+pnames, self._globals)
+        model.__init__(self, expression, pnames, f)
+
+
+
+def _as_model(a):
+    """
+    Converts numbers and string functions into models.
+    """
+    if isinstance(a, model): return a
+    if isinstance(a, str):   return _expression_model(a)
+    if _n.isscalar(a):       return model(repr(a), [], lambda x: a + 0*x, lambda x: [])
+    raise TypeError("Cannot combine a model with "+repr(a))
+
+def _as_float_array(x):
+    """
+    Converts x to a floating-point array, keeping the precision of floating 
+    point input (e.g., float32 data stays float32).
+    """
+    x = _n.asarray(x)
+    if x.dtype.kind == 'f': return x
+    return x.astype(float)
+
+
+
+class _bound_model():
+    """
+    Model evaluated with the fitter's full parameter list (see model.bind()).
+    """
+    def __init__(self, model, pnames, constants=None):
+        if constants is None: constants = dict()
+
+        self.model    = model
+        self.__name__ = model.name
+
+        # Where each model parameter comes from
+        self._index = []
+        self._const = []
+        for k in model.get_pnames():
+            if   k in pnames:    self._index.append(pnames.index(k)); self._const.append(None)
+            elif k in constants: self._index.append(None);             self._const.append(constants[k])
+            else: raise KeyError("Model parameter '"+k+"' is not a fit parameter or constant.")
+        self._N = len(pnames)
+
+    def _args(self, p):
+        return [p[self._index[n]] if self._const[n] is None else self._const[n] for n in range(len(self._index))]
+
+    def __call__(self, x, *p):
+        return self.model(x, *self._args(p))
+
+    def jacobian(self, x, *p):
+        """
+        Returns the derivatives with respect to each of the fitter's
+        parameters, shape (number of fitter parameters, len(x)).
+        """
+        Jm = self.model.jacobian(x, *self._args(p))
+        J  = _n.zeros((self._N, len(x)))
+        for n in range(len(self._index)):
+            if self._index[n] is not None: J[self._index[n]] += Jm[n]
+        return J
+
+
+
+###########################################
+# Guess helpers
+###########################################
+
+def _peak_guess(x, y):
+    """
+    Returns the amplitude, position, and area of the dominant peak (or dip)
+    in y, relative to the median.
+    """
+    y0 = _n.median(y)
+    d  = y - y0
+    if abs(d.max()) >= abs(d.min()): i = _n.argmax(d)
+    else:                            i = _n.argmin(d)
+    area = _n.trapz(d, x)
+
+    # Avoid zero widths
+    if area == 0 or d[i] == 0: area = d[i]*(x[-1]-x[0])*0.1 + 1e-300
+    return d[i], x[i], area
+
+
+
+###########################################
+# Library
+###########################################
+
+# constant: c
+constant = model('constant', ['c'],
+    lambda x, c: c + 0*x,
+    lambda x, c: [1.0],
+    lambda x, y: [_n.mean(y)],
+    [0.0])
+
+# linear: m*x + b
+linear = model('linear', ['m', 'b'],
+    lambda x, m, b: m*x + b,
+    lambda x, m, b: [x, 1.0],
+    lambda x, y: list(_n.polyfit(x, y, 1)),
+    [1.0, 0.0])
+
+# exponential decay: A*exp(-x/tau)
+def _exponential(x, A, tau): return A*_n.exp(-x/tau)
+def _exponential_jacobian(x, A, tau):
+    e = _n.exp(-x/tau)
+    return [e, A*e*x/tau**2]
+def _exponential_guess(x, y):
+    s  = _n.sign(_n.sum(y)) or 1.0
+    ok = y*s > 0
+    if _n.sum(ok) < 2: return [y[0], x[-1]-x[0]]
+    m, b = _n.polyfit(x[ok], _n.log(y[ok]*s), 1)
+    if m >= 0: return [y[0], x[-1]-x[0]]
+    return [s*_n.exp(b), -1.0/m]
+exponential = model('exponential', ['A', 'tau'], _exponential, _exponential_jacobian, _exponential_guess)
+
+# gaussian: A*exp(-(x-x0)**2/(2*sigma**2))
+def _gaussian(x, A, x0, sigma): return A*_n.exp(-0.5*((x-x0)/sigma)**2)
+def _gaussian_jacobian(x, A, x0, sigma):
+    u = (x-x0)/sigma
+    g = _n.exp(-0.5*u*u)
+    return [g, A*g*u/sigma, A*g*u*u/sigma]
+def _gaussian_guess(x, y):
+    A, x0, area = _peak_guess(x, y)
+    return [A, x0, abs(area/A)/_n.sqrt(2*_n.pi)]
+gaussian = model('gaussian', ['A', 'x0', 'sigma'], _gaussian, _gaussian_jacobian, _gaussian_guess, [1.0, 0.0, 1.0])
+
+# lorentzian: A/(1+((x-x0)/gamma)**2) (gamma = half width at half maximum)
+def _lorentzian(x, A, x0, gamma): return A/(1+((x-x0)/gamma)**2)
+def _lorentzian_jacobian(x, A, x0, gamma):
+    u = (x-x0)/gamma
+    L = 1/(1+u*u)
+    return [L, 2*A*L*L*u/gamma, 2*A*L*L*u*u/gamma]
+def _lorentzian_guess(x, y):
+    A, x0, area = _peak_guess(x, y)
+    return [A, x0, abs(area/A)/_n.pi]
+lorentzian = model('lorentzian', ['A', 'x0', 'gamma'], _lorentzian, _lorentzian_jacobian, _lorentzian_guess, [1.0, 0.0, 1.0])
+
+# voigt: gaussian (sigma) convolved with lorentzian (gamma), peak height A
+def _voigt_parts(x, x0, sigma, gamma):
+    s = _n.sqrt(2)*sigma
+    z  = ((x-x0) + 1j*gamma)/s
+    z0 = 1j*gamma/s
+    return s, z, _special.wofz(z), z0, _special.wofz(z0)
+def _voigt(x, A, x0, sigma, gamma):
+    s, z, w, z0, w0 = _voigt_parts(x, x0, sigma, gamma)
+    return A*w.real/w0.real
+def _voigt_jacobian(x, A, x0, sigma, gamma):
+    s, z, w, z0, w0 = _voigt_parts(x, x0, sigma, gamma)
+
+    # w'(z) = -2 z w(z) + 2i/sqrt(pi)
+    dw  = -2*z *w  + 2j/_n.sqrt(_n.pi)
+    dw0 = -2*z0*w0 + 2j/_n.sqrt(_n.pi)
+    R, N = w.real, w0.real
+
+    # Derivatives of z and z0 with respect to x0, sigma, gamma
+    dR_dx0 = (dw*(-1/s)).real
+    dR_ds  = (dw*(-z/sigma)).real
+    dN_ds  = (dw0*(-z0/sigma)).real
+    dR_dg  = (dw*(1j/s)).real
+    dN_dg  = (dw0*(1j/s)).real
+    return [R/N, A*dR_dx0/N, A*(dR_ds*N-R*dN_ds)/N**2, A*(dR_dg*N-R*dN_dg)/N**2]
+def _voigt_guess(x, y):
+    A, x0, area = _peak_guess(x, y)
+    w = abs(area/A)/(2*_n.pi)
+    return [A, x0, w, w]
+voigt = model('voigt', ['A', 'x0', 'sigma', 'gamma'], _voigt, _voigt_jacobian, _voigt_guess, [1.0, 0.0, 1.0, 1.0])
+
+# damped sine: A*exp(-x/tau)*sin(2*pi*f*x + phi)
+def _damped_sine(x, A, f, phi, tau): return A*_n.exp(-x/tau)*_n.sin(2*_n.pi*f*x+phi)
+def _damped_sine_jacobian(x, A, f, phi, tau):
+    e = _n.exp(-x/tau)
+    a = 2*_n.pi*f*x+phi
+    s = e*_n.sin(a)
+    c = A*e*_n.cos(a)
+    return [s, 2*_n.pi*x*c, c, A*s*x/tau**2]
+def _damped_sine_guess(x, y):
+
+    # Frequency from the biggest (non-DC) Fourier component of evenly
+    # resampled data
+    N  = len(x)
+    xe = _n.linspace(x[0], x[-1], N)
+    ye = _n.interp(xe, x, y) - _n.mean(y)
+    F  = _n.fft.rfft(ye)
+    i  = _n.argmax(abs(F[1:]))+1
+    f  = _n.fft.rfftfreq(N, xe[1]-xe[0])[i]
+
+    # Phase and amplitude from the component (y ~ A sin(wx+phi))
+    c   = _n.sum(ye*_n.exp(-2j*_n.pi*f*xe))
+    phi = _n.angle(c) + _n.pi/2
+
+    # Decay from the RMS of the two halves
+    r1  = _n.sqrt(_n.mean(ye[:N//2]**2))
+    r2  = _n.sqrt(_n.mean(ye[N//2:]**2))
+    tau = 10*(x[-1]-x[0])
+    if r2 > 0 and r1 > r2: tau = 0.5*(x[-1]-x[0])/_n.log(r1/r2)
+
+    # Amplitude at x = 0
+    A = 2*abs(c)/N / _n.mean(_n.exp(-(xe-0)/tau))
+
+    return [A, f, (phi+_n.pi) % (2*_n.pi) - _n.pi, tau]
+damped_sine = model('damped_sine', ['A', 'f', 'phi', 'tau'], _damped_sine, _damped_sine_jacobian, _damped_sine_guess, [1.0, 1.0, 0.0, 1.0])
@@ -446,12 +446,13 @@ def image_autozoom(axes="gca"):
 
     _pylab.draw()
 
-def image_coarsen(xlevel=0, ylevel=0, image="auto", method='average'):
+def image_coarsen(xlevel=0, ylevel=0, image="auto", method='average', tail='drop'):
     """
-    This will coarsen the image data by binning each xlevel+1 along the x-axis
-    and each ylevel+1 points along the y-axis
+    This will coarsen the image data by binning each xlevel points along the 
+    x-axis and each ylevel points along the y-axis.
 
-    type can be 'average', 'min', or 'max'
+    method can be 'average', 'min', 'max', or any of the other methods of
+    spinmob.fun.coarsen_array(). See spinmob.fun.coarsen_matrix() for tail.
     """
     if image == "auto": image = _pylab.gca().images[0]
 
@@ -463,7 +464,7 @@ def image_coarsen(xlevel=0, ylevel=0, image="auto", method='average'):
     if len(image_undo_list) > 10: image_undo_list.pop(0)
 
     # images have transposed data
-    image.set_array(_fun.coarsen_matrix(Z, ylevel, xlevel, method))
+    image.set_array(_fun.coarsen_matrix(Z, ylevel, xlevel, method, tail))
 
     # update the plot
     _pylab.draw()
@@ -1326,7 +1327,7 @@ def smooth_line(line, smoothing=1, trim=True, draw=True):
     xdata = list(line.get_xdata())
     ydata = list(line.get_ydata())
 
-    _fun.smooth_array(ydata, smoothing)
+    ydata = list(_fun.smooth_array(ydata, smoothing))
 
     if trim:
         for n in range(0, smoothing):
@@ -40,7 +40,7 @@ class spline_single:
             self.ydata_smoothed = list(ydata)
 
             # if we're supposed to, presmooth the data
-            if presmoothing: _fun.smooth_array(self.ydata_smoothed, presmoothing)
+            if presmoothing: self.ydata_smoothed = list(_fun.smooth_array(self.ydata_smoothed, presmoothing))
 
             print("presmoothing = ", str(presmoothing))
             print("smoothing = ",    str(smoothing))
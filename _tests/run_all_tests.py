@@ -6,6 +6,7 @@ from test__plot      import *
 from test__databox   import *
 from test__fitter    import *
 from test__functions import *
+from test__models    import *
 from test__dialogs   import *
 from test__egg       import *
 
@@ -194,6 +194,32 @@ class Test_fitter(_ut.TestCase):
                    dtype=_n.float32)
         self.assertEqual(f.get_processed_data()[1][0].dtype, _n.float32)
         
+    def test_float32(self):
+        """
+        Compares float32 and float64 fits of the same data.
+        """
+        x  = _n.linspace(-5,5,20000)
+        _n.random.seed(3)
+        y  = 2.0/(1+(x-0.3)**2) + 0.5 + _n.random.normal(0,0.05,len(x))
+        
+        for function in ['A/(1+(x-x0)**2)+c', _s.models.lorentzian+_s.models.constant]:
+            results = []
+            for dtype in [_n.float64, _n.float32]:
+                f = _s.data.fitter(autoplot=False)
+                if isinstance(function, str): f.set_functions(function, 'A=1, x0=0, c=0')
+                else:                         f.set_functions(function)
+                f.set_data(x, y, 0.05, dtype=dtype)
+                if not isinstance(function, str): f.autoguess()
+                f.fit()
+                
+                # Residuals stay in the requested precision
+                self.assertEqual(f.studentized_residuals()[0].dtype, dtype)
+                results.append((f.results[0], _n.sqrt(_n.diag(f.results[1])), f.chi_squared()))
+            
+            (p64, e64, c64), (p32, e32, c32) = results
+            self.assertTrue(_n.all(_n.abs(p32-p64) < 0.05*e64))
+            self.assertAlmostEqual(c32/c64, 1, 4)
+        
     
     def test_fix_free_and_function_globals(self):
         """
@@ -215,5 +241,388 @@ class Test_fitter(_ut.TestCase):
         f.fit()
         f.__repr__()
         
+    def test_multistart(self):
+        """
+        Makes sure a multistart fit escapes the local minimum that traps
+        a single leastsq run from a bad guess.
+        """
+        _n.random.seed(0)
+        x = _n.linspace(0,10,200)
+        y = 2*x*_n.cos(3.1*x)+1 + _n.random.normal(0,0.3,len(x))
+        
+        f = _s.data.fitter(autoplot=False, silent=True).set_data(x, y, 0.3)
+        f.set_functions('a*x*cos(b*x)+c', 'a=-0.2, b, c=3')
+        f.fit()
+        self.assertGreater(f.reduced_chi_squared(), 10)
+        
+        for sampler in ['latin', 'sobol']:
+            f.fit(multistart=2000, bounds=dict(b=(0,5)), sampler=sampler, seed=0)
+            self.assertAlmostEqual(f['b'], 3.1, 1)
+            self.assertLess(f.reduced_chi_squared(), 2)
+            self.assertGreater(f.results[2]['nfev_total'], 2000)
+        
+        # Threaded local fits give the same result and counts as serial ones
+        counts = []
+        for workers in [1, 4]:
+            f.set(profile=True).reset_profile()
+            f.fit(multistart=2000, bounds=dict(b=(0,5)), sampler='sobol', seed=0, workers=workers, force=True)
+            counts.append(f.get_profile()['residual_calls'])
+        self.assertAlmostEqual(f['b'], 3.1, 1)
+        self.assertEqual(counts[0], counts[1])
+        f.set(profile=False)
+        
+        # None means the default range on that side; bad bounds are errors
+        f.fit(multistart=20, bounds=dict(a=(None,5)), seed=0, force=True)
+        self.assertTrue(_n.isfinite(f.results[0]).all())
+        self.assertRaises(BaseException, f.fit, multistart=20, bounds=dict(a=(5,1)))
+        
+    def test_chi2_grid(self):
+        """
+        Compares the grid evaluators with chi_squared().
+        """
+        f = _s.data.fitter(autoplot=False, silent=True).set_data(self.x1, self.y1, self.ey)
+        f.set_functions('a*x+b', 'a,b')
+        f.fit()
+        
+        a = _n.linspace(-1,1,7)
+        b = _n.linspace(0,5,5)
+        c = f.chi2_grid(dict(a=a, b=b))
+        self.assertEqual(c.shape, (7,5))
+        self.assertAlmostEqual(c[2,3], f.chi_squared([a[2], b[3]]))
+        
+        # Profile: the minimum over the grid should be the fit's chi^2
+        a = _n.linspace(f['a']-0.5, f['a']+0.5, 11)
+        c, d = f.chi2_grid(dict(a=a), others='profile', return_parameters=True)
+        self.assertAlmostEqual(c[5], f.chi_squared(), 5)
+        self.assertAlmostEqual(d['b'][5], f['b'], 5)
+        self.assertTrue((c >= c[5]-1e-9).all())
+        
+    def test_headless_and_incremental_plot(self):
+        """
+        Makes sure the headless switch suppresses automatic plotting, and 
+        that incremental plotting reuses the existing curves.
+        """
+        _s.data.fitter.headless = True
+        try:
+            f = _s.data.fitter(first_figure=20).set_data(self.x1, self.y1, self.ey).set_functions('a*x+b', 'a,b')
+            f.fit()
+            self.assertEqual(f._plot_artists, dict())
+        finally: 
+            _s.data.fitter.headless = False
+        
+        # Incremental updates keep the same artists
+        f(a=2)
+        artists = f._plot_artists[0]['artists']
+        f(b=0.5, plot_max_points=4)
+        self.assertIs(f._plot_artists[0]['artists'][0], artists[0])
+        self.assertEqual(len(artists[0].lines[0].get_xdata()), 4)
+        
+        # Changing the layout redraws everything
+        f(plot_all_data=True)
+        self.assertIsNot(f._plot_artists[0]['artists'][0], artists[0])
+        
+    def test_fit_cache(self):
+        """
+        Identical re-fits should reuse the cached results.
+        """
+        f = _s.data.fitter(autoplot=False, profile=True).set_data(self.x1, self.y1, self.ey).set_functions('a*x+b', 'a,b')
+        f.fit()
+        r = f.results
+        
+        # Safe settings don't change the fit
+        f.fit(plot_guess=False)
+        self.assertIs(f.results, r)
+        self.assertEqual(f.get_profile()['fits'], 1)
+        self.assertEqual(f.get_profile()['fit_cache_hits'], 1)
+        
+        # Forced fits skip the cache, and changed guess
+        n = len(f._fit_cache)
+        f.fit(force=True)
+        self.assertEqual(f.get_profile()['fits'], 2)
+        self.assertEqual(len(f._fit_cache), n)
+        f(a=2).fit()
+        self.assertEqual(f.get_profile()['fits'], 3)
+        
+        # Back to the original inputs
+        f(a=1).fit()
+        self.assertEqual(f.get_profile()['fits'], 3)
+        
+        # Changing the trimming changes the processed data
+        f.fit(xmin=2)
+        self.assertEqual(f.get_profile()['fits'], 4)
+        
+        # So does modifying the data in place
+        x = _n.linspace(0, 1, 20)
+        y = 2*x+1
+        g = _s.data.fitter(autoplot=False).set_data(x, y, 0.1).set_functions('a*x+b', 'a,b')
+        self.assertTrue(_n.allclose(g.fit().results[0], [2,1]))
+        y[:] = 5*x+1
+        self.assertTrue(_n.allclose(g.fit().results[0], [5,1]))
+        
+        # Bounded size (untrimmed again is a hit), and disabled
+        f.set(fit_cache=1)
+        f.fit(xmin=None)
+        self.assertEqual(len(f._fit_cache), 1)
+        self.assertEqual(f.get_profile()['fits'], 4)
+        f.set(fit_cache=0).fit()
+        self.assertEqual(f.get_profile()['fits'], 5)
+        
+    def test_profile(self):
+        """
+        Checks the instrumentation counters.
+        """
+        f = _s.data.fitter(autoplot=False).set_data(self.x1, self.y1, self.ey).set_functions('a*x+b', 'a,b')
+        f.fit()
+        self.assertEqual(f.get_profile()['model_evaluations'], 0)
+        self.assertFalse('profile' in f.get_fit_results())
+        
+        f(profile=True, profile_trace=True)
+        f.fit()
+        p = f.get_fit_results()['profile']
+        self.assertEqual(p['fits'], 1)
+        self.assertGreaterEqual(p['residual_calls'], f.results[2]['nfev'])
+        self.assertGreaterEqual(p['model_evaluations'], p['residual_calls'])
+        self.assertEqual(len(p['trace']), p['residual_calls'])
+        self.assertGreater(p['time_solver'], 0)
+        
+        f.reset_profile()
+        self.assertEqual(f.get_profile()['fits'], 0)
+        
+    def test_online_fitter(self):
+        """
+        Compares the online fitter with a regular fit, and checks the 
+        forgetting factor.
+        """
+        x  = _n.array(self.x1, dtype=float)
+        y  = _n.array(self.y1, dtype=float)
+        ey = _n.array(self.ey)
+        
+        # Add the points in uneven blocks
+        o = _s.data.online_fitter(['1','x','x**2'], 'a,b,c')
+        o.add(x[0], y[0], ey[0])
+        o.add(x[1:5], y[1:5], ey[1:5])
+        o.add(x[5:], y[5:], ey[5:])
+        r = o.get_fit_results()
+        
+        f = _s.data.fitter(autoplot=False).set_functions('a+b*x+c*x**2', 'a,b,c').set_data(x, y, ey).fit()
+        R = f.get_fit_results()
+        for k in ['a', 'b', 'c', 'c.std', 'chi2', 'reduced_chi2', 'degrees_of_freedom']:
+            self.assertAlmostEqual(r[k], R[k], 6)
+        
+        # Forgetting factor follows a step
+        o = _s.data.online_fitter(['1'], forgetting=0.9)
+        for n in range(200): o.add(n, 1 if n < 100 else 5)
+        self.assertAlmostEqual(o.get_fit_parameters()[0][0], 5, 3)
+        
+    def test_compiled_functions(self):
+        """
+        Compares the compiled string functions with plain lambdas.
+        """
+        f = _s.data.fitter(autoplot=False, silent=True)
+        x = _n.linspace(-3,3,_s.data._compiled_function.min_size+1)
+        for e in ['a*exp(-(x-b)**2/c**2)+d', 'a*x*cos(b*x)+d*pi', 'a/(1+((x-b)/c)**2)+d*x**2+erf(x)*(x-b)**2',
+                  'a*x*10**20+b+c+d', 'a*x*3**41+b*2**-1+c+d']:
+            f.set_functions(e, 'a=1.3, b=0.2, c=0.7, d=0.1')
+            self.assertTrue(f.f[0].is_compiled())
+            y = _n.array(f.f[0]._lambda(x, 1.3, 0.2, 0.7, 0.1), dtype=float)
+            self.assertTrue(_n.allclose(f.f[0](x, 1.3, 0.2, 0.7, 0.1), y, rtol=1e-14, atol=0))
+        self.assertEqual(len(f.f[0](x[0:0], 1.3, 0.2, 0.7, 0.1)), 0)
+        self.assertEqual(f.f[0](_n.array(1.0), 1.3, 0.2, 0.7, 0.1), f.f[0]._lambda(1.0, 1.3, 0.2, 0.7, 0.1))
+        self.assertEqual(f.f[0](x[0:3], 1.3, 0.2, 0.7, 0.1)[0], f.f[0]._lambda(x[0:3], 1.3, 0.2, 0.7, 0.1)[0])
+        
+        # Things that can't be compiled still work
+        f.set_functions('max(x)*a', 'a')
+        self.assertFalse(f.f[0].is_compiled())
+        self.assertEqual(f.f[0](x, 2.0), 6.0)
+        
+        # Benchmark
+        f.set_data(x, _n.cos(x), 0.1)
+        f.set_functions('a*cos(b*x)+c', 'a,b,c')
+        self.assertEqual(len(f.benchmark_functions(repeat=2)), 1)
+    
+    def test_sparse_solver(self):
+        """
+        Global fit with local and shared parameters, sparse vs dense solver.
+        """
+        x  = _n.linspace(0,1,50)
+        ys = [3*x+1+0.01*_n.cos(7*x), 3*x+2+0.01*_n.sin(5*x), 0.5*x**2+1]
+        f  = _s.data.fitter(autoplot=False, silent=True).set_data([x,x,x], ys, 0.01)
+        f.set_functions(['a*x+b', 'a*x+c', 'd*x**2+b'], 'a,b,c,d')
+        
+        self.assertEqual(f.get_parameter_usage().tolist(), [[True,True,False,False],
+                                                            [True,False,True,False],
+                                                            [False,True,False,True]])
+        f._massage_data()
+        self.assertEqual(f.get_jacobian_sparsity().nnz, 150*2)
+        
+        R = f.fit().get_fit_results()
+        r = f.fit(solver='sparse').get_fit_results()
+        for k in ['a', 'b', 'c', 'd', 'a.std', 'c.std', 'chi2']:
+            self.assertAlmostEqual(r[k], R[k], 5)
+        
+        # Analytic Jacobians, with (3 of 7 parameters per set) and without 
+        # much structure
+        x  = _n.linspace(-5,5,400)
+        ms = [_s.models.lorentzian.rename(A='A'+str(n), x0='x'+str(n)) for n in range(3)]
+        ys = [ms[n](x, 1+n, 0.3*n, 0.7)+0.01*_n.cos(7*x+n) for n in range(3)]
+        for functions, data in [(ms, ys), (ms[2], ys[2])]:
+            f = _s.data.fitter(autoplot=False, silent=True).set_functions(functions).set_data(x, data, 0.01)
+            f.set(**dict([(k, 1.1*v+0.1) for k, v in zip(f.get_pnames(), [1,0,0.7,2,0.3,3,0.6])]))
+            R = f.fit().results[0]
+            r = f.fit(solver='sparse').results[0]
+            self.assertTrue(_n.allclose(r, R, atol=1e-6))
+    
+    def test_fit_sequence(self):
+        """
+        Warm-started fits over a smooth sweep.
+        """
+        x  = _n.linspace(0,10,200)
+        bs = _n.linspace(1,2,8)
+        datasets = [(x, 2*_n.cos(b*x)+0.1*_n.sin(3*x), 0.1) for b in bs]
+        
+        f = _s.data.fitter(autoplot=False, silent=True).set_functions('a*cos(b*x)', 'a=2, b=1')
+        d = f.fit_sequence(datasets)
+        self.assertTrue(_n.allclose(d['b'], bs, atol=1e-2))
+        self.assertEqual(len(d['covariance']), 8)
+        
+        # Last data set and fit are left in the fitter
+        self.assertAlmostEqual(f.get_fit_results()['b'], bs[-1], 2)
+        self.assertAlmostEqual(f.get_fit_results()['chi2'], d['chi2'][-1])
+        
+        # Warm starting saves function evaluations
+        c = f.fit_sequence(datasets, warm_start=False)
+        self.assertLess(sum(d['nfev']), sum(c['nfev']))
+    
+    def test_coarsen_log(self):
+        """
+        Log-binned coarsening and the processed data cache.
+        """
+        x = _n.linspace(0, 1e3, 100001)
+        y = 3.0/(1+x**2)
+        f = _s.data.fitter(autoplot=False, silent=True).set_data(x, y, 0.01).set_functions('a/(1+x**2)', 'a=1')
+        f.set(coarsen=1.1, coarsen_mode='log')
+        
+        xp, yp, eyp = f.get_processed_data()
+        xc, yc, eyc = _s.fun.coarsen_data(x, y, 0.01, level=1.1, exponential=True)
+        self.assertLess(len(xp[0]), 200)
+        self.assertTrue(_n.allclose(xp[0], xc) and _n.allclose(eyp[0], eyc))
+        
+        # Cached until something changes
+        self.assertIs(f.get_processed_data()[0][0], xp[0])
+        f['coarsen'] = 1.2
+        self.assertLess(len(f.get_processed_data()[0][0]), len(xp[0]))
+        
+        # The cached arrays are read-only, but the original data are not
+        self.assertFalse(f.get_processed_data()[1][0].flags.writeable)
+        self.assertTrue(y.flags.writeable)
+        
+        self.assertAlmostEqual(f.fit().get_fit_results()['a'], 3.0, 2)
+        
+        # Fitting reprocesses data modified in place
+        y *= 2
+        self.assertAlmostEqual(f.fit().get_fit_results()['a'], 6.0, 2)
+    
+    def test_exdata(self):
+        """
+        Errors in x via ODR, compared with scipy.odr directly.
+        """
+        import scipy.odr as _odr
+        x  = _n.linspace(0,10,50)
+        x  = x + 0.3*_n.cos(7*x)
+        y  = 2*_n.linspace(0,10,50)+1 + 0.2*_n.sin(5*x)
+        
+        f = _s.data.fitter(autoplot=False, silent=True).set_functions('a*x+b', 'a,b')
+        f.set_data(x, y, 0.2, exdata=0.3).fit()
+        
+        o = _odr.ODR(_odr.RealData(x, y, sx=0.3*_n.ones(50), sy=0.2*_n.ones(50)), 
+                     _odr.Model(lambda p,x: p[0]*x+p[1]), beta0=[1,1]).run()
+        r = f.get_fit_results()
+        self.assertAlmostEqual(r['a'],     o.beta[0], 6)
+        self.assertAlmostEqual(r['b.std'], o.cov_beta[1][1]**0.5, 6)
+        self.assertAlmostEqual(r['reduced_chi2'], o.res_var, 6)
+        
+        # The ODR data are reused while the data are unchanged
+        d = f._odr_data
+        self.assertIs(f.fit(force=True)._odr_data, d)
+        y += 0.1
+        self.assertIsNot(f.fit()._odr_data, d)
+        r = f.get_fit_results()
+        
+        # The vectorized chi^2 includes the x errors too
+        c = f.chi2_grid(dict(a=[r['a']]), progress=False)
+        self.assertAlmostEqual(c[0], f.chi_squared(), 6)
+        
+        # ODR does not support bounds or the other solvers
+        self.assertRaises(BaseException, f.fit, solver='trf')
+        f.set(solver='leastsq').set_bounds(a=(0,1))
+        self.assertRaises(BaseException, f.fit)
+        f.set_bounds(a=None)
+        
+        # Coarsening and trimming apply to exdata too
+        f.set(coarsen=2, xmax=5)
+        ex = f.get_processed_data(include_exdata=True)[3][0]
+        self.assertEqual(len(ex), len(f.get_processed_data()[0][0]))
+        self.assertAlmostEqual(ex[0], 0.3/2**0.5)
+    
+    def test_fit_async(self):
+        """
+        Background fit with progress reports, results, and cancellation.
+        """
+        x = _n.linspace(0,10,1000)
+        f = _s.data.fitter(autoplot=False, silent=True).set_functions('a*cos(b*x)+c', 'a=2, b=1.1, c').set_data(x, 3*_n.cos(x)+1, 0.1)
+        
+        done     = []
+        progress = []
+        job = f.fit_async(callback=done.append, progress=progress.append, progress_interval=0)
+        self.assertIs(job.wait(), f)
+        self.assertEqual(done, [f])
+        self.assertGreater(len(progress), 0)
+        self.assertTrue(_n.allclose(f.results[0], [3,1,1]))
+        
+        # Settings apply before the data are processed, and the same options
+        # (multistart, cache) as fit() are available
+        f.fit_async(coarsen=4, multistart=50, seed=0).wait()
+        self.assertEqual(len(f._xdata_massaged[0]), 250)
+        self.assertEqual(f.results[2]['multistart'], 50)
+        r = f.results
+        self.assertIs(f.fit_async(multistart=50, seed=0).wait().results, r)
+        f.set(coarsen=1)
+        
+        # Cancel a slow fit; the previous results are left alone
+        import time
+        def slow(x, a, b, c): 
+            time.sleep(0.01)
+            return a*_n.cos(b*x)+c
+        f.set_functions(slow, 'a=2, b=1.1, c').fit()
+        results = f.results
+        job = f.fit_async(force=True)
+        job.cancel()
+        while not job.poll(): time.sleep(0.01)
+        self.assertTrue(job.cancelled)
+        self.assertIs(f.results, results)
+    
+    def test_bounds(self):
+        """
+        Bounded least_squares solvers.
+        """
+        x = _n.linspace(0.1,10,200)
+        f = _s.data.fitter(autoplot=False, silent=True).set_functions('a*sqrt(x-b)', 'a=1, b=2')
+        f.set_data(x, 2*_n.sqrt(x-0.05)+0.01*_n.cos(9*x), 0.01)
+        
+        # The guess is in a NaN region; bounds keep the solvers out of it
+        f.set_bounds(b=(None, 0.1))
+        self.assertRaises(BaseException, f.fit)
+        for solver in ['trf', 'dogbox']:
+            r = f.fit(solver=solver).get_fit_results()
+            self.assertAlmostEqual(r['a'], 2,    3)
+            self.assertAlmostEqual(r['b'], 0.05, 2)
+        
+        # Same errors and chi^2 as leastsq on an unbounded problem
+        f.set_bounds(b=None)
+        f.set_functions('a*x+b', 'a,b').set_data(x, 3*x+1+0.01*_n.sin(5*x), 0.01)
+        r = f.fit(solver='trf', x_scale='jac').get_fit_results()
+        R = f.fit(solver='leastsq').get_fit_results()
+        for k in ['a', 'a.std', 'b.std', 'chi2']: self.assertAlmostEqual(r[k], R[k], 8)
+        
 if __name__ == "__main__":
     _ut.main()
@@ -96,11 +96,221 @@ class Test_functions(_ut.TestCase):
         self.assertAlmostEqual((P[0]*(f[1]-f[0]))**0.5, 1.5)
         self.assertAlmostEqual((P[1]*(f[1]-f[0]))**0.5, 0.5)
         
+    def test_find_peaks(self):
+        
+        y = [0,1,0,2,3,2,0,0,5,5,1]
+        self.assertEqual(_f.find_peaks(y, 0.5), [1,4,8])
+        p, s, i = _f.find_peaks(y, 0.5, True)
+        self.assertEqual(i, [1,3,8])
+        self.assertEqual(list(s[1]), [2,3,2])
+        self.assertEqual(_f.find_peaks(y, 10), [])
+        
+        # Filters
+        self.assertEqual(_f.find_peaks(y, 0.5, prominence=2), [4,8])
+        self.assertEqual(_f.find_peaks(y, 0.5, width=1.5),    [4,8])
+        
+        # N most prominent peaks of a spectrum
+        x = _n.linspace(0,100,100001)
+        y = _n.exp(-(x-20)**2) + 0.5*_n.exp(-(x-40)**2) + 2*_n.exp(-(x-60)**2) + 0.2*_n.exp(-(x-80)**2) + 0.01*_n.cos(x*3)
+        self.assertTrue(_n.allclose(_f.find_N_peaks(y, 3), [20000,40000,60000],        atol=100))
+        self.assertTrue(_n.allclose(_f.find_N_peaks(y, 4), [20000,40000,60000,80000],  atol=100))
+        self.assertIsNone(_f.find_N_peaks([0,1,0], 2))
+    
+    def test_fft_plan(self):
+        
+        self.assertTrue(1001 <= _f.next_fast_length(1001) <= 1024)
+        self.assertEqual(_f._previous_fast_length(1001), 1000)
+        
+        # 1001 points: crop to 1000, or pad
+        t = _n.linspace(0,10,1001)
+        y = _n.cos(7*t) + 1
+        f, Y = _f.fft(t, y, plan='crop', workers=2)
+        self.assertEqual(len(f), 1000)
+        self.assertAlmostEqual(Y[500], _n.average(y[0:1000]))
+        f, Y = _f.fft(t, y, plan='pad')
+        M = _f.next_fast_length(1001)
+        self.assertEqual(len(f), M)
+        self.assertAlmostEqual(Y[M//2], _n.average(y))
+        
+        # PSD integral is still the mean square, windowed or not
+        for window in [None, 'hanning']:
+            f, P = _f.psd(t, y, window=window, rescale=True, plan='pad')
+            self.assertAlmostEqual(sum(P)*(f[1]-f[0]), _n.average(y**2))
+        
+        # The returned frequencies can be modified in place
+        f, Y = _f.fft(t, y)
+        f *= 1e-3
+        self.assertAlmostEqual(_f.fft(t, y)[0][-1], 1e3*f[-1])
+        
+        # Windows needing extra arguments are bad windows too
+        self.assertIsNone(_f.fft(t, y, window='kaiser'))
+        self.assertRaises(ValueError, _f._get_window, 'kaiser', 10)
+            
+    def test_psd_welch(self):
+        
+        import scipy.signal as _signal
+        _n.random.seed(1)
+        t = _n.linspace(0,100,10001)
+        y = _n.random.normal(size=len(t)) + 0.3
+        
+        # Same as scipy's Welch estimate (without detrending), and the same
+        # integral convention as psd()
+        for N in [256, 255]:
+            f, P = _f.psd(t, y, segment=N, overlap=0.5)
+            f2, P2 = _signal.welch(y, 1/(t[1]-t[0]), 'boxcar', N, int(round(0.5*N)), detrend=False)
+            self.assertTrue(_n.allclose(f, f2))
+            self.assertTrue(_n.allclose(P, P2))
+        self.assertAlmostEqual(sum(P)*(f[1]-f[0]), _n.average(y**2), 1)
+        
+        # Windowed, median, and complex
+        f, P = _f.psd(t, y, segment=200, window='hanning', rescale=True, average='median')
+        self.assertEqual(len(f), 101)
+        self.assertAlmostEqual(sum(P)*(f[1]-f[0]), _n.average(y**2), delta=0.15)
+        f, P = _f.psd(t, y*(1+1j), segment=256, workers=2)
+        self.assertAlmostEqual(sum(P)*(f[1]-f[0]), 2*_n.average(y**2), 1)
+        self.assertRaises(ValueError, _f.psd, t, y, segment=256, plan='pad')
+        
+        # One full-length segment is the same as the ordinary psd, also for
+        # complex data with an odd or even number of points
+        z = y + 1j*_n.random.normal(size=len(y))
+        for M in [len(z), len(z)-1]:
+            f,  P  = _f.psd(t[0:M], z[0:M])
+            f2, P2 = _f.psd(t[0:M], z[0:M], segment=M)
+            self.assertTrue(_n.allclose(f, f2))
+            self.assertTrue(_n.allclose(P, P2))
+            self.assertAlmostEqual(sum(P)*(f[1]-f[0]), _n.average(_n.abs(z[0:M])**2))
+    
+    def test_psd_stream(self):
+        
+        _n.random.seed(2)
+        y = _n.random.normal(size=10000)
+        
+        # Chunks of any size give the same as the whole record at once
+        a = _f.psd_stream(1000, 256, 'hanning')
+        for chunk in _n.array_split(y, [3, 500, 501, 4000, 4100]): a.add(chunk)
+        f, P = _f.psd(_n.arange(len(y))/1000, y, segment=256, window='hanning')
+        self.assertTrue(_n.allclose(a.f, f))
+        self.assertTrue(_n.allclose(a.get_psd()[1], P))
+        self.assertEqual(a.N, 77)
+        
+        # Running variance
+        Ps = _f._periodograms(_f._segments(y, 256, 128), _n.hanning(256), dt=1e-3)
+        self.assertTrue(_n.allclose(a.variance_sample, Ps.var(0, ddof=1)))
+        self.assertTrue(_n.allclose(a.variance_mean,   Ps.var(0, ddof=1)/77))
+        
+        a.reset()
+        self.assertEqual(a.N, 0)
+    
     def test_generate_fake_data(self):
         
         # Survival test
         _f.generate_fake_data('cos(x)*3',_n.linspace(-5,5,11),1,2)
     
+    def test_coarsen_array(self):
+        
+        a = [1,2,3,4,5]
+        self.assertEqual(list(_f.coarsen_array(a, 2)), [1.5,3.5])
+        self.assertEqual(list(_f.coarsen_array(a, 2, 'max', tail='partial')), [2,4,5])
+        self.assertEqual(list(_f.coarsen_array(a, 2, 'sum', tail='pad')),     [3,7,10])
+        self.assertEqual(list(_f.coarsen_array(a, 2, 'last')),                [2,4])
+        b = _n.arange(6.0)
+        self.assertFalse(_n.shares_memory(_f.coarsen_array(b, 2, 'first'), b))
+        self.assertEqual(list(_f.coarsen_array(a, 2, 'minimum')),             [1,3])
+        self.assertAlmostEqual(_f.coarsen_array([3,4], 2, 'quadrature')[0], 2.5)
+        self.assertAlmostEqual(_f.coarsen_array([3,4], 2, 'rms')[0], 12.5**0.5)
+        
+        # N-D along an axis, without touching the original
+        Z = _n.arange(12.0).reshape(3,4)
+        self.assertEqual(_f.coarsen_array(Z, 2, axis=1).tolist(), [[0.5,2.5],[4.5,6.5],[8.5,10.5]])
+        self.assertEqual(_f.coarsen_array(Z, 2, 'median', axis=0, tail='partial').tolist(), [[2,3,4,5],[8,9,10,11]])
+        self.assertEqual(Z[0,0], 0)
+    
+    def test_coarsen_matrix(self):
+        
+        Z = _n.arange(35.0).reshape(5,7)
+        
+        # Same as coarsening along each index in turn
+        C = _f.coarsen_matrix(Z, 2, 3)
+        self.assertEqual(C.tolist(), _f.coarsen_array(_f.coarsen_array(Z, 2, axis=0), 3, axis=1).tolist())
+        self.assertEqual(_f.coarsen_matrix(Z, 0, 3, 'max').tolist(), _f.coarsen_array(Z, 3, 'max', axis=1).tolist())
+        
+        # Partial edge blocks
+        C = _f.coarsen_matrix(Z, 2, 3, 'sum', tail='partial')
+        self.assertEqual(C.shape, (3,3))
+        self.assertEqual(C.sum(), Z.sum())
+        self.assertEqual(C[2,2], 34)
+        self.assertEqual(_f.coarsen_matrix(Z, 2, 3, 'first', tail='pad')[2].tolist(), [28,31,34])
+    
+    def test_smooth_array(self):
+        
+        # Same as the nearest-neighbor average, including the ends
+        a = _n.random.normal(size=50)
+        b = _f.smooth_array(a, 3)
+        for n in [0,2,10,49]: self.assertAlmostEqual(b[n], _f.smooth(a, n, 3))
+        self.assertEqual(list(_f.smooth_array([1,2,3], 1)), [1.5,2,2.5])
+        
+        # Along an axis, in place
+        Z = _n.array([a, 2*a])
+        _f.smooth_array(Z, 3, axis=1, in_place=True)
+        self.assertTrue(_n.allclose(Z[1], 2*b))
+        
+        # Other kernels leave straight lines alone
+        x = _n.linspace(0,1,30)
+        for method in ['gaussian', 'savgol', 'median']:
+            y = _f.smooth_array(x, 2, method)
+            self.assertTrue(_n.allclose(y[10:-10], x[10:-10]))
+        
+        # Spikes
+        self.assertEqual(list(_f.smooth_array([0,0,9,0,0], 1, 'median')), [0,0,0,0,0])
+    
+    def test_calculus(self):
+        
+        # Non-uniform spacing
+        x = _n.sort(_n.random.uniform(0,10,100))
+        y = x**2
+        
+        xd, dy = _f.derivative(x, y)
+        self.assertEqual(len(xd), 98)
+        self.assertTrue(_n.allclose(dy, x[2:]+x[:-2]))
+        
+        # Same as fitting each (truncated) window
+        xd, dy = _f.derivative_fit(x, y, 3)
+        for n in [0, 1, 50, 99]:
+            i = slice(max(0,n-3), n+4)
+            self.assertAlmostEqual(dy[n], _f.fit_linear(x[i], y[i])[0])
+            self.assertAlmostEqual(xd[n], _n.mean(x[i]))
+        
+        # Trapezoid integral
+        xi, yi = _f.integrate_data(x, 2*x, xmin=1)
+        self.assertTrue(_n.allclose(yi, xi**2-xi[0]**2))
+        self.assertEqual(xi[0], x[x>=1][0])
+    
+    def test_interpolate(self):
+        
+        x = [0,1,2,4]
+        y = [0,10,20,0]
+        self.assertEqual(_f.interpolate(x, y, 1.5), 15)
+        self.assertEqual(_f.interpolate(x, y, 4),    0)
+        self.assertIsNone(_f.interpolate(x, y, 5))
+        self.assertEqual(_f.interpolate(x, y, 5, rigid_limits=False), 0)
+        
+        # Arrays, decreasing and non-monotonic x, and matrices
+        a = _f.interpolate(x, y, [-1, 0.5, 3, 5])
+        self.assertTrue(_n.isnan(a[0]) and _n.isnan(a[3]))
+        self.assertEqual(list(a[1:3]), [5,10])
+        self.assertEqual(list(_f.interpolate(x[::-1], y[::-1], [0.5, 3])), [5,10])
+        self.assertEqual(list(_f.interpolate([0,2,1], [0,2,4], [0.5, 1.5])), [0.5,1.5])
+        Z = _n.array([[0,1],[2,3],[4,5],[6,7]])
+        self.assertEqual(_f.interpolate(x, Z, 0.5).tolist(), [1,2])
+        self.assertEqual(_f.interpolate(x, Z, [0.5, 3]).tolist(), [[1,2],[5,6]])
+        
+        # Remapping a matrix
+        Z = _n.outer(_n.linspace(0,1,11), _n.ones(4))
+        new_Z, new_X = _f.distort_matrix_X(Z, _n.linspace(0,1,11), lambda x: x**2, 0, 1)
+        self.assertTrue(_n.allclose(new_Z[:,2], new_X**2, atol=1e-3))
+        new_Z, new_Y = _f.distort_matrix_Y(Z.transpose(), _n.linspace(0,1,11), lambda x: x**2, 0, 1)
+        self.assertTrue(_n.allclose(new_Z[2], new_Y**2, atol=1e-3))
+    
     def test_coarsen_data(self):
         
         # Simple coarsen
@@ -134,6 +344,18 @@ class Test_functions(_ut.TestCase):
         self.assertEqual(_n.shape(a), (4,16))
         self.assertAlmostEqual(a[3][5], 2.1213203435596424)
         
+        # Multiple y rows in one pass, linear and exponential
+        x  = _n.linspace(0,100,100)
+        ys = [_n.linspace(100,0,100), _n.linspace(0,1,100)**2]
+        for exponential, level in [(False, 3), (True, 1.3)]:
+            eys = [_n.ones(100), 2]
+            a = sm.fun.coarsen_data(x, ys, eys, 0.5, level=level, exponential=exponential)
+            for n in range(2):
+                b = sm.fun.coarsen_data(x, ys[n], eys[n], 0.5, level=level, exponential=exponential)
+                self.assertTrue(_n.allclose(a[1][n], b[1]))
+                self.assertTrue(_n.allclose(a[2][n], b[2]))
+                self.assertTrue(_n.allclose(a[3],    b[3]))
+        
     def test_averager_normal(self):
         
         import spinmob as sm
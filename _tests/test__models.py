@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Module for testing _models.py
+"""
+import numpy   as _n
+import spinmob as _s
+_m = _s.models
+
+import unittest as _ut
+
+
+class Test_models(_ut.TestCase):
+    """
+    Test class for models.
+    """
+
+    def setUp(self):    return
+    def tearDown(self): return
+    
+    def test_jacobians(self):
+        
+        # Analytic vs finite-difference Jacobians
+        x = _n.linspace(-10,10,201)
+        for m, p in [(_m.lorentzian,  [2,1,0.5]), 
+                     (_m.gaussian,    [2,1,0.5]), 
+                     (_m.voigt,       [2,1,0.5,0.3]), 
+                     (_m.damped_sine, [2,0.3,0.4,5]),
+                     (_m.exponential, [2,3]),
+                     (_m.lorentzian*_m.exponential-_m.linear, [2,1,0.5,1,20,0.1,1])]:
+            self.assertTrue(m.has_jacobian())
+            n = _m.model('numeric', m.get_pnames(), m._function)
+            self.assertTrue(_n.allclose(m.jacobian(x,*p), n.jacobian(x,*p), atol=1e-6))
+    
+    def test_composition(self):
+        
+        # Name clashes, string functions, and sharing parameters
+        m = _m.lorentzian + _m.lorentzian + 'c*x**2'
+        self.assertEqual(m.get_pnames(), ['A', 'x0', 'gamma', 'A_2', 'x0_2', 'gamma_2', 'c'])
+        self.assertFalse(m.has_jacobian())
+        self.assertAlmostEqual(m(2.0, 1,0,1, 2,2,1, 3), 0.2+2+12)
+        
+        m = (_m.lorentzian + _m.lorentzian).rename(gamma_2='gamma')
+        self.assertEqual(m.get_pnames(), ['A', 'x0', 'gamma', 'A_2', 'x0_2'])
+        
+        # Guess heuristics
+        x = _n.linspace(-10,10,2001)
+        g = _m.gaussian.guess(x, _m.gaussian(x, 2, 1, 0.5))
+        self.assertTrue(_n.allclose(g, [2, 1, 0.5], rtol=1e-3))
+    
+    def test_fit(self):
+        
+        # Fit with a model and its analytic Jacobian, compared with strings
+        x = _n.linspace(-10,10,2001)
+        y = _m.lorentzian(x, 3, 1.2, 0.7) + 0.1*x + 2 + 0.05*_n.cos(13*x)
+        
+        f = _s.data.fitter(autoplot=False, silent=True).set_functions(_m.lorentzian+_m.linear)
+        f.set_data(x, y, 0.05).autoguess().fit()
+        
+        g = _s.data.fitter(autoplot=False, silent=True).set_functions('A/(1+((x-x0)/gamma)**2)+m*x+b', 'A,x0,gamma,m,b')
+        g.set_data(x, y, 0.05).fit(A=f['A'], x0=f['x0'], gamma=f['gamma'], m=f['m'], b=f['b'])
+        
+        self.assertEqual(f.get_pnames(), g.get_pnames())
+        self.assertTrue(_n.allclose(f.results[0], g.results[0]))
+        self.assertTrue(_n.allclose(f.results[1], g.results[1], rtol=1e-4))
+        self.assertLess(f.results[2]['nfev'], g.results[2]['nfev'])
+        
+        # From the same start, the analytic Jacobian needs no more function
+        # evaluations than finite differences, for either solver, and the 
+        # solvers' counts agree with the profile
+        for solver in ['leastsq', 'trf']:
+            calls = []
+            for h in [f, g]:
+                h.set(solver=solver, profile=True, A=2, x0=1, gamma=1, m=0, b=1).reset_profile()
+                h.fit(force=True)
+                calls.append(h.get_profile()['residual_calls'])
+                self.assertEqual(h.get_profile()['jacobian_evaluations'], h.results[2].get('njev', 0))
+                
+                # leastsq validates the function with an uncounted call, and
+                # least_squares doesn't count finite-difference evaluations
+                if h is f and solver == 'trf': self.assertEqual(calls[-1], h.results[2]['nfev'])
+                else:                          self.assertGreaterEqual(calls[-1], h.results[2]['nfev'])
+            self.assertLessEqual(calls[0], calls[1])
+            self.assertTrue(_n.allclose(f.results[0], g.results[0], rtol=1e-5))
+
+
+if __name__ == "__main__": _ut.main()